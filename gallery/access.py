@@ -0,0 +1,101 @@
+""" Lookup of the galleries that permissions are checked against.
+
+Checking who can list or add photos of a gallery only needs its owner and
+visibility, so galleries are loaded with these fields only, once per request:
+permissions, views and serializers of a request share the galleries resolved
+by resolve_gallery, and lists resolve the galleries of all their photos at once
+with resolve_galleries.
+
+With GALLERY_ACCESS_CACHE_TIMEOUT set, the fields are also kept that many
+seconds in the django cache across requests, and dropped from it whenever the
+gallery is saved or deleted (see gallery.signals). Updates done with
+QuerySet.update() don't send signals, so they can be seen up to the timeout late.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Gallery
+
+ACCESS_FIELDS = ("id", "user_id", "public")
+
+
+def get_cache_timeout():
+    return getattr(settings, "GALLERY_ACCESS_CACHE_TIMEOUT", 0)
+
+
+def cache_key(gallery_id):
+    return "gallery:access:%s" % gallery_id
+
+
+def fetch_gallery(gallery_id):
+    """ Gallery of gallery_id with only ACCESS_FIELDS loaded, None if missing. """
+    timeout = get_cache_timeout()
+    values = cache.get(cache_key(gallery_id)) if timeout else None
+    if values is None:
+        values = (
+            Gallery.objects.filter(pk=gallery_id).values_list(*ACCESS_FIELDS).first()
+        )
+        if values is None:
+            return None
+        if timeout:
+            cache.set(cache_key(gallery_id), values, timeout)
+    return Gallery.from_db(DEFAULT_DB_ALIAS, ACCESS_FIELDS, values)
+
+
+def fetch_galleries(gallery_ids):
+    """ fetch_gallery of many galleries with one query, by id. Missing galleries
+        are left out.
+    """
+    timeout = get_cache_timeout()
+    rows = {}
+    if timeout:
+        cached = cache.get_many([cache_key(pk) for pk in gallery_ids])
+        rows = {values[0]: values for values in cached.values()}
+    missing = [pk for pk in gallery_ids if pk not in rows]
+    if missing:
+        fetched = {
+            values[0]: values
+            for values in Gallery.objects.filter(pk__in=missing).values_list(
+                *ACCESS_FIELDS
+            )
+        }
+        if timeout and fetched:
+            cache.set_many(
+                {cache_key(pk): values for pk, values in fetched.items()}, timeout
+            )
+        rows.update(fetched)
+    return {
+        pk: Gallery.from_db(DEFAULT_DB_ALIAS, ACCESS_FIELDS, values)
+        for pk, values in rows.items()
+    }
+
+
+def invalidate(gallery_id):
+    if get_cache_timeout():
+        cache.delete(cache_key(gallery_id))
+
+
+def resolve_gallery(request, gallery_id):
+    """ fetch_gallery, remembered for the rest of the request. """
+    try:
+        gallery_id = int(gallery_id)
+    except (TypeError, ValueError):
+        return None
+    galleries = request.__dict__.setdefault("_resolved_galleries", {})
+    if gallery_id not in galleries:
+        galleries[gallery_id] = fetch_gallery(gallery_id)
+    return galleries[gallery_id]
+
+
+def resolve_galleries(request, gallery_ids):
+    """ resolve_gallery of many galleries, the ones the request didn't resolve
+        yet are fetched with fetch_galleries.
+    """
+    galleries = request.__dict__.setdefault("_resolved_galleries", {})
+    missing = [pk for pk in set(gallery_ids) if pk not in galleries]
+    if missing:
+        fetched = fetch_galleries(missing)
+        for pk in missing:
+            galleries[pk] = fetched.get(pk)
+    return {pk: galleries[pk] for pk in gallery_ids}
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import time
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from gallery import likes, response_cache
+
+
+class CachedListMixin:
+    """ Cache the serialized data of list responses in gallery.response_cache
+        under cache_namespace, per url (so per page or cursor), for views whose
+        response doesn't depend on the request user, but for liked_by_me.
+        The cached data is shared by all users, liked_by_me is filled in for the
+        request user after it is read from the cache, with one query.
+        Responses carry an ETag of the shared data and of which of its objects
+        the request user liked, and vary on the credentials, so a user never
+        gets a 304 for the liked_by_me of another. A request whose If-None-Match
+        has it gets an empty 304 response, served from the cache with only the
+        liked_by_me query once the page is cached.
+    """
+
+    cache_namespace = None
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # liked_by_me is set per user once the data is cached, see add_liked_by_me
+        context["liked_ids"] = frozenset()
+        return context
+
+    def get_liked_ids(self, data):
+        """ Ids of the objects of the cached data liked by the request user, None
+            if the data has no liked_by_me.
+        """
+        items = data["results"] if isinstance(data, dict) else data
+        if not items or "liked_by_me" not in items[0]:
+            return None
+        return likes.liked_ids(
+            self.get_queryset().model,
+            self.request.user,
+            [item["id"] for item in items],
+        )
+
+    def add_liked_by_me(self, data, liked_ids):
+        """ Copy of the cached data with liked_by_me of the request user. """
+        if liked_ids is None:
+            return data
+        paginated = isinstance(data, dict)
+        items = data["results"] if paginated else data
+        items = [dict(item, liked_by_me=item["id"] in liked_ids) for item in items]
+        return dict(data, results=items) if paginated else items
+
+    def list(self, request, *args, **kwargs):
+        key = response_cache.entry_key(
+            self.cache_namespace, request.build_absolute_uri()
+        )
+        cached = response_cache.lookup(key)
+        if cached is None:
+            read_at = time.time()
+            response = super().list(request, *args, **kwargs)
+            content = json.dumps(response.data, cls=encoders.JSONEncoder).encode()
+            # a plain copy, so the cache doesn't hold on to the serializer
+            data = json.loads(content)
+            digest = hashlib.md5(content).hexdigest()
+            items = data["results"] if isinstance(data, dict) else data
+            response_cache.store(
+                key,
+                data,
+                digest,
+                self.cache_namespace,
+                [item["id"] for item in items],
+                read_at,
+            )
+        else:
+            data, digest = cached
+
+        liked_ids = self.get_liked_ids(data)
+        if liked_ids is not None:
+            liked = ",".join(str(pk) for pk in sorted(liked_ids))
+            digest = hashlib.md5(("%s:%s" % (digest, liked)).encode()).hexdigest()
+        etag = quote_etag(digest)
+        if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(self.add_liked_by_me(data, liked_ids))
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Cookie", "Authorization"))
+        return response
+
+
+class ConditionalRetrieveMixin:
+    """ Add validators derived from the updated_at field to retrieve responses:
+        a strong ETag made of the object id, updated_at and, when the object has
+        liked_by_me, whether the request user liked it, and Last-Modified.
+        Responses vary on the credentials, since liked_by_me is per user.
+        A request with If-None-Match or If-Modified-Since is first checked with
+        a query of the fields of conditional_fields only (and one of the likes
+        of the request user), and gets an empty 304 response if the object
+        didn't change and can_view_metadata allows it.
+    """
+
+    conditional_fields = ("updated_at",)
+
+    def can_view_metadata(self, metadata):
+        """ Whether the request user may know the object didn't change, given the
+            values of conditional_fields.
+        """
+        return True
+
+    def is_liked(self, pk):
+        """ Whether the request user liked the object, None if it isn't listed
+            with liked_by_me.
+        """
+        if "liked_by_me" not in self.get_serializer().fields:
+            return None
+        model = self.get_queryset().model
+        return bool(likes.liked_ids(model, self.request.user, [pk]))
+
+    def get_validators(self, pk, updated_at, liked):
+        etag = "%s-%d" % (pk, updated_at.timestamp() * 1000000)
+        if liked is not None:
+            etag += "-liked" if liked else "-unliked"
+        return quote_etag(etag), int(updated_at.timestamp())
+
+    def set_validators(self, response, pk, updated_at, liked):
+        etag, last_modified = self.get_validators(pk, updated_at, liked)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, ("Cookie", "Authorization"))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if (
+            "HTTP_IF_NONE_MATCH" in request.META
+            or "HTTP_IF_MODIFIED_SINCE" in request.META
+        ):
+            metadata = (
+                self.get_queryset()
+                .filter(**{self.lookup_field: lookup})
+                .values(*self.conditional_fields)
+                .first()
+            )
+            if metadata is not None and self.can_view_metadata(metadata):
+                liked = self.is_liked(lookup)
+                etag, last_modified = self.get_validators(
+                    lookup, metadata["updated_at"], liked
+                )
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified
+                )
+                if response is not None:
+                    return self.set_validators(
+                        response, lookup, metadata["updated_at"], liked
+                    )
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        response = Response(data)
+        return self.set_validators(
+            response, instance.pk, instance.updated_at, data.get("liked_by_me")
+        )
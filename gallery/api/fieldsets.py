@@ -0,0 +1,109 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+from gallery.api.serializers import LikedByMeField
+
+
+def get_extra_columns(field):
+    """ Columns a serializer field reads besides its source, for nested
+        serializers the ones of their fields.
+    """
+    field = getattr(field, "child", field)
+    if isinstance(field, serializers.BaseSerializer):
+        return [
+            column
+            for nested in field.fields.values()
+            for column in getattr(nested, "extra_columns", [])
+        ]
+    return getattr(field, "extra_columns", [])
+
+
+class SparseFieldsetMixin:
+    """ Let clients of a list view choose the fields of the listed objects with
+        ?fields=<name>,<name> or list all fields but some with ?omit=<name>,...
+        id is always listed. The serializer must have SelectableFieldsMixin.
+        Only the columns of the chosen fields are read (with only()) and only the
+        related objects of chosen fields are prefetched. When every chosen field
+        is read from a column or an annotation, or is liked_by_me, the objects
+        are read as dicts with values() and serialized without model instances.
+    """
+
+    fields_param = "fields"
+    omit_param = "omit"
+
+    def parse_field_names(self, param, known):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        names = {name.strip() for name in value.split(",") if name.strip()}
+        unknown = names - set(known)
+        if unknown:
+            raise ValidationError(
+                {param: "Unknown fields: %s." % ", ".join(sorted(unknown))}
+            )
+        return names
+
+    def get_selected_fields(self):
+        """ Names of the fields to serialize, None for all of them. """
+        if not hasattr(self, "_selected_fields"):
+            self._selected_fields = None
+            if self.request.method in SAFE_METHODS:
+                known = list(self.get_serializer_class()().fields)
+                fields = self.parse_field_names(self.fields_param, known)
+                omit = self.parse_field_names(self.omit_param, known)
+                if fields is not None or omit is not None:
+                    selected = set(known) if fields is None else fields
+                    selected = (selected - (omit or set())) | {"id"}
+                    self._selected_fields = frozenset(selected)
+        return self._selected_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        selected = self.get_selected_fields()
+        if selected is not None:
+            context["fields"] = selected
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.get_selected_fields() is None or not isinstance(queryset, QuerySet):
+            return queryset
+        model = queryset.model
+        annotations = set(queryset.query.annotations) | set(queryset.query.extra)
+        columns, selected_annotations, related = [model._meta.pk.name], [], set()
+        as_rows = True
+        for field in self.get_serializer().fields.values():
+            if isinstance(field, LikedByMeField):
+                continue
+            if field.source in annotations:
+                selected_annotations.append(field.source)
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                # a property or method, whose columns aren't known
+                return queryset
+            columns += get_extra_columns(field)
+            if model_field.concrete and not model_field.many_to_many:
+                columns.append(field.source)
+                as_rows = as_rows and not isinstance(field, serializers.FileField)
+            else:
+                related.add(field.source)
+                as_rows = False
+
+        lookups = [
+            lookup
+            for lookup in queryset._prefetch_related_lookups
+            if getattr(lookup, "prefetch_to", lookup).split(LOOKUP_SEP)[0] in related
+        ]
+        queryset = queryset.prefetch_related(None).prefetch_related(*lookups)
+        ordering = queryset.query.order_by
+        if not as_rows or not all(isinstance(term, str) for term in ordering):
+            return queryset.only(*columns)
+        # pagination reads the position of rows from their ordering fields
+        names = columns + selected_annotations + [term.lstrip("-") for term in ordering]
+        return queryset.values(*dict.fromkeys(names))
@@ -0,0 +1,74 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+
+class IdCursorPagination(CursorPagination):
+    """ Keyset pagination by id, a page costs the same no matter how deep it is
+        and no total count is computed.
+    """
+
+    ordering = "id"
+
+
+class OrderedCursorPagination(CursorPagination):
+    """ Keyset pagination by the ordering the view chose with get_ordering(),
+        ending with id so photos of the same position keep their order.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        return view.get_ordering()
+
+
+class TrendingCursorPagination(CursorPagination):
+    """ Keyset pagination over the trending score index, photos of the same
+        score in the order of the index.
+    """
+
+    ordering = ("-trending_score", "trending__photo")
+
+
+class LikedCursorPagination(CursorPagination):
+    """ Keyset pagination over the (user, created_at) index of likes, likes of
+        the same time in the order of their id, which the index ends with.
+    """
+
+    ordering = ("-liked_at", "-like_id")
+
+
+class SelectablePaginationMixin:
+    """ Let clients choose how a list view is paginated with ?pagination=<mode>,
+        default_pagination is used when no mode is given.
+        Following a cursor link always uses cursor pagination.
+        Querysets should be ordered the same way the cursor pagination orders them
+        so that both modes list objects in the same order.
+    """
+
+    pagination_param = "pagination"
+    pagination_classes = {
+        "page": api_settings.DEFAULT_PAGINATION_CLASS,
+        "cursor": IdCursorPagination,
+    }
+    default_pagination = "page"
+
+    def get_pagination_mode(self):
+        if CursorPagination.cursor_query_param in self.request.query_params:
+            return "cursor"
+        mode = self.request.query_params.get(
+            self.pagination_param, self.default_pagination
+        )
+        if mode not in self.pagination_classes:
+            raise ValidationError(
+                {
+                    self.pagination_param: "Choose one of: %s."
+                    % ", ".join(self.pagination_classes)
+                }
+            )
+        return mode
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            pagination_class = self.pagination_classes[self.get_pagination_mode()]
+            self._paginator = pagination_class()
+        return self._paginator
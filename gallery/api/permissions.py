@@ -1,7 +1,15 @@
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 from rest_framework import permissions
 
-from gallery.models import Gallery
+from gallery.access import resolve_gallery
+
+
+def get_view_gallery(request, view):
+    """ Gallery of the gallery_id of the view url, fetched once per request. """
+    gallery = resolve_gallery(request, view.kwargs.get("gallery_id"))
+    if gallery is None:
+        raise Http404
+    return gallery
 
 
 class CanViewGallery(permissions.BasePermission):
@@ -27,10 +35,10 @@ class CanListGalleryPhotos(permissions.BasePermission):
     message = "This gallery is private"
 
     def has_permission(self, request, view):
-        gallery = get_object_or_404(Gallery, pk=view.kwargs.get("gallery_id"))
+        gallery = get_view_gallery(request, view)
         if request.method != "GET" or gallery.public:
             return True
-        return gallery.user == request.user
+        return gallery.user_id == request.user.id
 
 
 class CanCreateGalleryPhoto(permissions.BasePermission):
@@ -43,5 +51,4 @@ class CanCreateGalleryPhoto(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method != "POST":
             return True
-        gallery = get_object_or_404(Gallery, pk=view.kwargs.get("gallery_id"))
-        return gallery.user == request.user
+        return get_view_gallery(request, view).user_id == request.user.id
@@ -1,45 +1,378 @@
+import time
+from collections import OrderedDict
+
 from django.contrib.auth import get_user_model
+from django.db import models
 from rest_framework import serializers
 
-from gallery.models import Gallery, Photo
+from gallery import likes, media, search, similarity, uploads
+from gallery.access import resolve_galleries, resolve_gallery
+from gallery.models import Gallery, Photo, PhotoRendition, PhotoUpload
 
 User = get_user_model()
 
 
-class GallerySerializer(serializers.ModelSerializer):
-    likes_count = serializers.IntegerField(read_only=True)
+def get_pk(obj):
+    # objects are dicts when serialized from rows, see SelectableFieldsMixin
+    return obj["id"] if isinstance(obj, dict) else obj.pk
+
+
+class LikedByMeField(serializers.ReadOnlyField):
+    """ Whether the request user liked the object.
+        Read from the "liked_ids" set of the context when given (see
+        LikedByMeListSerializer), with a query of its own otherwise.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        liked_ids = self.context.get("liked_ids")
+        if liked_ids is None:
+            request = self.context.get("request")
+            if request is None:
+                return False
+            liked_ids = likes.liked_ids(type(obj), request.user, [obj.pk])
+        return get_pk(obj) in liked_ids
+
+
+class MeasuredDataMixin:
+    """ Add the time spent serializing data to the request, when its metrics
+        are recorded (see gallery.middleware). DRF views serialize their
+        response data before it is rendered, so it isn't part of the render
+        time. Nested serializers are serialized with to_representation, only
+        the outermost one is timed.
+    """
+
+    @property
+    def data(self):
+        request = self.context.get("request")
+        # the django request, DRF requests don't pass attributes set on them
+        request = getattr(request, "_request", request)
+        if not hasattr(request, "_metrics_serialize_time"):
+            return super().data
+        start = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            request._metrics_serialize_time += time.perf_counter() - start
+
+
+class SelectableFieldsMixin:
+    """ Serializer of only the fields named by the "fields" set of the context,
+        all of them when there is none (see gallery.api.fieldsets).
+        It also serializes dicts of queryset.values() rows, keyed by the sources
+        of its fields, when they are all read from columns or annotations (or
+        are liked_by_me), which skips making model instances.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get("fields")
+        if selected is not None:
+            for name in list(fields):
+                if name not in selected:
+                    del fields[name]
+        return fields
+
+    def to_representation(self, instance):
+        if not isinstance(instance, dict):
+            return super().to_representation(instance)
+        data = OrderedDict()
+        for field in self._readable_fields:
+            if isinstance(field, LikedByMeField):
+                data[field.field_name] = field.to_representation(instance)
+                continue
+            value = instance[field.source]
+            if value is not None and not isinstance(field, serializers.RelatedField):
+                # related fields are read as the id they represent
+                value = field.to_representation(value)
+            data[field.field_name] = value
+        return data
+
+
+class LikedByMeListSerializer(MeasuredDataMixin, serializers.ListSerializer):
+    """ List of objects with a liked_by_me field, which of them the request user
+        liked is read with one query for the whole list.
+    """
+
+    def to_representation(self, data):
+        objects = list(data.all() if isinstance(data, models.Manager) else data)
+        request = self.context.get("request")
+        if (
+            "liked_ids" not in self.context
+            and request is not None
+            and "liked_by_me" in self.child.fields
+        ):
+            self.context["liked_ids"] = likes.liked_ids(
+                self.child.Meta.model, request.user, [get_pk(obj) for obj in objects]
+            )
+        return super().to_representation(objects)
+
+
+class GallerySerializer(
+    MeasuredDataMixin, SelectableFieldsMixin, serializers.ModelSerializer
+):
+    liked_by_me = LikedByMeField()
 
     class Meta:
         model = Gallery
-        fields = ["id", "user", "name", "likes_count", "public"]
-        read_only_fields = ["user"]
+        fields = ["id", "user", "name", "likes_count", "public", "liked_by_me"]
+        read_only_fields = ["user", "likes_count"]
+        list_serializer_class = LikedByMeListSerializer
+
+
+class LikedGallerySerializer(GallerySerializer):
+    """ A gallery with when the request user liked it. """
+
+    liked_at = serializers.DateTimeField(read_only=True)
+
+    class Meta(GallerySerializer.Meta):
+        fields = GallerySerializer.Meta.fields + ["liked_at"]
+
+
+class MediaField(serializers.ImageField):
+    """ Image of a photo or of one of its renditions, with a signed URL (see
+        gallery.media) if the photo is in a private gallery. The gallery comes
+        from the ones the request resolved (see gallery.access).
+    """
+
+    # columns of the photo it reads besides its own, also for the images of
+    # renditions, whose photo is the listed one (see gallery.api.fieldsets)
+    extra_columns = ["gallery"]
 
+    def to_representation(self, value):
+        if not value:
+            return None
+        # renditions have the photo they belong to, cached when loaded from it
+        photo = getattr(value.instance, "photo", value.instance)
+        request = self.context.get("request")
+        if request is None:
+            gallery = photo.gallery
+        else:
+            gallery = resolve_gallery(request, photo.gallery_id)
+        if gallery is not None and gallery.public:
+            return super().to_representation(value)
+        url = media.signed_url(value.name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class PhotoRenditionSerializer(serializers.ModelSerializer):
+    image = MediaField(read_only=True)
 
-class GalleryLikeSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Gallery
-        fields = ["number_of_likes"]
+        model = PhotoRendition
+        fields = ["name", "format", "image", "width", "height"]
+
+
+class GalleryField(serializers.PrimaryKeyRelatedField):
+    """ Gallery given by id, shared with the galleries the permissions of the
+        request already fetched (see gallery.access).
+    """
+
+    def to_internal_value(self, data):
+        request = self.context.get("request")
+        if request is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool) or not str(data).isdigit():
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        gallery = resolve_gallery(request, data)
+        if gallery is None:
+            self.fail("does_not_exist", pk_value=data)
+        return gallery
+
+
+class PhotoListSerializer(LikedByMeListSerializer):
+    """ List of photos whose galleries are resolved with one query, to know which
+        images have signed URLs.
+    """
 
-    def update(self, instance, validated_data):
-        user = self.context["request"].user
-        instance.likes.add(user)
-        return instance
+    def to_representation(self, data):
+        photos = list(data.all() if isinstance(data, models.Manager) else data)
+        request = self.context.get("request")
+        if request is not None and {"image", "renditions"} & set(self.child.fields):
+            resolve_galleries(request, [photo.gallery_id for photo in photos])
+        return super().to_representation(photos)
 
 
-class PhotoSerializer(serializers.ModelSerializer):
-    likes_count = serializers.IntegerField(read_only=True)
+class PhotoSerializer(
+    MeasuredDataMixin, SelectableFieldsMixin, serializers.ModelSerializer
+):
+    gallery = GalleryField(queryset=Gallery.objects.all())
+    image = MediaField()
+    renditions = PhotoRenditionSerializer(many=True, read_only=True)
+    liked_by_me = LikedByMeField()
 
     class Meta:
         model = Photo
-        fields = ["id", "title", "description", "image", "gallery", "likes_count"]
+        fields = [
+            "id",
+            "title",
+            "description",
+            "image",
+            "gallery",
+            "likes_count",
+            "processing_status",
+            "renditions",
+            "liked_by_me",
+            "taken_at",
+            "width",
+            "height",
+            "orientation",
+            "camera_model",
+            "latitude",
+            "longitude",
+        ]
+        read_only_fields = ["likes_count", "processing_status"]
+        list_serializer_class = PhotoListSerializer
 
 
-class PhotoLikeSerializer(serializers.ModelSerializer):
+class LikedPhotoSerializer(PhotoSerializer):
+    """ A photo with when the request user liked it. """
+
+    liked_at = serializers.DateTimeField(read_only=True)
+
+    class Meta(PhotoSerializer.Meta):
+        fields = PhotoSerializer.Meta.fields + ["liked_at"]
+
+
+class BulkPhotoSerializer(serializers.ModelSerializer):
+    """ Title and description of a photo of a bulk upload, its image is checked
+        by gallery.bulk_uploads.
+    """
+
     class Meta:
         model = Photo
-        fields = ["number_of_likes"]
+        fields = ["title", "description"]
+
+
+class SimilarPhotoSerializer(PhotoSerializer):
+    """ A photo with the hamming distance of its perceptual hash to the one of
+        the photo it is similar to (0 for an identical looking image).
+    """
+
+    distance = serializers.IntegerField(read_only=True)
+
+    class Meta(PhotoSerializer.Meta):
+        fields = PhotoSerializer.Meta.fields + ["distance"]
+
+
+class SimilarPhotoQuerySerializer(serializers.Serializer):
+    """ Query parameters of the similar photos search.
+        -scope: search photos of the same gallery or of all public galleries.
+        -distance: maximum number of differing bits of the perceptual hashes.
+    """
+
+    GALLERY = "gallery"
+    PUBLIC = "public"
+
+    scope = serializers.ChoiceField(choices=[GALLERY, PUBLIC], default=GALLERY)
+    distance = serializers.IntegerField(
+        min_value=0,
+        max_value=similarity.MAX_DISTANCE,
+        default=similarity.get_default_distance,
+    )
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class PhotoListQuerySerializer(serializers.Serializer):
+    """ Query parameters filtering and ordering the photos of a gallery by their
+        metadata (see gallery.exif).
+        -taken_after/taken_before: range of the capture time, bounds included.
+        -orientation: landscape, portrait or square.
+        -camera: camera model.
+        -bbox: south,west,north,east bounds in degrees of where photos were taken.
+        -dated: only photos with (true) or without (false) a capture time.
+        -ordering: id or taken_at, descending with a leading "-". Photos without
+         a capture time have no place in the taken_at ordering, so it needs
+         dated=true.
+    """
+
+    ORDERINGS = ["id", "-id", "taken_at", "-taken_at"]
+
+    taken_after = serializers.DateTimeField(required=False)
+    taken_before = serializers.DateTimeField(required=False)
+    orientation = serializers.ChoiceField(
+        choices=[choice for choice, _ in Photo.ORIENTATION_CHOICES], required=False
+    )
+    camera = serializers.CharField(max_length=100, required=False)
+    bbox = serializers.CharField(required=False)
+    dated = serializers.BooleanField(required=False)
+    ordering = serializers.ChoiceField(choices=ORDERINGS, default="id")
+
+    def validate_bbox(self, value):
+        try:
+            south, west, north, east = [float(part) for part in value.split(",")]
+        except ValueError:
+            raise serializers.ValidationError("Expected south,west,north,east.")
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise serializers.ValidationError(
+                "Bounds must be in degrees, south before north and west before east."
+            )
+        return south, west, north, east
+
+    def validate(self, attrs):
+        if attrs["ordering"].lstrip("-") == "taken_at" and not attrs.get("dated"):
+            raise serializers.ValidationError(
+                {"ordering": "Ordering by taken_at needs dated=true."}
+            )
+        return attrs
+
+
+class PhotoSearchQuerySerializer(serializers.Serializer):
+    """ Query parameters of the photo search.
+        -q: words the title and description of the photos must have.
+        -gallery: only search the photos of this gallery.
+    """
+
+    q = serializers.CharField(max_length=200)
+    gallery = serializers.IntegerField(required=False)
+
+    def validate_q(self, value):
+        words = search.query_words(value)
+        if not words:
+            raise serializers.ValidationError("No words to search.")
+        return words
+
+
+class PhotoLikeBatchSerializer(serializers.Serializer):
+    """ Photo ids to like and unlike in one request, liking wins if an id is in both. """
+
+    like = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=500
+    )
+    unlike = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=500
+    )
+
+
+class PhotoUploadSerializer(serializers.ModelSerializer):
+    """ Chunked upload of a photo, size and checksum (SHA-256 hex digest) are
+        the ones of the whole image.
+    """
+
+    class Meta:
+        model = PhotoUpload
+        fields = [
+            "id",
+            "title",
+            "description",
+            "filename",
+            "size",
+            "checksum",
+            "received",
+        ]
+        read_only_fields = ["received"]
+
+    def validate_size(self, value):
+        if not 0 < value <= uploads.get_max_size():
+            raise serializers.ValidationError(
+                "Ensure this value is between 1 and %d." % uploads.get_max_size()
+            )
+        return value
 
-    def update(self, instance, validated_data):
-        user = self.context["request"].user
-        instance.likes.add(user)
-        return instance
+    def validate_checksum(self, value):
+        if len(value) != 64 or value.strip("0123456789abcdefABCDEF"):
+            raise serializers.ValidationError("Not a SHA-256 hex digest.")
+        return value.lower()
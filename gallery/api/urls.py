@@ -20,6 +20,11 @@ urlpatterns = [
         view=views.GalleryLikeApiView.as_view(),
         name="like_gallery",
     ),
+    path(
+        "galleries/liked/",
+        view=views.LikedGalleryListApiView.as_view(),
+        name="list_liked_galleries",
+    ),
     path(
         "galleries/public/",
         view=views.PublicGalleryListApiView.as_view(),
@@ -30,11 +35,47 @@ urlpatterns = [
         view=views.PhotoListCreateApiView.as_view(),
         name="list_create_photos",
     ),
+    path(
+        "galleries/<int:gallery_id>/photos/bulk/",
+        view=views.PhotoBulkCreateApiView.as_view(),
+        name="bulk_create_photos",
+    ),
+    path(
+        "galleries/<int:gallery_id>/photos/<int:pk>/similar/",
+        view=views.SimilarPhotoListApiView.as_view(),
+        name="list_similar_photos",
+    ),
+    path(
+        "galleries/<int:gallery_id>/uploads/",
+        view=views.PhotoUploadCreateApiView.as_view(),
+        name="create_photo_upload",
+    ),
+    path(
+        "uploads/<uuid:pk>/",
+        view=views.PhotoUploadApiView.as_view(),
+        name="photo_upload",
+    ),
+    path(
+        "uploads/<uuid:pk>/finish/",
+        view=views.PhotoUploadFinishApiView.as_view(),
+        name="finish_photo_upload",
+    ),
     path(
         "photos/<int:pk>/like/",
         view=views.PhotoLikeApiView.as_view(),
         name="like_photo",
     ),
+    path(
+        "photos/like/", view=views.PhotoLikeBatchApiView.as_view(), name="like_photos",
+    ),
+    path(
+        "photos/liked/",
+        view=views.LikedPhotoListApiView.as_view(),
+        name="list_liked_photos",
+    ),
+    path(
+        "photos/search/", view=views.PhotoSearchApiView.as_view(), name="search_photos",
+    ),
     path(
         "photos/trending/",
         view=views.TrendingPhotosListApiView.as_view(),
@@ -1,25 +1,61 @@
-from django.db.models import Count
-from rest_framework import generics
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
+from gallery import (
+    bulk_uploads,
+    exif,
+    jobs,
+    likes,
+    response_cache,
+    search,
+    similarity,
+    uploads,
+)
+
+from gallery.api.caching import CachedListMixin, ConditionalRetrieveMixin
+from gallery.api.fieldsets import SparseFieldsetMixin
+from gallery.api.pagination import (
+    LikedCursorPagination,
+    OrderedCursorPagination,
+    SelectablePaginationMixin,
+    TrendingCursorPagination,
+)
 from gallery.api.permissions import (
     CanCreateGalleryPhoto,
     CanListGalleryPhotos,
     CanViewGallery,
+    get_view_gallery,
 )
 from gallery.api.serializers import (
-    GalleryLikeSerializer,
+    BulkPhotoSerializer,
     GallerySerializer,
-    PhotoLikeSerializer,
+    LikedGallerySerializer,
+    LikedPhotoSerializer,
+    PhotoLikeBatchSerializer,
+    PhotoListQuerySerializer,
+    PhotoSearchQuerySerializer,
     PhotoSerializer,
+    PhotoUploadSerializer,
+    SimilarPhotoQuerySerializer,
+    SimilarPhotoSerializer,
 )
-from gallery.models import Gallery, Photo
+from gallery.models import Gallery, Photo, PhotoUpload
 
 
-class GalleryListCreateApiView(generics.ListCreateAPIView):
+class GalleryListCreateApiView(
+    SparseFieldsetMixin, SelectablePaginationMixin, generics.ListCreateAPIView
+):
     """ Create and list galleries """
 
-    queryset = Gallery.objects.annotate(likes_count=Count("likes")).all()
+    queryset = Gallery.objects.order_by("id")
     serializer_class = GallerySerializer
     permission_classes = [IsAuthenticated]
 
@@ -27,76 +63,470 @@ class GalleryListCreateApiView(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class GalleryRetreiveApiView(generics.RetrieveAPIView):
+class GalleryRetreiveApiView(ConditionalRetrieveMixin, generics.RetrieveAPIView):
     """ Get a gallery by id.
         Any user can view public gallaries.
         Only the gallery owner can view it if it is private.
+        Conditional requests are answered from updated_at and whether the
+        request user liked the gallery.
     """
 
-    queryset = Gallery.objects.annotate(likes_count=Count("likes")).all()
+    queryset = Gallery.objects.all()
     serializer_class = GallerySerializer
     permission_classes = [IsAuthenticated, CanViewGallery]
+    conditional_fields = ("updated_at", "user_id", "public")
+
+    def can_view_metadata(self, metadata):
+        return metadata["public"] or metadata["user_id"] == self.request.user.id
 
 
-class GalleryLikeApiView(generics.RetrieveUpdateAPIView):
-    """ Like a gallery given gallery id.
-        Getting the user from the request inside the serializer.
+class LikeApiView(generics.GenericAPIView):
+    """ Get the number of likes (GET), like (PUT/PATCH) or unlike (DELETE) an
+        object of queryset given its id as the request user.
+        Likes are written directly by gallery.likes which returns the new number
+        of likes, so no object is loaded and no likes are counted.
     """
 
+    permission_classes = [IsAuthenticated]
+
+    def likes_response(self, action, *args):
+        try:
+            likes_count = action(self.get_queryset().model, self.kwargs["pk"], *args)
+        except ObjectDoesNotExist:
+            raise Http404
+        return Response({"number_of_likes": likes_count})
+
+    def get(self, request, *args, **kwargs):
+        return self.likes_response(likes.get_likes_count)
+
+    def put(self, request, *args, **kwargs):
+        return self.likes_response(likes.like, request.user)
+
+    def patch(self, request, *args, **kwargs):
+        return self.put(request, *args, **kwargs)
+
+    def delete(self, request, *args, **kwargs):
+        return self.likes_response(likes.unlike, request.user)
+
+
+class GalleryLikeApiView(LikeApiView):
+    """ Like or unlike a gallery given gallery id. """
+
     queryset = Gallery.objects.all()
-    serializer_class = GalleryLikeSerializer
+
+
+class LikedListApiView(SparseFieldsetMixin, generics.ListAPIView):
+    """ List the objects of queryset liked by the request user, last liked first,
+        with when they were liked (liked_at), from the (user, created_at) index of
+        the likes. Objects the user can no longer view aren't listed.
+    """
+
     permission_classes = [IsAuthenticated]
+    pagination_class = LikedCursorPagination
+
+    def get_visible_filter(self):
+        """ Q of the objects the request user can view. """
+        raise NotImplementedError
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        likes = queryset.model.likes.through._meta.model_name
+        return (
+            queryset.filter(**{likes + "__user": self.request.user})
+            .filter(self.get_visible_filter())
+            .annotate(liked_at=F(likes + "__created_at"), like_id=F(likes + "__id"))
+            .order_by("-liked_at", "-like_id")
+        )
+
+
+class LikedGalleryListApiView(LikedListApiView):
+    """ List galleries liked by the request user, last liked first. """
+
+    queryset = Gallery.objects.all()
+    serializer_class = LikedGallerySerializer
+
+    def get_visible_filter(self):
+        return Q(public=True) | Q(user=self.request.user)
 
 
-class PublicGalleryListApiView(generics.ListAPIView):
-    """ List public galleries """
+class PublicGalleryListApiView(
+    CachedListMixin,
+    SparseFieldsetMixin,
+    SelectablePaginationMixin,
+    generics.ListAPIView,
+):
+    """ List public galleries, pages are cached (see gallery.response_cache). """
 
-    queryset = Gallery.objects.annotate(likes_count=Count("likes")).filter(public=True)
+    cache_namespace = response_cache.PUBLIC_GALLERIES
+
+    queryset = Gallery.objects.filter(public=True).order_by("id")
     serializer_class = GallerySerializer
     permission_classes = [IsAuthenticated]
 
 
-class PhotoListCreateApiView(generics.ListCreateAPIView):
+class PhotoListCreateApiView(
+    SparseFieldsetMixin, SelectablePaginationMixin, generics.ListCreateAPIView
+):
     """ List and create photos.
         Any user can list photos of a public gallary.
         Only the gallery owner can list its photos if it is private.
+        Photos can be filtered and ordered by their metadata (see
+        PhotoListQuerySerializer), from indexes starting with the gallery.
     """
 
     serializer_class = PhotoSerializer
     permission_classes = [IsAuthenticated, CanListGalleryPhotos, CanCreateGalleryPhoto]
+    pagination_classes = {
+        "page": SelectablePaginationMixin.pagination_classes["page"],
+        "cursor": OrderedCursorPagination,
+    }
+
+    def get_list_params(self):
+        if not hasattr(self, "_list_params"):
+            # a plain dict, DRF reads booleans missing from a QueryDict as False
+            query = PhotoListQuerySerializer(data=self.request.query_params.dict())
+            query.is_valid(raise_exception=True)
+            self._list_params = query.validated_data
+        return self._list_params
+
+    def get_ordering(self):
+        ordering = self.get_list_params()["ordering"]
+        if ordering.lstrip("-") == "id":
+            return (ordering,)
+        return (ordering, "-id" if ordering.startswith("-") else "id")
 
     def get_queryset(self):
         """
         list all photos related to a gallery given gallery_id
         """
         gallery_id = self.kwargs["gallery_id"]
-        return Photo.objects.annotate(likes_count=Count("likes")).filter(
-            gallery_id=gallery_id
+        params = self.get_list_params()
+        photos = Photo.objects.filter(gallery_id=gallery_id)
+        if "dated" in params:
+            photos = photos.filter(taken_at__isnull=not params["dated"])
+        if "taken_after" in params:
+            photos = photos.filter(taken_at__gte=params["taken_after"])
+        if "taken_before" in params:
+            photos = photos.filter(taken_at__lte=params["taken_before"])
+        if "orientation" in params:
+            photos = photos.filter(orientation=params["orientation"])
+        if "camera" in params:
+            photos = photos.filter(camera_model=params["camera"])
+        if "bbox" in params:
+            photos = exif.within_box(photos, *params["bbox"])
+        return photos.prefetch_related("renditions").order_by(*self.get_ordering())
+
+    def perform_create(self, serializer):
+        """
+        save the uploaded photo to the gallery of the url and leave its processing
+        to the background worker
+        """
+        gallery = get_view_gallery(self.request, self)
+        with transaction.atomic():
+            photo = serializer.save(gallery=gallery, processing_status=Photo.PENDING)
+            jobs.enqueue("process_photo", photo_id=photo.pk)
+
+
+class PhotoBulkCreateApiView(generics.GenericAPIView):
+    """ Create many photos of a gallery from one multipart request: the title,
+        description and image fields are repeated once per photo, in the same
+        order. Only the gallery owner can add photos to it.
+        Every photo is created or rejected on its own, results are given in the
+        order of the photos with the status of each: 201 if all photos were
+        created, 400 if none was, 207 otherwise.
+    """
+
+    serializer_class = PhotoSerializer
+    permission_classes = [IsAuthenticated, CanCreateGalleryPhoto]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        gallery = get_view_gallery(request, self)
+        images = request.FILES.getlist("image")
+        titles = request.data.getlist("title")
+        descriptions = request.data.getlist("description")
+        if not images:
+            raise ValidationError({"image": ["No image was submitted."]})
+        if not len(images) == len(titles) == len(descriptions):
+            raise ValidationError(
+                {"detail": "Every image needs exactly one title and description."}
+            )
+        if len(images) > bulk_uploads.get_max_photos():
+            raise ValidationError(
+                {
+                    "detail": "At most %d photos per request."
+                    % bulk_uploads.get_max_photos()
+                }
+            )
+
+        results = [None] * len(images)
+        items, indexes = [], []
+        for index, (image, title, description) in enumerate(
+            zip(images, titles, descriptions)
+        ):
+            serializer = BulkPhotoSerializer(
+                data={"title": title, "description": description}
+            )
+            if serializer.is_valid():
+                items.append(dict(serializer.validated_data, image=image))
+                indexes.append(index)
+            else:
+                results[index] = {"errors": serializer.errors}
+
+        created = {}
+        for index, (photo, errors) in zip(
+            indexes, bulk_uploads.create_photos(gallery, items)
+        ):
+            if photo is None:
+                results[index] = {"errors": {"image": errors}}
+            else:
+                created[photo.pk] = index
+        photos = Photo.objects.prefetch_related("renditions").in_bulk(list(created))
+        # serialized as one list, so liked_by_me of all photos takes one query
+        serialized = self.get_serializer([photos[pk] for pk in created], many=True).data
+        for index, data in zip(created.values(), serialized):
+            results[index] = {"photo": data}
+
+        for index, result in enumerate(results):
+            result["index"] = index
+            result["status"] = (
+                status.HTTP_201_CREATED
+                if "photo" in result
+                else status.HTTP_400_BAD_REQUEST
+            )
+        if len(created) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+
+class SimilarPhotoListApiView(generics.ListAPIView):
+    """ List photos that look like a photo, closest first.
+        Searches the photo gallery or, with ?scope=public, all public galleries
+        and the photo gallery. Photos that aren't processed yet have no hash.
+    """
+
+    serializer_class = SimilarPhotoSerializer
+    permission_classes = [IsAuthenticated, CanListGalleryPhotos]
+    pagination_class = None
+
+    def get_queryset(self):
+        photo = get_object_or_404(
+            Photo.objects.only("id", "dhash"),
+            pk=self.kwargs["pk"],
+            gallery_id=self.kwargs["gallery_id"],
         )
+        if photo.dhash is None:
+            raise ValidationError({"detail": "This photo isn't processed yet."})
+        query = SimilarPhotoQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        photos = Photo.objects.exclude(pk=photo.pk)
+        if params["scope"] == SimilarPhotoQuerySerializer.PUBLIC:
+            photos = photos.filter(
+                Q(gallery__public=True) | Q(gallery_id=self.kwargs["gallery_id"])
+            )
+        else:
+            photos = photos.filter(gallery_id=self.kwargs["gallery_id"])
+        matches = similarity.similar_photos(
+            photos, similarity.to_unsigned(photo.dhash), params["distance"]
+        )[: params["limit"]]
+
+        distances = dict(matches)
+        similar = Photo.objects.prefetch_related("renditions").in_bulk(distances)
+        for pk, distance in distances.items():
+            similar[pk].distance = distance
+        return [similar[pk] for pk, _ in matches]
 
 
-class PhotoLikeApiView(generics.RetrieveUpdateAPIView):
-    """ Like photo given photo id.
-        Getting the user from the request inside the serializer.
+class PhotoSearchApiView(SparseFieldsetMixin, generics.ListAPIView):
+    """ Search photos by words of their title and description, best match first,
+        among the photos the request user can view (see gallery.search).
+        ?gallery=<id> only searches the photos of a gallery.
     """
 
+    serializer_class = PhotoSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        query = PhotoSearchQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        photos = Photo.objects.filter(
+            Q(gallery__public=True) | Q(gallery__user=self.request.user)
+        )
+        if "gallery" in params:
+            photos = photos.filter(gallery_id=params["gallery"])
+        return search.search(photos, params["q"]).prefetch_related("renditions")
+
+
+class PhotoLikeApiView(LikeApiView):
+    """ Like or unlike a photo given photo id. """
+
     queryset = Photo.objects.all()
-    serializer_class = PhotoLikeSerializer
+
+
+class PhotoLikeBatchApiView(generics.GenericAPIView):
+    """ Like and unlike many photos in one request, e.g. to sync likes done offline.
+        Returns the number of likes and like status of every existing photo given.
+    """
+
+    serializer_class = PhotoLikeBatchSerializer
     permission_classes = [IsAuthenticated]
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = likes.sync_photo_likes(
+            request.user,
+            serializer.validated_data.get("like", []),
+            serializer.validated_data.get("unlike", []),
+        )
+        return Response(
+            {
+                "results": [
+                    {"id": pk, "number_of_likes": likes_count, "liked": liked}
+                    for pk, likes_count, liked in results
+                ]
+            }
+        )
+
+
+class LikedPhotoListApiView(LikedListApiView):
+    """ List photos liked by the request user, last liked first. """
+
+    queryset = Photo.objects.prefetch_related("renditions")
+    serializer_class = LikedPhotoSerializer
 
-class TrendingPhotosListApiView(generics.ListAPIView):
-    """ List Trending Photos based on number of likes of the photos from 
-        public galleries only.
+    def get_visible_filter(self):
+        return Q(gallery__public=True) | Q(gallery__user=self.request.user)
+
+
+class TrendingPhotosListApiView(
+    CachedListMixin,
+    SparseFieldsetMixin,
+    SelectablePaginationMixin,
+    generics.ListAPIView,
+):
+    """ List Trending Photos based on time decayed likes of the photos from 
+        public galleries only, most trending first.
+        Paginated with page numbers by default, ?pagination=cursor uses a cursor.
+        Pages are cached (see gallery.response_cache).
     """
 
+    cache_namespace = response_cache.TRENDING
+
     serializer_class = PhotoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_classes = {
+        "page": SelectablePaginationMixin.pagination_classes["page"],
+        "cursor": TrendingCursorPagination,
+    }
 
     def get_queryset(self):
         """
-        list all photos from public galleries where there number of likes is >= 2
+        list all listed photos of the precomputed trending ranking (see gallery.trending)
         """
-        return Photo.objects.annotate(likes_count=Count("likes")).filter(
-            likes_count__gt=2, gallery__public=True
+        return (
+            Photo.objects.filter(trending__listed=True)
+            .annotate(trending_score=F("trending__score"))
+            .prefetch_related("renditions")
+            # ordered like the trending index, which ends with the photo id
+            .order_by("-trending_score", "trending__photo")
         )
+
+
+class PhotoUploadCreateApiView(generics.CreateAPIView):
+    """ Start a chunked upload of a photo to a gallery.
+        Only the gallery owner can upload photos to it.
+    """
+
+    serializer_class = PhotoUploadSerializer
+    permission_classes = [IsAuthenticated, CanCreateGalleryPhoto]
+
+    def perform_create(self, serializer):
+        gallery = get_view_gallery(self.request, self)
+        serializer.instance = uploads.start_upload(
+            self.request.user, gallery, **serializer.validated_data
+        )
+
+
+class UserUploadApiView(generics.GenericAPIView):
+    """ Base of the views of an upload of the request user. """
+
+    serializer_class = PhotoUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return PhotoUpload.objects.filter(user=self.request.user)
+
+
+class PhotoUploadApiView(UserUploadApiView):
+    """ Get the progress of (GET), send a chunk to (PUT) or cancel (DELETE)
+        an upload of the request user.
+        A chunk is the raw request body, it starts at the offset given by the
+        Content-Range header ("bytes <first>-<last>/<size>") or at the number of
+        bytes received so far. An optional X-Chunk-SHA256 header is checked.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def put(self, request, *args, **kwargs):
+        upload = self.get_object()
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        content_range = request.META.get("HTTP_CONTENT_RANGE")
+        offset = upload.received
+        if content_range:
+            try:
+                unit, spec = content_range.split(" ", 1)
+                first, last = spec.split("/", 1)[0].split("-")
+                offset, length = int(first), int(last) - int(first) + 1
+                if unit != "bytes":
+                    raise ValueError
+            except ValueError:
+                raise ValidationError({"detail": "Invalid Content-Range header."})
+        if length <= 0 or request.stream is None:
+            raise ValidationError({"detail": "Chunk is empty."})
+        try:
+            uploads.append_chunk(
+                upload,
+                offset,
+                request.stream,
+                length,
+                request.META.get("HTTP_X_CHUNK_SHA256"),
+            )
+        except uploads.OffsetMismatch as e:
+            return Response(
+                {"detail": str(e), "received": upload.received},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except uploads.UploadError as e:
+            raise ValidationError({"detail": str(e)})
+        return Response(self.get_serializer(upload).data)
+
+    def delete(self, request, *args, **kwargs):
+        uploads.cancel_upload(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PhotoUploadFinishApiView(UserUploadApiView):
+    """ Finish an upload once all its chunks are received and create its photo.
+        Finishing an upload that another request is finishing or cancelling
+        gets a 409 response.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            photo = uploads.finish_upload(self.get_object())
+        except uploads.UploadGone as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            raise ValidationError({"detail": str(e)})
+        serializer = PhotoSerializer(photo, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
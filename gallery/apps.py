@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class GalleryConfig(AppConfig):
     name = 'gallery'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
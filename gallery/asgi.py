@@ -0,0 +1,56 @@
+""" ASGI handler running views in a bounded pool of threads.
+
+Django 3.0 has no async views or ORM, its ASGIHandler runs every view through
+sync_to_async in the default executor of the event loop. Its request_finished
+signal then closes the database connections of the event loop thread instead of
+the one that ran the view, so connections opened by views are never closed.
+
+GalleryASGIHandler runs views, including the rendering of their response, in its
+own pool of GALLERY_ASGI_THREADS threads, and closes the database connections of
+the thread once the response is ready, like a WSGI server does. Reading requests
+and sending responses stay on the event loop, so slow clients only cost a
+coroutine while a WSGI server ties a thread to each of them, and the number of
+queries run at once (and of database connections) is bounded by the pool.
+
+This module must not import models, it is imported before apps are loaded.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.db import close_old_connections
+
+
+def get_threads():
+    return getattr(settings, "GALLERY_ASGI_THREADS", 16)
+
+
+class GalleryASGIHandler(ASGIHandler):
+    def __init__(self, max_workers=None):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or get_threads(), thread_name_prefix="asgi-view"
+        )
+
+    def get_response_in_thread(self, request):
+        try:
+            return BaseHandler.get_response(self, request)
+        finally:
+            close_old_connections()
+
+    async def get_response(self, request):
+        # a coroutine function, so ASGIHandler awaits it instead of running it
+        # with sync_to_async
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, self.get_response_in_thread, request
+        )
+
+
+def get_asgi_application():
+    """ Same as django.core.asgi.get_asgi_application with GalleryASGIHandler. """
+    django.setup(set_prefix=False)
+    return GalleryASGIHandler()
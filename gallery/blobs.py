@@ -0,0 +1,113 @@
+""" Reference counting and garbage collection of content addressed files.
+
+Every photo and rendition whose file is in blob_storage holds a reference to a
+Blob row, taken when the row is created and released when it is deleted (see
+gallery.signals). Files of blobs without references are deleted by collect,
+after a grace period protecting files that were just saved but whose photo
+isn't committed yet.
+"""
+import os
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Blob, Photo, PhotoRendition
+from .storage import blob_storage
+
+REFERENCING_MODELS = (Photo, PhotoRendition)
+
+
+def change_refcount(names, delta):
+    return Blob.objects.filter(name__in=names).update(
+        refcount=F("refcount") + delta, updated_at=timezone.now()
+    )
+
+
+def count_blobs(names):
+    """ Names of blobs grouped by the number of times they are in names. """
+    counts = Counter(name for name in names if blob_storage.is_blob(name))
+    groups = defaultdict(list)
+    for name, count in counts.items():
+        groups[count].append(name)
+    return groups
+
+
+def acquire(*names):
+    """ Add a reference to the blobs of names, creating the missing Blob rows. """
+    groups = count_blobs(names)
+    if not groups:
+        return
+    all_names = [name for group in groups.values() for name in group]
+    existing = set(
+        Blob.objects.filter(name__in=all_names).values_list("name", flat=True)
+    )
+    # rows created by a concurrent upload of the same content in the meantime
+    # are left as they are, the references are added below
+    Blob.objects.bulk_create(
+        [
+            Blob(name=name, size=blob_storage.size(name))
+            for name in all_names
+            if name not in existing
+        ],
+        ignore_conflicts=True,
+    )
+    for count, group in groups.items():
+        change_refcount(group, count)
+
+
+def release(*names):
+    """ Remove a reference to the blobs of names. """
+    for count, group in count_blobs(names).items():
+        change_refcount(group, -count)
+
+
+def is_referenced(name):
+    return any(
+        model.objects.filter(image=name).exists() for model in REFERENCING_MODELS
+    )
+
+
+def collect(grace=60 * 60):
+    """ Delete files of blobs without references and files without a blob, that
+        weren't used in the last grace seconds. Returns the number of deleted files.
+    """
+    deadline = timezone.now() - timedelta(seconds=grace)
+    deleted = 0
+    for name in Blob.objects.filter(
+        refcount__lte=0, updated_at__lt=deadline
+    ).values_list("name", flat=True):
+        if is_referenced(name):
+            # the count drifted, e.g. photos created with bulk_create
+            Blob.objects.filter(name=name).update(
+                refcount=sum(
+                    model.objects.filter(image=name).count()
+                    for model in REFERENCING_MODELS
+                )
+            )
+            continue
+        if delete_file(name, deadline):
+            deleted += 1
+        Blob.objects.filter(name=name, refcount__lte=0).delete()
+
+    root = blob_storage.path(blob_storage.prefix)
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, blob_storage.location).replace(os.sep, "/")
+            if not Blob.objects.filter(name=name).exists() and not is_referenced(name):
+                deleted += delete_file(name, deadline)
+    return deleted
+
+
+def delete_file(name, deadline):
+    """ Delete the file of name unless it was used after deadline. """
+    try:
+        modified = blob_storage.get_modified_time(name)
+    except FileNotFoundError:
+        return False
+    if modified >= deadline:
+        return False
+    blob_storage.delete(name)
+    return True
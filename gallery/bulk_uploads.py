@@ -0,0 +1,87 @@
+""" Creation of many photos uploaded in one request.
+
+Images are validated (decoded by Pillow, which releases the GIL while it works)
+and written to blob_storage in a pool of threads, then all photos are inserted
+with one bulk INSERT, and their processing jobs with another, in one
+transaction. bulk_create doesn't send signals, so the references to the image
+blobs that gallery.signals takes for single photos are taken here, and the
+photos are added to the search index here.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import blobs, jobs, search, uploads
+from .models import Photo
+
+
+def get_max_photos():
+    """ Maximum number of photos of one bulk upload. """
+    return getattr(settings, "GALLERY_BULK_UPLOAD_MAX_PHOTOS", 100)
+
+
+def get_workers():
+    """ Threads validating and storing the images of one bulk upload. """
+    return getattr(settings, "GALLERY_BULK_UPLOAD_WORKERS", 4)
+
+
+def store_image(gallery, image):
+    """ Validate image (an uploaded file) and store it as the image of a new
+        photo of gallery. Returns the photo and None, or None and error messages.
+    """
+    if image.size > uploads.get_max_size():
+        return None, ["Image is larger than %d bytes." % uploads.get_max_size()]
+    try:
+        forms.ImageField().clean(image)
+    except ValidationError as e:
+        return None, e.messages
+    photo = Photo(gallery=gallery, processing_status=Photo.PENDING)
+    photo.image.save(image.name, image, save=False)
+    return photo, None
+
+
+def insert_photos(gallery, photos):
+    """ bulk_create photos of gallery and make sure they have their id. """
+    Photo.objects.bulk_create(photos)
+    if photos and photos[0].pk is None:
+        # the database doesn't return the ids of rows inserted in bulk (SQLite),
+        # they are the last photos of the gallery as the transaction serializes
+        # writes, which is checked with their images
+        rows = list(
+            Photo.objects.filter(gallery=gallery)
+            .order_by("-pk")
+            .values_list("pk", "image")[: len(photos)]
+        )
+        rows.reverse()
+        if [image for _, image in rows] != [photo.image.name for photo in photos]:
+            raise RuntimeError("Could not find the ids of the inserted photos.")
+        for photo, (pk, _) in zip(photos, rows):
+            photo.pk = pk
+
+
+def create_photos(gallery, items):
+    """ Create photos of gallery from items, dicts of a title, a description and
+        an image (an uploaded file), and queue their processing.
+        Returns for every item, in order, its Photo and None, or None and error
+        messages of its image.
+    """
+    with ThreadPoolExecutor(max_workers=get_workers()) as executor:
+        results = list(
+            executor.map(lambda item: store_image(gallery, item["image"]), items)
+        )
+    photos = []
+    for item, (photo, _) in zip(items, results):
+        if photo is not None:
+            photo.title = item["title"]
+            photo.description = item["description"]
+            photos.append(photo)
+
+    with transaction.atomic():
+        insert_photos(gallery, photos)
+        blobs.acquire(*[photo.image.name for photo in photos])
+        search.index_photos(photos)
+        jobs.enqueue_many("process_photo", [{"photo_id": photo.pk} for photo in photos])
+    return results
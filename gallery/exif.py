@@ -0,0 +1,194 @@
+""" Metadata of photo images: capture time, camera, location and dimensions.
+
+It is read once from the EXIF of the uploaded image by the background
+processing of the photo (see gallery.tasks) and stored in indexed columns of
+Photo, so photos are filtered and ordered by it without reading their files.
+Reading EXIF only parses the image header, the pixels aren't decoded.
+
+Locations are also stored as a geohash, which interleaves the bits of the
+longitude and latitude: it can only grow when either of them grows, so the
+photos taken within a bounding box have a geohash between the ones of its south
+west and north east corners. They are read from that range of the (gallery,
+geohash) index before their exact coordinates are checked (see within_box). Set
+GALLERY_EXIF_LOCATION to False to not store where photos were taken.
+"""
+import math
+import struct
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from PIL import Image
+
+from .models import Photo
+
+# EXIF tags
+ORIENTATION = 0x0112
+MODEL = 0x0110
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 0x9003
+DATETIME_DIGITIZED = 0x9004
+OFFSET_TIME_ORIGINAL = 0x9011
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+# orientations whose image is stored rotated by 90 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# what Pillow raises reading a malformed EXIF
+EXIF_ERRORS = (SyntaxError, ValueError, TypeError, KeyError, OSError, struct.error)
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# cells of about 5 x 5 meters
+GEOHASH_PRECISION = 9
+
+
+def get_location():
+    return getattr(settings, "GALLERY_EXIF_LOCATION", True)
+
+
+def get_ifd(exif, tag):
+    """ Tags of the sub IFD tag of exif, an empty dict if it has none. """
+    if hasattr(exif, "get_ifd"):
+        return exif.get_ifd(tag)
+    # before Pillow 8.2 the Exif IFD is merged in exif and the GPS IFD is a dict
+    value = exif.get(tag) if tag == GPS_IFD else exif
+    return value if isinstance(value, dict) else {}
+
+
+def clean_text(value, max_length):
+    if not isinstance(value, str):
+        return None
+    return value.strip("\x00 ")[:max_length] or None
+
+
+def parse_datetime(value, offset=None):
+    """ Aware datetime of an EXIF date and time, in UTC unless an offset like
+        "+02:00" is given. None if it isn't a valid date, e.g. zeros.
+    """
+    try:
+        taken_at = datetime.strptime(clean_text(value, 19), "%Y:%m:%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+    tzinfo = timezone.utc
+    offset = clean_text(offset, 6)
+    if offset and len(offset) == 6 and offset[0] in "+-" and offset[3] == ":":
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:]))
+        except ValueError:
+            pass
+        else:
+            tzinfo = timezone(-delta if offset[0] == "-" else delta)
+    return taken_at.replace(tzinfo=tzinfo)
+
+
+def to_float(value):
+    # rationals are (numerator, denominator) tuples before Pillow 7.2
+    if isinstance(value, tuple):
+        return value[0] / value[1]
+    return float(value)
+
+
+def gps_coordinate(value, ref, limit):
+    """ Degrees of an EXIF (degrees, minutes, seconds) GPS coordinate, negative
+        to the south or west. None if it is missing or out of -limit..limit.
+    """
+    try:
+        degrees, minutes, seconds = (to_float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    if clean_text(ref, 1) in ("S", "W"):
+        coordinate = -coordinate
+    if math.isnan(coordinate) or abs(coordinate) > limit:
+        return None
+    return coordinate
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """ Geohash of a location: bits alternately halve the longitude and latitude
+        intervals, 5 bits per character.
+    """
+    intervals = {"longitude": [-180.0, 180.0], "latitude": [-90.0, 90.0]}
+    values = {"longitude": longitude, "latitude": latitude}
+    characters, bits = [], 0
+    for bit in range(precision * 5):
+        axis = "latitude" if bit % 2 else "longitude"
+        low, high = intervals[axis]
+        middle = (low + high) / 2
+        bits <<= 1
+        if values[axis] >= middle:
+            bits |= 1
+            intervals[axis][0] = middle
+        else:
+            intervals[axis][1] = middle
+        if bit % 5 == 4:
+            characters.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+    return "".join(characters)
+
+
+def within_box(photos, south, west, north, east):
+    """ Photos of the queryset photos taken within the bounding box. """
+    return photos.filter(
+        geohash__range=(geohash(south, west), geohash(north, east)),
+        latitude__range=(south, north),
+        longitude__range=(west, east),
+    )
+
+
+def read_exif(image):
+    """ (tags, Exif IFD tags, GPS IFD tags) of a PIL image, empty dicts if its
+        EXIF is malformed, so the photo is stored without its metadata.
+    """
+    try:
+        exif = image.getexif()
+        gps = get_ifd(exif, GPS_IFD) if get_location() else {}
+        return dict(exif), dict(get_ifd(exif, EXIF_IFD)), dict(gps)
+    except EXIF_ERRORS:
+        return {}, {}, {}
+
+
+def image_metadata(image):
+    """ Values of the Photo metadata fields for an opened PIL image. """
+    exif, exif_tags, gps = read_exif(image)
+    width, height = image.size
+    if exif.get(ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    if width > height:
+        orientation = Photo.LANDSCAPE
+    elif width < height:
+        orientation = Photo.PORTRAIT
+    else:
+        orientation = Photo.SQUARE
+    metadata = {
+        "width": width,
+        "height": height,
+        "orientation": orientation,
+        "taken_at": parse_datetime(
+            exif_tags.get(DATETIME_ORIGINAL) or exif_tags.get(DATETIME_DIGITIZED),
+            exif_tags.get(OFFSET_TIME_ORIGINAL),
+        ),
+        "camera_model": clean_text(exif.get(MODEL), 100),
+        "latitude": None,
+        "longitude": None,
+        "geohash": None,
+    }
+    latitude = gps_coordinate(gps.get(GPS_LATITUDE), gps.get(GPS_LATITUDE_REF), 90)
+    longitude = gps_coordinate(gps.get(GPS_LONGITUDE), gps.get(GPS_LONGITUDE_REF), 180)
+    if latitude is not None and longitude is not None:
+        metadata.update(
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geohash(latitude, longitude),
+        )
+    return metadata
+
+
+def update_photo_metadata(photo):
+    """ Read and save the metadata of a photo image. """
+    with photo.image.open("rb") as image_file:
+        with Image.open(image_file) as image:
+            metadata = image_metadata(image)
+    Photo.objects.filter(pk=photo.pk).update(**metadata)
+    return metadata
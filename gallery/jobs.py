@@ -0,0 +1,172 @@
+""" Database backed job queue.
+
+Jobs are rows of the Job table, so enqueueing one is a single INSERT that is
+committed (or rolled back) together with the request that enqueued it.
+The run_worker management command claims due jobs and runs them in a pool
+of processes, a failed job is retried with an exponential backoff until it
+runs out of attempts.
+
+Job functions are registered with the job decorator:
+
+    @job("process_photo")
+    def process_photo(photo_id):
+        ...
+
+    enqueue("process_photo", photo_id=photo.pk)
+"""
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def get_lease():
+    """ Seconds a worker may run a job before it is considered dead. """
+    return getattr(settings, "GALLERY_JOBS_LEASE", 10 * 60)
+
+
+def get_retry_delay():
+    """ Seconds before the first retry of a failed job, doubled on every retry. """
+    return getattr(settings, "GALLERY_JOBS_RETRY_DELAY", 30)
+
+
+def job(name, on_failure=None):
+    """ Register a job function under name.
+        on_failure is called with the job arguments once the job has failed
+        all its attempts.
+    """
+
+    def register(function):
+        registry[name] = (function, on_failure)
+        return function
+
+    return register
+
+
+def enqueue(name, max_attempts=3, **arguments):
+    """ Queue a call of the job function registered under name. """
+    if name not in registry:
+        raise KeyError("No job registered as %r" % name)
+    return Job.objects.create(
+        name=name, arguments=json.dumps(arguments), max_attempts=max_attempts
+    )
+
+
+def enqueue_many(name, arguments_list, max_attempts=3):
+    """ Queue a call of the job function registered under name for every dict of
+        arguments of arguments_list, with one INSERT.
+    """
+    if name not in registry:
+        raise KeyError("No job registered as %r" % name)
+    return Job.objects.bulk_create(
+        Job(name=name, arguments=json.dumps(arguments), max_attempts=max_attempts)
+        for arguments in arguments_list
+    )
+
+
+def due_jobs():
+    now = timezone.now()
+    return Job.objects.filter(
+        Q(status=Job.PENDING, run_at__lte=now)
+        | Q(status=Job.RUNNING, locked_until__lt=now)
+    )
+
+
+def claim(limit):
+    """ Mark up to limit due jobs as running and return their ids.
+        Every job is claimed with a conditional UPDATE, so concurrent workers
+        never run the same job twice.
+    """
+    claimed = []
+    for job_id, status, locked_until in (
+        due_jobs()
+        .order_by("run_at")
+        .values_list("pk", "status", "locked_until")[: limit * 2]
+    ):
+        updated = Job.objects.filter(
+            pk=job_id, status=status, locked_until=locked_until
+        ).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            locked_until=timezone.now() + timedelta(seconds=get_lease()),
+        )
+        if updated:
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def record_failure(job, error, retry=True):
+    """ Record that an attempt of job failed with error (a traceback): it is
+        retried later while it has attempts left (and retry is true), else it is
+        marked failed and the on_failure function of its job is called.
+    """
+    job.last_error = error
+    if retry and job.attempts < job.max_attempts:
+        job.status = Job.PENDING
+        delay = get_retry_delay() * 2 ** (job.attempts - 1)
+        job.run_at = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = Job.FAILED
+        job.finished_at = timezone.now()
+        logger.error("Job %s %s failed:\n%s", job.pk, job.name, job.last_error)
+        _, on_failure = registry.get(job.name, (None, None))
+        if on_failure:
+            try:
+                on_failure(**json.loads(job.arguments))
+            except Exception:
+                logger.exception("on_failure of job %s %s failed", job.pk, job.name)
+    job.locked_until = None
+    job.save()
+    return job.status
+
+
+def run(job_id):
+    """ Run a claimed job and record its outcome. Returns its new status, None
+        if the job was deleted since it was claimed.
+    """
+    job = Job.objects.filter(pk=job_id).first()
+    if job is None:
+        return None
+    if job.name not in registry:
+        return record_failure(job, "No job registered as %r" % job.name, retry=False)
+    function, _ = registry[job.name]
+    try:
+        function(**json.loads(job.arguments))
+    except Exception:
+        return record_failure(job, traceback.format_exc())
+    job.status = Job.DONE
+    job.finished_at = timezone.now()
+    job.locked_until = None
+    job.save()
+    return job.status
+
+
+def fail(job_id, error):
+    """ Record a failed attempt of a claimed job whose run didn't record its
+        outcome, e.g. because it raised while reading or saving the job.
+        Returns its new status, None if it isn't running anymore.
+    """
+    job = Job.objects.filter(pk=job_id, status=Job.RUNNING).first()
+    if job is None:
+        return None
+    return record_failure(job, error)
+
+
+def run_pending(limit=100):
+    """ Run due jobs one by one in this process, returns how many were run. """
+    job_ids = claim(limit)
+    for job_id in job_ids:
+        run(job_id)
+    return len(job_ids)
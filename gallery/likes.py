@@ -0,0 +1,179 @@
+""" Fast like/unlike write path, and reads of likes by time.
+
+Likes are written straight to the likes table instead of going through
+obj.likes.add()/remove(), which read the existing rows first. The stored
+likes_count (and the trending score of photos) is updated in the same
+transaction, so the new count is known without counting the likes again.
+
+Likes tables are indexed by created_at and by (user, created_at), so the likes of
+a time range (see the count_likes command) and the like history of a user (the
+liked lists of gallery.api) are read with index range scans.
+Which objects of a page a user liked is read with a single query (liked_ids).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from . import response_cache, trending
+from .models import Gallery, Photo, PhotoLike
+
+# cached listings showing likes_count of each liked model
+LIKES_LISTINGS = {
+    Gallery: response_cache.PUBLIC_GALLERIES,
+    Photo: response_cache.TRENDING,
+}
+
+
+def change_likes_count(model, pks, delta):
+    """ Atomically add delta to likes_count of the objects of model with pks.
+        Only the cached pages listing them are invalidated.
+    """
+    response_cache.invalidate_objects(LIKES_LISTINGS[model], pks)
+    return model.objects.filter(pk__in=pks).update(
+        likes_count=F("likes_count") + delta, updated_at=timezone.now()
+    )
+
+
+def get_likes_count(model, pk):
+    """ Stored likes_count of an object, raises model.DoesNotExist if it is missing. """
+    return model.objects.values_list("likes_count", flat=True).get(pk=pk)
+
+
+def like_filter(model, pk, user):
+    """ Filter of the likes table row of user liking the object of model with pk. """
+    field = model.likes.field
+    return {field.m2m_field_name() + "_id": pk, field.m2m_reverse_field_name(): user}
+
+
+def liked_ids(model, user, pks):
+    """ Set of the ids among pks of model objects liked by user, read with one
+        query on the (object, user) unique index of the likes.
+    """
+    if not pks or not user.is_authenticated:
+        return set()
+    field = model.likes.field.m2m_field_name() + "_id"
+    return set(
+        model.likes.through.objects.filter(
+            user=user, **{field + "__in": pks}
+        ).values_list(field, flat=True)
+    )
+
+
+def like(model, pk, user):
+    """ Make user like the object of model with pk (a gallery or a photo) and
+        return its new number of likes, liking twice has no effect.
+    """
+    likes_count = get_likes_count(model, pk)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                liked = model.likes.through.objects.create(
+                    **like_filter(model, pk, user)
+                )
+        except IntegrityError:
+            # already liked
+            return likes_count
+        change_likes_count(model, [pk], 1)
+        if model is Photo:
+            trending.add_likes([(pk, liked.created_at)])
+        # concurrent likes may have changed the count since it was read
+        return get_likes_count(model, pk)
+
+
+def unlike(model, pk, user):
+    """ Remove the like of user from the object of model with pk and return its
+        new number of likes, unliking an object that isn't liked has no effect.
+    """
+    likes_count = get_likes_count(model, pk)
+    with transaction.atomic():
+        likes = model.likes.through.objects.filter(**like_filter(model, pk, user))
+        if model is Photo:
+            removed = list(likes.values_list("photo_id", "created_at"))
+        deleted, _ = likes.delete()
+        if not deleted:
+            return likes_count
+        change_likes_count(model, [pk], -deleted)
+        if model is Photo:
+            trending.remove_likes(removed)
+        return get_likes_count(model, pk)
+
+
+def sync_photo_likes(user, like_ids=(), unlike_ids=()):
+    """ Like and unlike many photos at once for user.
+        Returns (photo id, number of likes, liked by user) of every photo that exists.
+        Photos are read once with the like status of user. In the transaction,
+        the photos still to like are read again and their likes inserted one
+        savepoint each, so likes made meanwhile (e.g. by a retried batch) aren't
+        counted twice, and counters are updated with one UPDATE per direction
+        for the likes actually inserted or deleted.
+    """
+    like_ids, unlike_ids = set(like_ids), set(unlike_ids) - set(like_ids)
+    photos = (
+        Photo.objects.filter(pk__in=like_ids | unlike_ids)
+        .annotate(
+            liked=Exists(PhotoLike.objects.filter(photo=OuterRef("pk"), user=user))
+        )
+        .values_list("pk", "liked")
+    )
+    existing = dict(photos)
+    to_like = [pk for pk in like_ids if pk in existing and not existing[pk]]
+    to_unlike = [pk for pk in unlike_ids if pk in existing and existing[pk]]
+
+    with transaction.atomic():
+        if to_like:
+            liked_at = timezone.now()
+            liked = liked_ids(Photo, user, to_like)
+            inserted = []
+            for pk in to_like:
+                if pk in liked:
+                    continue
+                try:
+                    with transaction.atomic():
+                        PhotoLike.objects.create(
+                            photo_id=pk, user=user, created_at=liked_at
+                        )
+                except IntegrityError:
+                    # liked meanwhile
+                    continue
+                inserted.append(pk)
+            if inserted:
+                change_likes_count(Photo, inserted, 1)
+                trending.add_likes([(pk, liked_at) for pk in inserted])
+        if to_unlike:
+            likes = PhotoLike.objects.filter(user=user, photo_id__in=to_unlike)
+            removed = list(likes.values_list("photo_id", "created_at"))
+            to_unlike = [photo_id for photo_id, _ in removed]
+            likes.delete()
+            change_likes_count(Photo, to_unlike, -1)
+            trending.remove_likes(removed)
+        counts = Photo.objects.filter(pk__in=list(existing)).values_list(
+            "pk", "likes_count"
+        )
+        return [(pk, likes_count, pk in like_ids) for pk, likes_count in counts]
+
+
+def likes_between(model, since, until=None):
+    """ Likes of model objects (galleries or photos) that happened since, and
+        before until if given.
+    """
+    likes = model.likes.through.objects.filter(created_at__gte=since)
+    if until is not None:
+        likes = likes.filter(created_at__lt=until)
+    return likes
+
+
+def count_likes_by_period(model, since, until=None, period="hour"):
+    """ Number of likes of model objects per period ("hour", "day"...) since, and
+        before until if given, as (start of the period, count) pairs in time
+        order. Periods without likes are left out. See the count_likes command.
+    """
+    return list(
+        likes_between(model, since, until)
+        .annotate(period=Trunc("created_at", period))
+        .order_by()
+        .values("period")
+        .annotate(count=Count("pk"))
+        .order_by("period")
+        .values_list("period", "count")
+    )
@@ -0,0 +1,327 @@
+import json
+import math
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from gallery import metrics, synthetic
+from gallery.models import Gallery, GalleryLike, Photo, PhotoLike
+
+User = get_user_model()
+
+# benchmarked endpoint: url name of its api
+ENDPOINTS = {
+    "list_galleries": "list_create_galleries",
+    "list_public_galleries": "list_public_galleries",
+    "get_gallery": "get_gallery",
+    "list_photos": "list_create_photos",
+    "list_trending_photos": "list_trending_photos",
+    "like_photo": "like_photo",
+    "like_gallery": "like_gallery",
+}
+
+# ids of objects requests are made on, drawn from the first ones of the tables
+SAMPLE_SIZE = 10000
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of sorted values. """
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def parse_setting(value):
+    """ NAME=VALUE, VALUE is read as JSON if it can be. """
+    name, separator, value = value.partition("=")
+    if not separator or not name:
+        raise ValueError(value)
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the api endpoints in-process with django test clients from "
+        "--threads threads and report requests/s, latency percentiles and queries "
+        "per request as JSON, to compare releases and settings. Runs on the "
+        "configured database (see generate_data) or, with --fresh, on a new test "
+        "database (in memory with SQLite) filled with synthetic data. Like "
+        "endpoints like and then unlike objects the user didn't like, so the data "
+        "is left as it was. Concurrent writes may fail on SQLite, failed requests "
+        "are reported as errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS)
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per endpoint."
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=10,
+            help="Requests per endpoint made before measuring.",
+        )
+        parser.add_argument("--threads", type=int, default=1)
+        parser.add_argument(
+            "--fresh",
+            action="store_true",
+            help="Benchmark a new test database filled with synthetic data.",
+        )
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1,
+            help="With --fresh, multiplies the default number of generated objects.",
+        )
+        parser.add_argument(
+            "--setting",
+            type=parse_setting,
+            action="append",
+            default=[],
+            metavar="NAME=VALUE",
+            help="Setting overridden while benchmarking, VALUE is JSON or a "
+            "string, e.g. GALLERY_RESPONSE_CACHE_TIMEOUT=0 to turn the response "
+            "cache off.",
+        )
+        parser.add_argument(
+            "--username", help="User the requests are made as, the first by default."
+        )
+        parser.add_argument("--label", default="", help="Label of the run.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output", help="File to write the JSON report to, stdout by default."
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["threads"] < 1:
+            raise CommandError("--requests and --threads must be positive.")
+        overrides = dict(options["setting"])
+        with ExitStack() as stack:
+            if options["fresh"]:
+                stack.enter_context(self.fresh_database())
+                synthetic.generate(
+                    seed=options["seed"],
+                    **{
+                        name: max(int(count * options["scale"]), 1)
+                        for name, count in synthetic.SCALE.items()
+                    }
+                )
+            # every request is measured by the metrics middleware
+            stack.enter_context(
+                override_settings(GALLERY_METRICS_SAMPLE_RATE=1, **overrides)
+            )
+            report = {
+                "label": options["label"],
+                "started_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": {
+                    "vendor": connection.vendor,
+                    "name": str(connection.settings_dict["NAME"]),
+                    "fresh": options["fresh"],
+                },
+                "settings": overrides,
+                "threads": options["threads"],
+                "data": {
+                    "users": User.objects.count(),
+                    "galleries": Gallery.objects.count(),
+                    "photos": Photo.objects.count(),
+                    "photo_likes": PhotoLike.objects.count(),
+                    "gallery_likes": GalleryLike.objects.count(),
+                },
+                "endpoints": self.benchmark(**options),
+            }
+
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(content + "\n")
+            for name, result in report["endpoints"].items():
+                self.stdout.write(
+                    "%s: %.1f requests/s, p50 %.1f ms, p99 %.1f ms, %s queries"
+                    % (
+                        name,
+                        result["requests_per_second"],
+                        result["latency_ms"]["p50"],
+                        result["latency_ms"]["p99"],
+                        result["queries_per_request"],
+                    )
+                )
+        else:
+            self.stdout.write(content)
+
+    @contextmanager
+    def fresh_database(self):
+        """ Switch to a new test database and a temporary MEDIA_ROOT. """
+        old_name = connection.settings_dict["NAME"]
+        media_root = tempfile.mkdtemp()
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def get_user(self, username):
+        users = User.objects.order_by("pk")
+        if username:
+            users = users.filter(username=username)
+        user = users.first()
+        if user is None:
+            raise CommandError("No user to make the requests as.")
+        return user
+
+    def make_requests(self, endpoint, count, rng):
+        """ (method, path, query) of count requests to endpoint. """
+        url_name = "gallery:api_gallery:%s" % ENDPOINTS[endpoint]
+        if endpoint in ("list_galleries", "list_trending_photos"):
+            return [("get", reverse(url_name), {})] * count
+        if endpoint == "list_public_galleries":
+            galleries = Gallery.objects.filter(public=True).count()
+            pages = max(math.ceil(galleries / settings.REST_FRAMEWORK["PAGE_SIZE"]), 1)
+            return [
+                ("get", reverse(url_name), {"page": rng.randint(1, pages)})
+                for _ in range(count)
+            ]
+
+        if endpoint in ("get_gallery", "like_gallery"):
+            ids = Gallery.objects.filter(public=True).values_list("pk", flat=True)
+        else:
+            # galleries with many photos are drawn more often
+            field = "gallery_id" if endpoint == "list_photos" else "pk"
+            ids = Photo.objects.filter(gallery__public=True).values_list(
+                field, flat=True
+            )
+        if endpoint in ("like_photo", "like_gallery"):
+            # unliking an object liked before the benchmark would change the data
+            ids = ids.exclude(likes=self.user)
+        ids = list(ids.order_by("pk")[:SAMPLE_SIZE])
+        if not ids:
+            raise CommandError("No public galleries or photos to request.")
+        if endpoint in ("like_photo", "like_gallery"):
+            # a like and an unlike of each object, count is rounded up to pairs
+            return [
+                (method, reverse(url_name, args=[pk]), {})
+                for pk in (rng.choice(ids) for _ in range((count + 1) // 2))
+                for method in ("put", "delete")
+            ]
+        return [
+            ("get", reverse(url_name, args=[rng.choice(ids)]), {}) for _ in range(count)
+        ]
+
+    def run_requests(self, requests, threads, cookie):
+        """ Make requests from threads clients, returns their latencies in
+            seconds and the number of failed ones.
+        """
+        remaining = iter(requests)
+        lock = threading.Lock()
+        latencies, errors = [], []
+
+        def client():
+            client = Client(raise_request_exception=False, HTTP_HOST=self.host)
+            client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+            try:
+                while True:
+                    with lock:
+                        request = next(remaining, None)
+                    if request is None:
+                        return
+                    method, path, query = request
+                    start = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, query, HTTP_ACCEPT="application/json"
+                    )
+                    latency = time.perf_counter() - start
+                    with lock:
+                        latencies.append(latency)
+                        if response.status_code >= 400:
+                            errors.append(response.status_code)
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    connections.close_all()
+
+        if threads == 1:
+            client()
+        else:
+            workers = [threading.Thread(target=client) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return latencies, len(errors)
+
+    def benchmark(
+        self, endpoints, requests, warmup, threads, username, seed, **options
+    ):
+        rng = random.Random(seed)
+        self.host = (settings.ALLOWED_HOSTS or ["localhost"])[0].lstrip(".")
+        if self.host == "*":
+            self.host = "localhost"
+        login = Client()
+        self.user = self.get_user(username)
+        login.force_login(self.user)
+        cookie = login.cookies[settings.SESSION_COOKIE_NAME].value
+        measured = "gallery.middleware.RequestMetricsMiddleware" in settings.MIDDLEWARE
+        if not measured:
+            self.stderr.write("RequestMetricsMiddleware is off, queries aren't counted")
+
+        results = {}
+        for endpoint in endpoints:
+            warmup_requests = self.make_requests(endpoint, warmup, rng)
+            self.run_requests(warmup_requests, threads, cookie)
+            metrics.registry.clear()
+            start = time.perf_counter()
+            latencies, errors = self.run_requests(
+                self.make_requests(endpoint, requests, rng), threads, cookie
+            )
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            result = {
+                "requests": len(latencies),
+                "errors": errors,
+                "requests_per_second": round(len(latencies) / elapsed, 1),
+                "latency_ms": {
+                    name: round(value * 1000, 2)
+                    for name, value in (
+                        ("mean", statistics.mean(latencies)),
+                        ("p50", percentile(latencies, 50)),
+                        ("p95", percentile(latencies, 95)),
+                        ("p99", percentile(latencies, 99)),
+                        ("max", latencies[-1]),
+                    )
+                },
+                "queries_per_request": None,
+                "db_ms_per_request": None,
+            }
+            view = "gallery:api_gallery:%s" % ENDPOINTS[endpoint]
+            histograms = metrics.registry.histograms
+            queries = histograms.get(("gallery_request_queries", view))
+            if measured and queries is not None:
+                db_time = histograms[("gallery_request_db_seconds", view)]
+                result["queries_per_request"] = round(queries.sum / queries.count, 2)
+                result["db_ms_per_request"] = round(
+                    db_time.sum / db_time.count * 1000, 2
+                )
+            results[endpoint] = result
+        return results
@@ -0,0 +1,205 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from gallery.asgi import GalleryASGIHandler
+
+User = get_user_model()
+
+# bytes a client reads at once, the chunk size of ASGIHandler
+CHUNK_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and latency of a read endpoint served by a threaded "
+        "WSGI server and by the ASGI handler, in this process, with slow clients "
+        "that wait --client-delay seconds after every 64 KiB they read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/gallery/api/galleries/public/")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--concurrency", type=int, default=100, help="Clients at once."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=16,
+            help="Threads of the WSGI server and of the ASGI view pool.",
+        )
+        parser.add_argument("--client-delay", type=float, default=0.05)
+        parser.add_argument(
+            "--username", help="User the requests are made as, the first by default."
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        if options["username"]:
+            users = users.filter(username=options["username"])
+        user = users.first()
+        if user is None:
+            raise CommandError("No user to make the requests as.")
+        client = Client()
+        client.force_login(user)
+        self.cookie = "%s=%s" % (
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value,
+        )
+        self.host = (settings.ALLOWED_HOSTS or ["localhost"])[0].lstrip(".")
+        if self.host == "*":
+            self.host = "localhost"
+        self.path, _, self.query = options["path"].partition("?")
+        self.delay = options["client_delay"]
+
+        self.stdout.write(
+            "%s, %d requests, %d clients, %d threads, %.3fs client delay per 64 KiB"
+            % (
+                options["path"],
+                options["requests"],
+                options["concurrency"],
+                options["workers"],
+                self.delay,
+            )
+        )
+        for name, run in (("wsgi", self.run_wsgi), ("asgi", self.run_asgi)):
+            start = time.perf_counter()
+            latencies, statuses = run(
+                options["requests"], options["concurrency"], options["workers"]
+            )
+            elapsed = time.perf_counter() - start
+            if set(statuses) != {200}:
+                raise CommandError("%s responses had status %s" % (name, statuses))
+            latencies.sort()
+            self.stdout.write(
+                "%s: %.1f requests/s, p50 %.1f ms, p99 %.1f ms"
+                % (
+                    name,
+                    len(latencies) / elapsed,
+                    statistics.median(latencies) * 1000,
+                    latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                )
+            )
+
+    def run_clients(self, requests, concurrency, make_request):
+        """ Run requests calls of make_request from concurrency client threads. """
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+        latencies, statuses = [], []
+
+        def client():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                status = make_request()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    statuses.append(status)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, statuses
+
+    def run_wsgi(self, requests, concurrency, workers):
+        """ A threaded WSGI server: a worker thread runs the view and then writes
+            the response to the slow client.
+        """
+        handler = WSGIHandler()
+        server = ThreadPoolExecutor(max_workers=workers)
+
+        def serve():
+            response_status = []
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": self.path,
+                "QUERY_STRING": self.query,
+                "SERVER_NAME": self.host,
+                "SERVER_PORT": "80",
+                "HTTP_HOST": self.host,
+                "HTTP_COOKIE": self.cookie,
+                "HTTP_ACCEPT": "application/json",
+                "wsgi.input": io.BytesIO(b""),
+                "wsgi.url_scheme": "http",
+                "wsgi.errors": io.StringIO(),
+            }
+            body = handler(
+                environ, lambda status, headers: response_status.append(status)
+            )
+            try:
+                for part in body:
+                    for _ in range(0, len(part), CHUNK_SIZE):
+                        time.sleep(self.delay)
+            finally:
+                body.close()
+            return int(response_status[0].split()[0])
+
+        try:
+            return self.run_clients(
+                requests, concurrency, lambda: server.submit(serve).result()
+            )
+        finally:
+            server.shutdown()
+
+    def run_asgi(self, requests, concurrency, workers):
+        """ The ASGI handler on an event loop, sending to slow clients with
+            backpressure: send returns once the client read the chunk.
+        """
+        handler = GalleryASGIHandler(max_workers=workers)
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": self.path,
+            "query_string": self.query.encode(),
+            "headers": [
+                (b"host", self.host.encode()),
+                (b"cookie", self.cookie.encode()),
+                (b"accept", b"application/json"),
+            ],
+            "server": (self.host, 80),
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def request():
+            response_status = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response_status.append(message["status"])
+                elif message.get("body"):
+                    await asyncio.sleep(self.delay)
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            return time.perf_counter() - start, response_status[0]
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def client():
+                async with semaphore:
+                    return await request()
+
+            return await asyncio.gather(*(client() for _ in range(requests)))
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            handler.executor.shutdown()
+        return [latency for latency, _ in results], [status for _, status in results]
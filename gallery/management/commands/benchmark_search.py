@@ -0,0 +1,135 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from gallery import search, synthetic
+from gallery.models import Gallery, Photo
+
+User = get_user_model()
+
+PAGE_SIZE = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the photo search latency as the number of photos grows: photos "
+        "with synthetic descriptions are added up to each of --photos, in a "
+        "transaction that is rolled back, and searches of a rare and a common "
+        "word are timed against the search index and a LIKE scan at every size. "
+        "Every search matches --matches photos whatever the size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--photos", type=int, nargs="+", default=[10000, 100000, 1000000]
+        )
+        parser.add_argument("--queries", type=int, default=20)
+        parser.add_argument("--matches", type=int, default=5)
+        parser.add_argument(
+            "--no-scan", action="store_true", help="Don't time the LIKE scan."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = options["photos"]
+        if sorted(sizes) != sizes or sizes[0] < 1:
+            raise CommandError("--photos must be positive and increasing.")
+        with transaction.atomic():
+            self.benchmark(random.Random(options["seed"]), **options)
+            transaction.set_rollback(True)
+
+    def add_photos(self, gallery, texts):
+        """ Create and index photos of gallery with (title, description) texts. """
+        first_photo = synthetic.next_id(Photo)
+        Photo.objects.bulk_create(
+            (
+                Photo(
+                    gallery=gallery,
+                    title=title,
+                    description=description,
+                    image="benchmark.jpg",
+                    processing_status=Photo.READY,
+                )
+                for title, description in texts
+            ),
+            batch_size=synthetic.BATCH_SIZE,
+        )
+        search.index_photos(
+            Photo.objects.filter(pk__gte=first_photo)
+            .only("pk", "title", "description")
+            .iterator()
+        )
+
+    def time_queries(self, lookup, queries):
+        """ Seconds per query to read the first page and the count of the photos
+            lookup finds, and the counts.
+        """
+        counts = []
+        start = time.perf_counter()
+        for words in queries:
+            photos = lookup(words)
+            list(photos[:PAGE_SIZE])
+            counts.append(photos.count())
+        return (time.perf_counter() - start) / len(queries), counts
+
+    def benchmark(self, rng, photos, queries, matches, no_scan, **options):
+        user = User.objects.create(username="search-benchmark")
+        gallery = Gallery.objects.create(user=user, name="benchmark")
+        visible = Photo.objects.filter(Q(gallery__public=True) | Q(gallery__user=user))
+        weights = synthetic.power_law_weights(len(synthetic.WORDS), 1.1)
+
+        # rare words that are no substring of each other, so the scan finds the
+        # same photos
+        searched = [["r%05dx" % i, rng.choice(synthetic.WORDS)] for i in range(queries)]
+        self.add_photos(
+            gallery,
+            (
+                (
+                    common.capitalize(),
+                    "%s %s" % (synthetic.generate_text(rng, weights), rare),
+                )
+                for rare, common in searched
+                for _ in range(matches)
+            ),
+        )
+        self.stdout.write(
+            "%d queries of %d matches, backend %s"
+            % (queries, matches, search.get_backend())
+        )
+
+        count = queries * matches
+        for size in photos:
+            if size > count:
+                self.add_photos(
+                    gallery,
+                    (
+                        (
+                            synthetic.generate_text(rng, weights, words=3),
+                            synthetic.generate_text(rng, weights),
+                        )
+                        for _ in range(size - count)
+                    ),
+                )
+                count = size
+            index_time, index_counts = self.time_queries(
+                lambda words: search.search(visible, words), searched
+            )
+            line = "%d photos: index %.2f ms" % (count, index_time * 1000)
+            if not no_scan:
+                scan_time, scan_counts = self.time_queries(
+                    lambda words: visible.filter(
+                        *[
+                            Q(title__icontains=word) | Q(description__icontains=word)
+                            for word in words
+                        ]
+                    ).order_by("id"),
+                    searched,
+                )
+                if scan_counts != index_counts:
+                    raise CommandError("Index and scan found different photos.")
+                line += ", scan %.2f ms" % (scan_time * 1000)
+            self.stdout.write(line + " per query")
@@ -0,0 +1,87 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from gallery import similarity
+from gallery.models import Gallery, Photo
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the indexed similar photos lookup with a scan of all hashes on "
+        "random photos, created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--photos", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument(
+            "--distance", type=int, default=similarity.get_default_distance()
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not 0 <= options["distance"] <= similarity.MAX_DISTANCE:
+            raise CommandError(
+                "--distance must be between 0 and %d" % similarity.MAX_DISTANCE
+            )
+        with transaction.atomic():
+            self.benchmark(random.Random(options["seed"]), **options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, rng, photos, queries, distance, **options):
+        user = User.objects.create(username="similar-photos-benchmark")
+        gallery = Gallery.objects.create(user=user, name="benchmark")
+        queried = [rng.getrandbits(similarity.HASH_BITS) for _ in range(queries)]
+        hashes = [rng.getrandbits(similarity.HASH_BITS) for _ in range(photos)]
+        # a few near duplicates of every queried hash so lookups find something
+        for value in queried:
+            for _ in range(3):
+                near = value
+                for bit in rng.sample(range(similarity.HASH_BITS), rng.randint(0, 8)):
+                    near ^= 1 << bit
+                hashes.append(near)
+
+        Photo.objects.bulk_create(
+            (
+                Photo(
+                    gallery=gallery,
+                    title="photo",
+                    description="benchmark",
+                    image="benchmark.jpg",
+                    processing_status=Photo.READY,
+                    **similarity.hash_fields(value)
+                )
+                for value in hashes
+            ),
+            batch_size=500,
+        )
+        self.stdout.write(
+            "%d photos, %d queries, distance %d" % (len(hashes), queries, distance)
+        )
+
+        queryset = Photo.objects.filter(gallery=gallery)
+        timings = {}
+        results = {}
+        for name, lookup in (
+            ("index", similarity.similar_photos),
+            ("scan", similarity.similar_photos_scan),
+        ):
+            start = time.perf_counter()
+            results[name] = [lookup(queryset, value, distance) for value in queried]
+            timings[name] = (time.perf_counter() - start) / queries
+            self.stdout.write("%s: %.2f ms per query" % (name, timings[name] * 1000))
+        if results["index"] != results["scan"]:
+            raise CommandError("Index and scan lookups found different photos.")
+        self.stdout.write(
+            "index lookup is %.1fx faster than a scan, %.1f matches per query"
+            % (
+                timings["scan"] / timings["index"],
+                sum(map(len, results["index"])) / queries,
+            )
+        )
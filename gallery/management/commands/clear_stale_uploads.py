@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from gallery.uploads import delete_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete chunked photo uploads that were never finished."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=24 * 60 * 60,
+            help="Seconds after which an unfinished upload is deleted.",
+        )
+
+    def handle(self, *args, **options):
+        count = delete_stale_uploads(options["max_age"])
+        self.stdout.write("Deleted %d stale upload(s)" % count)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from gallery.blobs import collect
+
+
+class Command(BaseCommand):
+    help = "Delete stored images that no photo or rendition uses anymore."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=60 * 60,
+            help="Seconds an unused image is kept after it was last used.",
+        )
+
+    def handle(self, *args, **options):
+        count = collect(options["grace"])
+        self.stdout.write("Deleted %d unused file(s)" % count)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from gallery.models import Photo
+from gallery.similarity import update_photo_hash
+
+
+class Command(BaseCommand):
+    help = "Compute the perceptual hashes used to find similar photos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--gallery", type=int, help="Only process photos of this gallery id."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Compute all hashes again instead of only the missing ones.",
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.order_by("id")
+        if options["gallery"]:
+            photos = photos.filter(gallery_id=options["gallery"])
+        if not options["force"]:
+            photos = photos.filter(dhash__isnull=True)
+        computed = 0
+        for photo in photos.iterator(chunk_size=100):
+            try:
+                update_photo_hash(photo)
+            except (IOError, SyntaxError) as e:
+                self.stderr.write("Photo %d: %s" % (photo.pk, e))
+            else:
+                computed += 1
+        self.stdout.write("Computed %d hash(es)" % computed)
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from gallery.likes import count_likes_by_period
+from gallery.models import Gallery, Photo
+
+MODELS = {"galleries": Gallery, "photos": Photo}
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the likes of galleries or photos of the last hours, per period, "
+        "from the created_at index of the likes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=list(MODELS))
+        parser.add_argument(
+            "--hours", type=int, default=24, help="Count the likes of the last hours."
+        )
+        parser.add_argument(
+            "--period",
+            choices=["hour", "day", "week", "month"],
+            default="hour",
+            help="Count the likes per period.",
+        )
+
+    def handle(self, *args, **options):
+        model = MODELS[options["model"]]
+        since = timezone.now() - timedelta(hours=options["hours"])
+        counts = count_likes_by_period(model, since, period=options["period"])
+        for period, count in counts:
+            self.stdout.write("%s %d" % (period.isoformat(), count))
+        self.stdout.write(
+            "%d like(s) of %s in the last %d hour(s)"
+            % (sum(count for _, count in counts), options["model"], options["hours"])
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from gallery.exif import update_photo_metadata
+from gallery.models import Photo
+
+
+class Command(BaseCommand):
+    help = (
+        "Read the capture time, camera, location and dimensions of photos from "
+        "their EXIF, e.g. for photos processed before it was."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--gallery", type=int, help="Only process photos of this gallery id."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Read the metadata of all photos again instead of only the "
+            "missing ones.",
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.order_by("id")
+        if options["gallery"]:
+            photos = photos.filter(gallery_id=options["gallery"])
+        if not options["force"]:
+            # every read image has its dimensions
+            photos = photos.filter(width__isnull=True)
+        read = 0
+        for photo in photos.only("id", "image").iterator(chunk_size=100):
+            try:
+                update_photo_metadata(photo)
+            except (IOError, SyntaxError) as e:
+                self.stderr.write("Photo %d: %s" % (photo.pk, e))
+            else:
+                read += 1
+        self.stdout.write("Read the metadata of %d photo(s)" % read)
@@ -0,0 +1,65 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery import synthetic
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, galleries, photos (sharing a few tiny generated "
+        "images) and power law distributed likes, e.g. to run benchmark_api on."
+    )
+
+    def add_arguments(self, parser):
+        for name, count in synthetic.SCALE.items():
+            parser.add_argument("--" + name.replace("_", "-"), type=int, default=count)
+        parser.add_argument(
+            "--images", type=int, default=20, help="Distinct images of the photos."
+        )
+        parser.add_argument("--public-ratio", type=float, default=0.8)
+        parser.add_argument(
+            "--exponent",
+            type=float,
+            default=1.1,
+            help="Exponent of the power law of photos per gallery and likes.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=7, help="Likes happened in the last days."
+        )
+        parser.add_argument(
+            "--prefix", default="synthetic", help="Prefix of the usernames."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["galleries"] < 1 or options["images"] < 1:
+            raise CommandError("At least one user, gallery and image are needed.")
+        if User.objects.filter(username__startswith=options["prefix"]).exists():
+            raise CommandError(
+                "Users starting with %r exist already, choose another --prefix."
+                % options["prefix"]
+            )
+        start = time.perf_counter()
+        counts = synthetic.generate(
+            users=options["users"],
+            galleries=options["galleries"],
+            photos=options["photos"],
+            photo_likes=options["photo_likes"],
+            gallery_likes=options["gallery_likes"],
+            images=options["images"],
+            public_ratio=options["public_ratio"],
+            exponent=options["exponent"],
+            days=options["days"],
+            prefix=options["prefix"],
+            seed=options["seed"],
+        )
+        generated = ", ".join(
+            "%d %s" % (count, name.replace("_", " ")) for name, count in counts.items()
+        )
+        self.stdout.write(
+            "Generated %s in %.1fs" % (generated, time.perf_counter() - start)
+        )
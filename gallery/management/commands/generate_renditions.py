@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from gallery.models import Photo
+from gallery.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    help = "Create the missing renditions of existing photos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--gallery", type=int, help="Only process photos of this gallery id."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Render all renditions again instead of only the missing ones.",
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.order_by("id")
+        if options["gallery"]:
+            photos = photos.filter(gallery_id=options["gallery"])
+        created = 0
+        for photo in photos.iterator(chunk_size=100):
+            try:
+                created += generate_renditions(photo, force=options["force"])
+            except (IOError, SyntaxError) as e:
+                self.stderr.write("Photo %d: %s" % (photo.pk, e))
+        self.stdout.write("Created %d rendition(s)" % created)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from gallery import search
+
+
+class Command(BaseCommand):
+    help = "Index the title and description of all photos for the photo search."
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(
+            "Indexed %d photo(s) with the %s index" % (count, search.get_backend())
+        )
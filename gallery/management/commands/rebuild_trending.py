@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from gallery import trending
+
+
+class Command(BaseCommand):
+    help = "Recompute the trending photos ranking from the photo likes."
+
+    def handle(self, *args, **options):
+        count = trending.rebuild()
+        self.stdout.write("Ranked %d liked photo(s)" % count)
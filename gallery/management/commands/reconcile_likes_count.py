@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from gallery.models import Gallery, Photo
+
+
+def actual_likes_count(model):
+    """ Subquery counting the rows of the likes table of each object of model. """
+    through = model.likes.through
+    liked_field = model.likes.field.m2m_field_name()
+    counts = (
+        through.objects.filter(**{liked_field: OuterRef("pk")})
+        .order_by()
+        .values(liked_field)
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    help = "Fix likes_count of galleries and photos that drifted from their likes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the objects whose likes_count is wrong.",
+        )
+
+    def handle(self, *args, **options):
+        for model in (Gallery, Photo):
+            drifted = list(
+                model.objects.annotate(actual=actual_likes_count(model))
+                .exclude(likes_count=F("actual"))
+                .values_list("pk", flat=True)
+            )
+            if drifted and not options["dry_run"]:
+                model.objects.filter(pk__in=drifted).update(
+                    likes_count=actual_likes_count(model), updated_at=timezone.now()
+                )
+            self.stdout.write(
+                "%s: %d object(s) with a wrong likes_count%s"
+                % (
+                    model._meta.verbose_name_plural,
+                    len(drifted),
+                    "" if options["dry_run"] else " fixed",
+                )
+            )
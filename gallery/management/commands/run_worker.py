@@ -0,0 +1,88 @@
+import logging
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from gallery import jobs, worker
+
+logger = logging.getLogger("gallery.jobs")
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (e.g. photo processing) in a pool of processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=2,
+            help="Number of jobs run at the same time, one process each.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before looking for new jobs when none are due.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is due instead of waiting for new ones.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(options["concurrency"], 1)
+        # spawned processes set django up themselves instead of sharing the
+        # database connections of this one
+        executor = ProcessPoolExecutor(
+            max_workers=concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=worker.setup_worker_process,
+        )
+        # future -> id of the job it runs
+        running = {}
+        try:
+            while True:
+                free = concurrency - len(running)
+                job_ids = jobs.claim(free) if free else []
+                connections.close_all()
+                for job_id in job_ids:
+                    running[executor.submit(worker.run_job, job_id)] = job_id
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                done, _ = wait(
+                    running,
+                    timeout=options["poll_interval"],
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    self.job_done(running.pop(future), future)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.shutdown(wait=True)
+
+    def job_done(self, job_id, future):
+        """ Report the outcome of a job run by the pool. A run that raised before
+            recording it (e.g. a database error) counts as a failed attempt, so
+            the worker carries on with the other jobs.
+        """
+        try:
+            _, status = future.result()
+        except Exception:
+            error = traceback.format_exc()
+            logger.error("Job %d raised in its worker:\n%s", job_id, error)
+            try:
+                status = jobs.fail(job_id, error)
+            except Exception:
+                # the job is claimed again once its lease expires
+                logger.exception("Could not record the failure of job %d", job_id)
+                status = None
+        self.stdout.write("Job %d %s" % (job_id, status))
@@ -0,0 +1,215 @@
+""" Serving of photo images and renditions to the users allowed to view them.
+
+A file is served if a photo of a public gallery uses it, as image or rendition,
+or a photo of a gallery of the request user (identical photos share one file,
+see gallery.storage). Image columns are indexed, so this costs one or two index
+lookups.
+
+How the file is sent depends on GALLERY_MEDIA_BACKEND:
+- "django": a FileResponse read in chunks of GALLERY_MEDIA_CHUNK_SIZE bytes.
+  WSGI servers providing wsgi.file_wrapper (e.g. gunicorn) send whole files with
+  os.sendfile. Requests for a single byte range get a 206 response streamed
+  from Python.
+- "x-accel-redirect": an empty response whose X-Accel-Redirect header sends
+  nginx to GALLERY_MEDIA_ACCEL_PREFIX + the file name, an internal location
+  aliased to MEDIA_ROOT, from which nginx sends the file and handles ranges.
+- "x-sendfile": an empty response whose X-Sendfile header has the path of the
+  file, for Apache mod_xsendfile or lighttpd.
+
+Images of photos of private galleries are given signed URLs (see signed_url),
+which grant access to the file until they expire. Their HMAC signature is
+checked without any query, so a page of private thumbnails costs no session or
+gallery lookup per image. URLs signed within the same period of
+GALLERY_MEDIA_URL_MAX_AGE seconds expire at the same time, so they are the same
+for every listing of the period and clients can cache the images.
+"""
+import mimetypes
+import os
+import time
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date
+
+from .models import Photo
+from .storage import blob_storage
+
+DJANGO = "django"
+X_ACCEL_REDIRECT = "x-accel-redirect"
+X_SENDFILE = "x-sendfile"
+
+# visibility of a file: used by a public gallery, or only by galleries of the user
+PUBLIC = "public"
+PRIVATE = "private"
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def get_backend():
+    return getattr(settings, "GALLERY_MEDIA_BACKEND", DJANGO)
+
+
+def get_accel_prefix():
+    return getattr(settings, "GALLERY_MEDIA_ACCEL_PREFIX", "/protected-media/")
+
+
+def get_chunk_size():
+    return getattr(settings, "GALLERY_MEDIA_CHUNK_SIZE", 64 * 1024)
+
+
+def get_url_max_age():
+    return getattr(settings, "GALLERY_MEDIA_URL_MAX_AGE", 60 * 60)
+
+
+def get_signature(name, expires):
+    return salted_hmac("gallery.media", "%s:%d" % (name, expires)).hexdigest()
+
+
+def signed_url(name):
+    """ URL of the file of name that is valid for at least
+        GALLERY_MEDIA_URL_MAX_AGE seconds, and at most twice as long.
+    """
+    max_age = get_url_max_age()
+    expires = (int(time.time()) // max_age + 2) * max_age
+    query = urlencode({"expires": expires, "signature": get_signature(name, expires)})
+    return "%s?%s" % (blob_storage.url(name), query)
+
+
+def check_signature(name, expires, signature):
+    """ Whether signature, from the query of a signed URL of name, is valid and
+        expires isn't over.
+    """
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    return expires > time.time() and constant_time_compare(
+        signature or "", get_signature(name, expires)
+    )
+
+
+def get_visibility(user, name):
+    """ PUBLIC if a photo of a public gallery uses the file of name, PRIVATE if
+        only photos of galleries of user do, None if user can't view it.
+    """
+    visible = Q(gallery__public=True)
+    if user.is_authenticated:
+        visible |= Q(gallery__user=user)
+    photos = (
+        Photo.objects.filter(visible)
+        .order_by("-gallery__public")
+        .values_list("gallery__public", flat=True)
+    )
+    visibility = None
+    for uses in (Q(image=name), Q(renditions__image=name)):
+        public = photos.filter(uses).first()
+        if public:
+            return PUBLIC
+        if public is not None:
+            visibility = PRIVATE
+    return visibility
+
+
+def parse_range(header, size):
+    """ (first, last) byte of the range of a Range header, within a file of size
+        bytes. None if the header is malformed or asks for several ranges, the
+        whole file is sent then. Raises RangeNotSatisfiable if the range is
+        outside the file.
+    """
+    unit, _, spec = header.partition("=")
+    first, separator, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec or not separator:
+        return None
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        return None
+    if first is None:
+        # suffix range, the last bytes of the file
+        if last is None:
+            return None
+        if last == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - last, 0), size - 1
+    if last is None:
+        last = size - 1
+    elif last < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable(header)
+    return first, min(last, size - 1)
+
+
+class FileRange:
+    """ File-like object reading length bytes of file from its current position.
+        It has no fileno(), so wsgi.file_wrapper reads it rather than sending the
+        rest of the file with os.sendfile.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def send_file(request, name, etag=None, last_modified=None):
+    """ Response sending the file of name by the media backend, answering a
+        Range request if If-Range (when sent) matches etag or last_modified.
+        Raises FileNotFoundError if there is no such file.
+    """
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    backend = get_backend()
+    if backend == X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = get_accel_prefix() + quote(name)
+        return response
+    path = blob_storage.path(name)
+    if backend == X_SENDFILE:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+        return response
+
+    file = open(path, "rb")
+    size = os.fstat(file.fileno()).st_size
+    byte_range = None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    validators = (etag, last_modified and http_date(last_modified))
+    if "HTTP_RANGE" in request.META and (if_range is None or if_range in validators):
+        try:
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+        except RangeNotSatisfiable:
+            file.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % size
+            return response
+
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        first, last = byte_range
+        file.seek(first)
+        response = FileResponse(
+            FileRange(file, last - first + 1), status=206, content_type=content_type
+        )
+        response["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+        response["Content-Length"] = last - first + 1
+    response.block_size = get_chunk_size()
+    response["Accept-Ranges"] = "bytes"
+    return response
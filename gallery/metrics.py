@@ -0,0 +1,139 @@
+""" In-process request metrics, exposed in the Prometheus text format.
+
+RequestMetricsMiddleware (see gallery.middleware) records for a sample of the
+requests, per view: total latency, number of SQL queries, time spent in the
+database, time spent serializing objects into the response data (see
+MeasuredDataMixin in gallery.api.serializers) and time spent rendering that
+data to the response body, each into a histogram of registry. The metrics view
+serves them to Prometheus.
+
+Histograms only hold bucket counters, so they take constant memory whatever the
+number of requests. Every process has its own registry.
+"""
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    "gallery_request_duration_seconds": (
+        "Total latency of requests.",
+        LATENCY_BUCKETS,
+    ),
+    "gallery_request_queries": ("SQL queries run by requests.", QUERY_BUCKETS),
+    "gallery_request_db_seconds": (
+        "Time requests spent running SQL queries.",
+        LATENCY_BUCKETS,
+    ),
+    "gallery_request_serialize_seconds": (
+        "Time requests spent serializing objects into their response data.",
+        LATENCY_BUCKETS,
+    ),
+    "gallery_request_render_seconds": (
+        "Time requests spent rendering their response data to bytes (e.g. JSON).",
+        LATENCY_BUCKETS,
+    ),
+}
+
+
+def get_sample_rate():
+    """ Fraction of the requests that are measured, 0 disables the measures. """
+    return getattr(settings, "GALLERY_METRICS_SAMPLE_RATE", 0)
+
+
+def get_slow_request_threshold():
+    """ Seconds after which a measured request is logged with its queries, None
+        disables the log.
+    """
+    return getattr(settings, "GALLERY_METRICS_SLOW_REQUEST", None)
+
+
+class Histogram:
+    """ Count of observed values per bucket, with their sum. """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last counter is for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """ (upper bound, number of values <= upper bound) of every bucket. """
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """ Histograms of HISTOGRAMS per view, safe to use from many threads. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, values):
+        """ Add values, a dict of histogram name to value, to the histograms of
+            view.
+        """
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms.get((name, view))
+                if histogram is None:
+                    histogram = self.histograms[name, view] = Histogram(
+                        HISTOGRAMS[name][1]
+                    )
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """ All histograms in the Prometheus text exposition format. """
+        lines = []
+        with self.lock:
+            for name, (description, _) in HISTOGRAMS.items():
+                views = sorted(
+                    view
+                    for histogram_name, view in self.histograms
+                    if histogram_name == name
+                )
+                if not views:
+                    continue
+                lines.append("# HELP %s %s" % (name, description))
+                lines.append("# TYPE %s histogram" % name)
+                for view in views:
+                    histogram = self.histograms[name, view]
+                    label = 'view="%s"' % escape_label(view)
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(
+                            '%s_bucket{%s,le="%s"} %d'
+                            % (name, label, format_bound(bound), count)
+                        )
+                    lines.append("%s_sum{%s} %r" % (name, label, histogram.sum))
+                    lines.append("%s_count{%s} %d" % (name, label, histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_bound(bound):
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+registry = Registry()
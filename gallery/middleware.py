@@ -0,0 +1,116 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger("gallery.metrics")
+
+# slowest queries logged with a slow request
+SLOW_REQUEST_QUERIES = 10
+
+
+class QueryRecorder:
+    """ Database execute wrapper counting queries and the time they take,
+        and keeping their SQL if keep_sql.
+    """
+
+    def __init__(self, keep_sql):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.duration = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if self.keep_sql:
+                self.queries.append((duration, sql))
+
+
+class RequestMetricsMiddleware:
+    """ Record latency, queries, database, serialize and render time of a sample
+        of the requests (GALLERY_METRICS_SAMPLE_RATE) in gallery.metrics, per
+        view, and log requests slower than GALLERY_METRICS_SLOW_REQUEST seconds
+        with their slowest queries and the queries they repeated.
+        Requests that aren't sampled only cost a call to random().
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = metrics.get_sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        threshold = metrics.get_slow_request_threshold()
+        recorder = QueryRecorder(keep_sql=threshold is not None)
+        request._metrics_serialize_time = 0
+        request._metrics_render_time = 0
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "<unresolved>"
+        metrics.registry.observe(
+            view,
+            {
+                "gallery_request_duration_seconds": duration,
+                "gallery_request_queries": recorder.count,
+                "gallery_request_db_seconds": recorder.duration,
+                "gallery_request_serialize_seconds": request._metrics_serialize_time,
+                "gallery_request_render_seconds": request._metrics_render_time,
+            },
+        )
+        if threshold is not None and duration >= threshold:
+            log_slow_request(request, view, response, duration, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # called right before the response (e.g. of a DRF view) is rendered
+        if hasattr(request, "_metrics_render_time"):
+            start = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_render_time = time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def log_slow_request(request, view, response, duration, recorder):
+    repeated = Counter(sql for _, sql in recorder.queries)
+    slowest = sorted(recorder.queries, reverse=True)[:SLOW_REQUEST_QUERIES]
+    lines = [
+        "Slow request %s %s (%s) %d: %.3fs, %d queries in %.3fs"
+        % (
+            request.method,
+            request.get_full_path(),
+            view,
+            response.status_code,
+            duration,
+            recorder.count,
+            recorder.duration,
+        )
+    ]
+    lines.extend("  %.3fs %s" % query for query in slowest)
+    lines.extend(
+        "  repeated %d times: %s" % (count, sql)
+        for sql, count in repeated.most_common()
+        if count > 1
+    )
+    logger.warning("\n".join(lines))
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_likes_count(apps, schema_editor):
+    for model_name, liked_field in (("Gallery", "gallery"), ("Photo", "photo")):
+        model = apps.get_model("gallery", model_name)
+        counts = (
+            model.likes.through.objects.filter(**{liked_field: OuterRef("pk")})
+            .order_by()
+            .values(liked_field)
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        model.objects.update(likes_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0003_auto_20200504_1422'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gallery',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_likes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:22
+
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# the ranking as of this migration (see gallery.trending), copied so the
+# migration computes the same whatever becomes of the module and its settings.
+# rebuild_trending ranks photos again with the current ones.
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HALF_LIFE = 24 * 60 * 60
+MIN_LIKES = 3
+
+
+def rank_liked_photos(apps, schema_editor):
+    TrendingPhoto = apps.get_model("gallery", "TrendingPhoto")
+    Photo = apps.get_model("gallery", "Photo")
+    photos = Photo.objects.filter(likes_count__gt=0).values_list(
+        "pk", "likes_count", "gallery__public"
+    )
+    # likes existing before this migration have no known time, treat them as
+    # happening now
+    now = django.utils.timezone.now()
+    score = (now - EPOCH).total_seconds() * math.log(2) / HALF_LIFE
+    TrendingPhoto.objects.bulk_create(
+        TrendingPhoto(
+            photo_id=photo_id,
+            score=score + math.log(likes_count),
+            listed=public and likes_count >= MIN_LIKES,
+        )
+        for photo_id, likes_count, public in photos.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gallery', '0004_likes_count'),
+    ]
+
+    operations = [
+        # PhotoLike takes over the table django created for Photo.likes
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PhotoLike',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gallery.Photo')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'gallery_photo_likes',
+                        'unique_together': {('photo', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='photo',
+                    name='likes',
+                    field=models.ManyToManyField(related_name='liked_photos', through='gallery.PhotoLike', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='photolike',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='TrendingPhoto',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='gallery.Photo')),
+                ('score', models.FloatField()),
+                ('listed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendingphoto',
+            index=models.Index(fields=['listed', 'score'], name='gallery_tre_listed_162264_idx'),
+        ),
+        migrations.RunPython(rank_liked_photos, migrations.RunPython.noop),
+    ]
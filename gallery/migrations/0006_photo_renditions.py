@@ -0,0 +1,30 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import gallery.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0005_trending_photos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('format', models.CharField(max_length=10)),
+                ('image', models.ImageField(max_length=255, upload_to=gallery.models.rendition_directory_path)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='gallery.Photo')),
+            ],
+            options={
+                'unique_together': {('photo', 'name', 'format')},
+            },
+        ),
+    ]
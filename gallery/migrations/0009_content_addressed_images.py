@@ -0,0 +1,39 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:32
+
+from django.db import migrations, models
+import django.utils.timezone
+import gallery.models
+import gallery.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0008_photo_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(storage=gallery.storage.ContentAddressedStorage(), upload_to=gallery.models.image_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='photorendition',
+            name='image',
+            field=models.ImageField(max_length=255, storage=gallery.storage.ContentAddressedStorage(), upload_to=gallery.models.rendition_directory_path),
+        ),
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(fields=['refcount', 'updated_at'], name='gallery_blo_refcoun_2000fd_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gallery', '0011_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gallery',
+            index=models.Index(fields=['public', 'id'], name='gallery_gal_public_f5d659_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['gallery', 'id'], name='gallery_pho_gallery_f6d9e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photolike',
+            index=models.Index(fields=['user', 'photo'], name='gallery_pho_user_id_0f472c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingphoto',
+            index=models.Index(condition=models.Q(listed=True), fields=['-score', 'photo'], name='trending_listed_score_idx'),
+        ),
+        # photos liked by a user, the table of Gallery.likes is created by django
+        migrations.RunSQL(
+            'CREATE INDEX "gallery_gallery_likes_user_gallery_idx" '
+            'ON "gallery_gallery_likes" ("user_id", "gallery_id");',
+            'DROP INDEX "gallery_gallery_likes_user_gallery_idx";',
+        ),
+        migrations.AlterField(
+            model_name='gallery',
+            name='public',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='gallery',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='gallery.Gallery'),
+        ),
+        migrations.AlterField(
+            model_name='photolike',
+            name='photo',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='gallery.Photo'),
+        ),
+        migrations.AlterField(
+            model_name='photolike',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RemoveIndex(
+            model_name='trendingphoto',
+            name='gallery_tre_listed_162264_idx',
+        ),
+    ]
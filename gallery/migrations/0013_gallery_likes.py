@@ -0,0 +1,83 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gallery', '0012_composite_indexes'),
+    ]
+
+    operations = [
+        # replaced by the (user, created_at) index of GalleryLike
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS "gallery_gallery_likes_user_gallery_idx";',
+            'CREATE INDEX "gallery_gallery_likes_user_gallery_idx" '
+            'ON "gallery_gallery_likes" ("user_id", "gallery_id");',
+        ),
+        # GalleryLike takes over the table django created for Gallery.likes, so
+        # existing likes are kept as they are
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='GalleryLike',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('gallery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gallery.Gallery')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'gallery_gallery_likes',
+                        'unique_together': {('gallery', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='gallery',
+                    name='likes',
+                    field=models.ManyToManyField(related_name='liked_galleries', through='gallery.GalleryLike', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        # likes existing before this migration have no known time, they are
+        # given the time of the migration
+        migrations.AddField(
+            model_name='gallerylike',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='gallerylike',
+            index=models.Index(fields=['user', 'created_at'], name='gallery_gal_user_id_c116be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gallerylike',
+            index=models.Index(fields=['created_at'], name='gallery_gal_created_b92d0c_idx'),
+        ),
+        migrations.AlterField(
+            model_name='gallerylike',
+            name='gallery',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='gallery.Gallery'),
+        ),
+        migrations.AlterField(
+            model_name='gallerylike',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='photolike',
+            index=models.Index(fields=['user', 'created_at'], name='gallery_pho_user_id_2cb379_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photolike',
+            index=models.Index(fields=['created_at'], name='gallery_pho_created_0361bc_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='photolike',
+            name='gallery_pho_user_id_0f472c_idx',
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:01
+
+from django.db import migrations, models
+import gallery.models
+import gallery.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0013_gallery_likes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(db_index=True, storage=gallery.storage.ContentAddressedStorage(), upload_to=gallery.models.image_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='photorendition',
+            name='image',
+            field=models.ImageField(db_index=True, max_length=255, storage=gallery.storage.ContentAddressedStorage(), upload_to=gallery.models.rendition_directory_path),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:05
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.deletion
+
+# the tokenizer of gallery.search as of this migration, so that the migration
+# doesn't break when the module changes. rebuild_search_index indexes photos
+# again with the current one.
+TITLE_WEIGHT = 2
+MAX_WORD_LENGTH = 100
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [word for word in WORD_RE.findall(text) if len(word) <= MAX_WORD_LENGTH]
+
+
+def photo_terms(title, description):
+    weights = Counter(tokenize(description))
+    for word in tokenize(title):
+        weights[word] += TITLE_WEIGHT
+    return weights
+
+
+def create_search_index(apps, schema_editor):
+    """ The FTS5 table on SQLite (when it has FTS5), the PhotoSearchTerm rows
+        otherwise, of the existing photos.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=connection.alias):
+                schema_editor.execute(
+                    'CREATE VIRTUAL TABLE "gallery_photo_search" USING fts5('
+                    'title, description, tokenize = "unicode61 remove_diacritics 2")'
+                )
+        except DatabaseError:
+            # SQLite built without FTS5
+            pass
+        else:
+            schema_editor.execute(
+                'INSERT INTO "gallery_photo_search" (rowid, title, description) '
+                'SELECT id, title, description FROM "gallery_photo"'
+            )
+            return
+
+    Photo = apps.get_model('gallery', 'Photo')
+    PhotoSearchTerm = apps.get_model('gallery', 'PhotoSearchTerm')
+    photos = Photo.objects.order_by('pk').values_list('pk', 'title', 'description')
+    PhotoSearchTerm.objects.bulk_create(
+        (
+            PhotoSearchTerm(photo_id=pk, term=term, weight=weight)
+            for pk, title, description in photos.iterator()
+            for term, weight in photo_terms(title, description).items()
+        ),
+        batch_size=500,
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS "gallery_photo_search"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0014_media_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('weight', models.PositiveIntegerField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='gallery.Photo')),
+            ],
+            options={
+                'unique_together': {('term', 'photo')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,6 +1,11 @@
+import os
+import uuid
+
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
+from .storage import blob_storage
 from .utils import get_random_string
 
 # Create your models here.
@@ -12,18 +17,30 @@ class Gallery(models.Model):
         -user: user here is ForeignKey because user has many galleries and 
           a gallery belong to one user (one to many relation).
         -public: so that user can have private galleries in which he only have access to them.
-        -likes: likes is ManyToManyField to create new model of gallery and user
-         to be able to track who liked the gallery and if user liked the gallery before or not.
+        -likes: likes is ManyToManyField through GalleryLike to be able to track who
+         liked the gallery, when, and if user liked the gallery before or not.
+        -likes_count: denormalized number of likes kept in sync with likes
+         (see gallery.signals) so listing galleries doesn't need to count likes.
+        -updated_at: last change of the gallery or its likes_count, used to answer
+         conditional requests without loading the gallery.
     """
 
     # gallery owner
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # gallery name is optional
     name = models.CharField(max_length=250, null=True, blank=True)
-    public = models.BooleanField(default=True, db_index=True)
+    public = models.BooleanField(default=True)
     likes = models.ManyToManyField(
-        settings.AUTH_USER_MODEL, related_name="liked_galleries"
+        settings.AUTH_USER_MODEL,
+        related_name="liked_galleries",
+        through="gallery.GalleryLike",
     )
+    likes_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # public galleries listed by id
+        indexes = [models.Index(fields=["public", "id"])]
 
     @property
     def number_of_likes(self):
@@ -33,31 +50,309 @@ class Gallery(models.Model):
 def image_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/gallery/<Gallery_id>/random str/<filename>
     # random string is used here to prevent file overwrite with same <filename>
+    # photos use blob_storage, which only keeps the extension of this path
     return "gallery/{0}/{1}/{2}".format(
         instance.gallery.id, get_random_string(5), filename
     )
 
 
+def rendition_directory_path(instance, filename):
+    # path of the rendition beside the original image of the photo:
+    # gallery/<Gallery_id>/random str/renditions/<image name>_<rendition name>.<ext>
+    # renditions use blob_storage, which only keeps the extension of this path
+    # filename here is the extension of the rendition format
+    directory, image_filename = os.path.split(instance.photo.image.name)
+    return "{0}/renditions/{1}_{2}.{3}".format(
+        directory, os.path.splitext(image_filename)[0], instance.name, filename
+    )
+
+
 class Photo(models.Model):
     """ Model for adding photos in a gallery. 
         -gallery: gallery here is ForeignKey because gallery includes many photos and 
          a photo belong to one gallery (one to many relation).
         -description: description is TextField to allow large text.
         -image: image is ImageField because it handels uploading the file using upload_to kwarg 
-         and saves its path.
-        -likes: likes is ManyToManyField to create new model of photo and user
-         to be able to track who liked the photo and if user liked the photo before or not.
-        
+         and saves its path. Images are content addressed (see gallery.storage) so
+         identical images are stored once.
+        -likes: likes is ManyToManyField through PhotoLike to be able to track who liked
+         the photo, when, and if user liked the photo before or not.
+        -likes_count: denormalized number of likes kept in sync with likes
+         (see gallery.signals) so listing photos doesn't need to count likes.
+        -processing_status: state of the background processing of the uploaded
+         image (see gallery.jobs), renditions are available once it is ready.
+        -updated_at: last change of the photo, its likes_count, processing status
+         or renditions.
+        -dhash: perceptual hash of the image used to find similar photos, and
+         dhash_0 to dhash_3 its indexed 16 bit chunks (see gallery.similarity).
+        -taken_at, width, height, orientation, camera_model, latitude, longitude:
+         metadata read from the image EXIF when it is processed, and geohash
+         its location (see gallery.exif). Unknown values are null.
     """
 
-    gallery = models.ForeignKey("gallery.Gallery", on_delete=models.CASCADE)
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    PROCESSING_STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (READY, "Ready"),
+        (FAILED, "Failed"),
+    ]
+
+    LANDSCAPE = "landscape"
+    PORTRAIT = "portrait"
+    SQUARE = "square"
+    ORIENTATION_CHOICES = [
+        (LANDSCAPE, "Landscape"),
+        (PORTRAIT, "Portrait"),
+        (SQUARE, "Square"),
+    ]
+
+    # indexed by the (gallery, id) index
+    gallery = models.ForeignKey(
+        "gallery.Gallery", on_delete=models.CASCADE, db_index=False
+    )
     title = models.CharField(max_length=250)
     description = models.TextField()
-    image = models.ImageField(upload_to=image_directory_path)
+    # indexed to find who may view the file (see gallery.media)
+    image = models.ImageField(
+        upload_to=image_directory_path, storage=blob_storage, db_index=True
+    )
     likes = models.ManyToManyField(
-        settings.AUTH_USER_MODEL, related_name="liked_photos"
+        settings.AUTH_USER_MODEL,
+        related_name="liked_photos",
+        through="gallery.PhotoLike",
+    )
+    likes_count = models.PositiveIntegerField(default=0)
+    processing_status = models.CharField(
+        max_length=10, choices=PROCESSING_STATUS_CHOICES, default=PENDING
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    dhash = models.BigIntegerField(null=True, blank=True, editable=False)
+    dhash_0 = models.PositiveIntegerField(null=True, editable=False, db_index=True)
+    dhash_1 = models.PositiveIntegerField(null=True, editable=False, db_index=True)
+    dhash_2 = models.PositiveIntegerField(null=True, editable=False, db_index=True)
+    dhash_3 = models.PositiveIntegerField(null=True, editable=False, db_index=True)
+    # metadata is indexed with the gallery, photos are listed by gallery
+    taken_at = models.DateTimeField(null=True, editable=False)
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    orientation = models.CharField(
+        max_length=10, choices=ORIENTATION_CHOICES, null=True, editable=False
     )
+    camera_model = models.CharField(max_length=100, null=True, editable=False)
+    latitude = models.FloatField(null=True, editable=False)
+    longitude = models.FloatField(null=True, editable=False)
+    geohash = models.CharField(max_length=12, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # photos of a gallery listed by id
+            models.Index(fields=["gallery", "id"]),
+            # and filtered or ordered by their metadata (see gallery.exif)
+            models.Index(fields=["gallery", "taken_at", "id"]),
+            models.Index(fields=["gallery", "orientation", "id"]),
+            models.Index(fields=["gallery", "camera_model", "id"]),
+            models.Index(fields=["gallery", "geohash"]),
+        ]
 
     @property
     def number_of_likes(self):
         return self.likes.count()
+
+
+class PhotoRendition(models.Model):
+    """ A resized copy of a photo image in a given format (see gallery.renditions),
+        so that clients don't have to download originals to show small images.
+        -name: name of the rendition size, e.g. thumbnail.
+        -format: image format of the rendition, e.g. JPEG or WEBP.
+        -width/height: actual dimensions of the rendition.
+    """
+
+    photo = models.ForeignKey(
+        "gallery.Photo", on_delete=models.CASCADE, related_name="renditions"
+    )
+    name = models.CharField(max_length=50)
+    format = models.CharField(max_length=10)
+    # indexed to find who may view the file (see gallery.media)
+    image = models.ImageField(
+        upload_to=rendition_directory_path,
+        storage=blob_storage,
+        max_length=255,
+        db_index=True,
+    )
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [["photo", "name", "format"]]
+
+
+class PhotoSearchTerm(models.Model):
+    """ A word of the title or description of a photo, the search index of
+        databases without FTS5 (see gallery.search).
+        -weight: occurrences of the word, the ones in the title count more.
+    """
+
+    # postings of a word are read from the unique (term, photo) index
+    term = models.CharField(max_length=100)
+    photo = models.ForeignKey(
+        "gallery.Photo", on_delete=models.CASCADE, related_name="search_terms"
+    )
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [["term", "photo"]]
+
+
+class GalleryLike(models.Model):
+    """ A user liking a gallery.
+        -created_at: when the like happened.
+        It keeps the table of the implicit Gallery.likes many to many relation.
+        Likes of a user are indexed by time, for their like history, and so are
+        all likes, for the likes of a time range (see gallery.likes).
+    """
+
+    # indexed by the unique (gallery, user) index
+    gallery = models.ForeignKey(
+        "gallery.Gallery", on_delete=models.CASCADE, db_index=False
+    )
+    # indexed by the (user, created_at) index
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "gallery_gallery_likes"
+        unique_together = [["gallery", "user"]]
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+
+class PhotoLike(models.Model):
+    """ A user liking a photo.
+        -created_at: when the like happened, used to score trending photos.
+        It keeps the table of the implicit Photo.likes many to many relation.
+        Indexed like GalleryLike.
+    """
+
+    # indexed by the unique (photo, user) index
+    photo = models.ForeignKey("gallery.Photo", on_delete=models.CASCADE, db_index=False)
+    # indexed by the (user, created_at) index
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "gallery_photo_likes"
+        unique_together = [["photo", "user"]]
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+
+class TrendingPhoto(models.Model):
+    """ Precomputed trending rank of a liked photo (see gallery.trending).
+        -score: time decayed number of likes of the photo stored in log space,
+         so that scores of different photos stay comparable without decaying
+         every row as time goes by.
+        -listed: photo is in a public gallery and has enough likes to trend,
+         the feed is served straight from a partial index of listed photos by score.
+    """
+
+    photo = models.OneToOneField(
+        "gallery.Photo",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="trending",
+    )
+    score = models.FloatField()
+    listed = models.BooleanField(default=False)
+
+    class Meta:
+        # only listed photos are served, most trending first
+        indexes = [
+            models.Index(
+                fields=["-score", "photo"],
+                name="trending_listed_score_idx",
+                condition=models.Q(listed=True),
+            )
+        ]
+
+
+class Job(models.Model):
+    """ A task run in the background by the run_worker command (see gallery.jobs).
+        -name: name of the registered job function to call.
+        -arguments: JSON encoded keyword arguments of the call.
+        -run_at: job isn't run before this time, used to delay retries.
+        -locked_until: lease of the worker running the job, a running job whose
+         lease expired (e.g. the worker died) is picked up again.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=100)
+    arguments = models.TextField(default="{}")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_at"])]
+
+
+class PhotoUpload(models.Model):
+    """ A resumable upload of a photo image sent in chunks (see gallery.uploads).
+        -path: storage name of the image, chunks are written straight to it.
+        -size/checksum: size and SHA-256 hex digest of the whole image announced
+         by the client, checked before the photo is created.
+        -received: number of bytes written so far, the next chunk starts there.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    gallery = models.ForeignKey("gallery.Gallery", on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
+    description = models.TextField()
+    filename = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64)
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class Blob(models.Model):
+    """ A file of the content addressed storage (see gallery.blobs).
+        -refcount: number of photos and renditions using the file, files no longer
+         used are deleted by the collect_blobs command.
+    """
+
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["refcount", "updated_at"])]
@@ -0,0 +1,100 @@
+""" Resized copies (renditions) of uploaded photos.
+
+Renditions are configured by GALLERY_RENDITIONS, a dict of rendition name to
+the maximum (width, height) of the rendition and the formats to save it in.
+Like originals they are content addressed, so the renditions of identical
+images are stored once.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Photo, PhotoRendition
+
+DEFAULT_RENDITIONS = {
+    "thumbnail": {"size": (320, 320), "formats": ["JPEG", "WEBP"]},
+    "medium": {"size": (1280, 1280), "formats": ["JPEG", "WEBP"]},
+}
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def get_renditions():
+    return getattr(settings, "GALLERY_RENDITIONS", DEFAULT_RENDITIONS)
+
+
+def get_quality():
+    return getattr(settings, "GALLERY_RENDITION_QUALITY", 80)
+
+
+def open_image(photo, max_size):
+    """ Decode the photo image upright and in RGB(A).
+        JPEGs are decoded at the smallest scale that still covers max_size.
+    """
+    with photo.image.open("rb") as image_file:
+        image = Image.open(image_file)
+        image.draft("RGB", max_size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        image.load()
+    return image
+
+
+def render(image, size, image_format):
+    """ Encode a copy of image that fits in size (never upscaled) in image_format. """
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, image_format, quality=get_quality(), optimize=True)
+    return image.size, output.getvalue()
+
+
+def generate_renditions(photo, force=False):
+    """ Create the configured renditions of photo that are missing (all of them if
+        force), so running it again only renders what isn't there yet.
+        Renditions that are no longer configured are removed.
+        Returns the number of renditions created.
+    """
+    wanted = {
+        (name, image_format): tuple(spec["size"])
+        for name, spec in get_renditions().items()
+        for image_format in spec["formats"]
+    }
+    existing = {}
+    removed = False
+    for rendition in photo.renditions.all():
+        key = (rendition.name, rendition.format)
+        if (
+            force
+            or key not in wanted
+            or not rendition.image.storage.exists(rendition.image.name)
+        ):
+            # the file may be shared, collect_blobs deletes it once unused
+            rendition.delete()
+            removed = True
+        else:
+            existing[key] = rendition
+    missing = [key for key in wanted if key not in existing]
+    if missing or removed:
+        Photo.objects.filter(pk=photo.pk).update(updated_at=timezone.now())
+    if not missing:
+        return 0
+
+    max_size = tuple(max(wanted[key][i] for key in missing) for i in range(2))
+    image = open_image(photo, max_size)
+    for name, image_format in missing:
+        size, content = render(image, wanted[name, image_format], image_format)
+        rendition = PhotoRendition(
+            photo=photo, name=name, format=image_format, width=size[0], height=size[1]
+        )
+        extension = EXTENSIONS[image_format]
+        rendition.image.save(extension, ContentFile(content), save=False)
+        rendition.save()
+    return len(missing)
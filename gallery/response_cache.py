@@ -0,0 +1,202 @@
+""" Cache of listings that every user gets the same response for.
+
+Responses are cached per namespace (e.g. "trending"), keyed by the url they were
+requested with, so every page or cursor is cached on its own. Data changes don't
+delete entries: they invalidate a whole namespace by replacing its version, which
+is part of the keys, so entries of the old version are never read again and
+expire. Versions are random tokens, so a version evicted from the cache can't
+come back as an old one.
+Changes that only touch the listed objects, not which objects a page lists or in
+which order (e.g. likes changing likes_count), invalidate those objects only
+(see invalidate_objects): the cached pages holding them are dropped, the others
+are still served.
+
+The cache is a local memory LRU cache by default, which is only shared by the
+threads of one process: with several worker processes every process caches its
+own pages and doesn't see the invalidations made by the others, so their stale
+pages are served until they expire. Set GALLERY_RESPONSE_CACHE to the name of a
+django cache shared by the processes (e.g. memcached or redis) in that case.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+PUBLIC_GALLERIES = "public_galleries"
+TRENDING = "trending"
+
+
+def get_timeout():
+    """ Seconds a response is cached at most, 0 disables the cache. """
+    return getattr(settings, "GALLERY_RESPONSE_CACHE_TIMEOUT", 60)
+
+
+def get_max_entries():
+    return getattr(settings, "GALLERY_RESPONSE_CACHE_MAX_ENTRIES", 1000)
+
+
+class LRUCache:
+    """ Thread safe local memory cache of at most max_entries values, dropping the
+        least recently used one when full. Implements the get, set and delete
+        methods of django caches used here.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout=None):
+        """ Store value for timeout seconds, forever if timeout is None. """
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        alias = getattr(settings, "GALLERY_RESPONSE_CACHE", None)
+        _backend = caches[alias] if alias else LRUCache(get_max_entries())
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting.startswith("GALLERY_RESPONSE_CACHE"):
+        _backend = None
+
+
+def version_key(namespace):
+    return "gallery:responses:%s" % namespace
+
+
+def get_version(namespace):
+    backend = get_backend()
+    version = backend.get(version_key(namespace))
+    if version is None:
+        version = uuid.uuid4().hex
+        backend.set(version_key(namespace), version, None)
+    return version
+
+
+def entry_key(namespace, url):
+    """ Key of the response of url in the current version of namespace. Take it
+        before reading the data, so data read before a change is stored under the
+        old version.
+    """
+    return "gallery:responses:%s:%s:%s" % (
+        namespace,
+        get_version(namespace),
+        hashlib.md5(url.encode()).hexdigest(),
+    )
+
+
+def changed_key(namespace, pk):
+    return "gallery:responses:%s:changed:%s" % (namespace, pk)
+
+
+def changed_since(namespace, pks, read_at):
+    """ Whether one of the objects of namespace with pks was invalidated after
+        read_at (a time.time() taken before they were read).
+    """
+    changes = get_backend().get_many([changed_key(namespace, pk) for pk in pks])
+    return any(changed_at >= read_at for changed_at in changes.values())
+
+
+def lookup(key):
+    """ Cached (data, digest) of key, None if it isn't cached or one of the
+        objects it lists was invalidated since.
+    """
+    if not get_timeout():
+        return None
+    entry = get_backend().get(key)
+    if entry is None:
+        return None
+    data, digest, namespace, pks, read_at = entry
+    if changed_since(namespace, pks, read_at):
+        return None
+    return data, digest
+
+
+def store(key, data, digest, namespace, pks, read_at):
+    """ Cache data (with the digest of its content) listing the objects of
+        namespace with pks, read from the database after read_at.
+    """
+    if get_timeout() and not changed_since(namespace, pks, read_at):
+        get_backend().set(
+            key, (data, digest, namespace, list(pks), read_at), get_timeout()
+        )
+
+
+def bump(namespace):
+    get_backend().set(version_key(namespace), uuid.uuid4().hex, None)
+
+
+def invalidate(*namespaces):
+    """ Drop the cached responses of namespaces, now and once the current
+        transaction is committed, so that a response cached by a concurrent
+        request before the change was visible is dropped too.
+    """
+    for namespace in namespaces:
+        bump(namespace)
+        transaction.on_commit(lambda namespace=namespace: bump(namespace))
+
+
+def mark_changed(namespace, pks):
+    # an entry lives get_timeout() seconds at most, so do the marks
+    changed_at = time.time()
+    backend = get_backend()
+    for pk in pks:
+        backend.set(changed_key(namespace, pk), changed_at, get_timeout())
+
+
+def invalidate_objects(namespace, pks):
+    """ Drop the cached responses of namespace listing one of the objects with
+        pks, now and once the current transaction is committed, like invalidate.
+    """
+    pks = list(pks)
+    mark_changed(namespace, pks)
+    transaction.on_commit(lambda: mark_changed(namespace, pks))
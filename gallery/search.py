@@ -0,0 +1,197 @@
+""" Full-text search of photos by their title and description.
+
+Photos are found through an inverted index of the words of their title and
+description, so a search reads the postings of its words instead of scanning
+the photos:
+- on SQLite with FTS5, the gallery_photo_search FTS5 table, whose rowid is the
+  photo id. Results are ranked by bm25.
+- elsewhere, or with GALLERY_SEARCH_BACKEND = "python", PhotoSearchTerm rows
+  (word, photo, weight) made by tokenizing in Python. The photos having the
+  rarest word of the query are read from the (term, photo) index and looked up
+  for the other words. Results are ranked by the summed weights of the words.
+Either index is updated in the transaction that saves or deletes a photo (see
+gallery.signals), photos created in bulk are indexed with index_photos.
+A photo matches when its title and description have all the words of the query,
+words are lowercased and stripped of accents like FTS5's unicode61 tokenizer
+does, and words of the title weigh TITLE_WEIGHT times more.
+"""
+import re
+import unicodedata
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Subquery, Sum
+from django.dispatch import receiver
+
+from .models import Photo, PhotoSearchTerm
+
+FTS5 = "fts5"
+PYTHON = "python"
+
+FTS_TABLE = "gallery_photo_search"
+TITLE_WEIGHT = 2
+# longer words aren't indexed, nor searched
+MAX_WORD_LENGTH = 100
+MAX_QUERY_WORDS = 10
+# words are told apart as rarer than others up to that many photos
+MAX_POSTINGS_COUNT = 1000
+BATCH_SIZE = 500
+
+WORD_RE = re.compile(r"[^\W_]+")
+
+_backend = None
+
+
+def get_backend():
+    """ FTS5 if the database has the FTS5 table, else PYTHON, unless
+        GALLERY_SEARCH_BACKEND says which.
+    """
+    global _backend
+    if _backend is None:
+        _backend = getattr(settings, "GALLERY_SEARCH_BACKEND", None)
+        if _backend is None:
+            has_table = connection.vendor == "sqlite" and (
+                FTS_TABLE in connection.introspection.table_names()
+            )
+            _backend = FTS5 if has_table else PYTHON
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == "GALLERY_SEARCH_BACKEND":
+        _backend = None
+
+
+def tokenize(text):
+    """ Lowercased words of text, without accents. """
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [word for word in WORD_RE.findall(text) if len(word) <= MAX_WORD_LENGTH]
+
+
+def photo_terms(title, description):
+    """ Weight of every word of a photo: its number of occurrences, the ones in
+        the title counting TITLE_WEIGHT times.
+    """
+    weights = Counter(tokenize(description))
+    for word in tokenize(title):
+        weights[word] += TITLE_WEIGHT
+    return weights
+
+
+def batches(items):
+    """ Lists of at most BATCH_SIZE items, items are read as they are needed. """
+    items = iter(items)
+    batch = list(islice(items, BATCH_SIZE))
+    while batch:
+        yield batch
+        batch = list(islice(items, BATCH_SIZE))
+
+
+def unindex_photos(photo_ids):
+    """ Remove photos from the FTS5 index, PhotoSearchTerm rows are deleted with
+        their photo.
+    """
+    if get_backend() != FTS5:
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(photo_ids):
+            cursor.execute(
+                "DELETE FROM %s WHERE rowid IN (%s)"
+                % (FTS_TABLE, ", ".join(["%s"] * len(batch))),
+                batch,
+            )
+
+
+def index_photos(photos):
+    """ Index (again) the title and description of photos, which must have
+        their id.
+    """
+    with transaction.atomic():
+        for batch in batches(photos):
+            if get_backend() == FTS5:
+                unindex_photos([photo.pk for photo in batch])
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        "INSERT INTO %s (rowid, title, description) "
+                        "VALUES (%%s, %%s, %%s)" % FTS_TABLE,
+                        [(photo.pk, photo.title, photo.description) for photo in batch],
+                    )
+            else:
+                PhotoSearchTerm.objects.filter(
+                    photo_id__in=[photo.pk for photo in batch]
+                ).delete()
+                PhotoSearchTerm.objects.bulk_create(
+                    PhotoSearchTerm(photo_id=photo.pk, term=term, weight=weight)
+                    for photo in batch
+                    for term, weight in photo_terms(
+                        photo.title, photo.description
+                    ).items()
+                )
+
+
+def rebuild():
+    """ Index all photos from scratch, e.g. after changing GALLERY_SEARCH_BACKEND.
+        Returns the number of indexed photos.
+    """
+    with transaction.atomic():
+        if get_backend() == FTS5:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM %s" % FTS_TABLE)
+        else:
+            PhotoSearchTerm.objects.all().delete()
+        photos = Photo.objects.only("pk", "title", "description").order_by("pk")
+        count = 0
+        for batch in batches(photos.iterator()):
+            index_photos(batch)
+            count += len(batch)
+    return count
+
+
+def query_words(query):
+    """ Distinct words of a search query, in order, at most MAX_QUERY_WORDS. """
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_WORDS]
+
+
+def postings_count(word):
+    """ Number of photos having word, counted up to MAX_POSTINGS_COUNT. """
+    return PhotoSearchTerm.objects.filter(term=word)[:MAX_POSTINGS_COUNT].count()
+
+
+def search(photos, words):
+    """ Photos of the queryset photos having all words, best match first, with
+        their rank (lower is better).
+    """
+    if get_backend() == FTS5:
+        # words only have letters and digits, quoted they are plain FTS5 terms
+        match = " ".join('"%s"' % word for word in words)
+        return photos.extra(
+            select={"rank": "bm25(%s, %d, 1)" % (FTS_TABLE, TITLE_WEIGHT)},
+            tables=[FTS_TABLE],
+            where=[
+                "%s.rowid = %s.id" % (FTS_TABLE, Photo._meta.db_table),
+                "%s MATCH %%s" % FTS_TABLE,
+            ],
+            params=[match],
+        ).order_by("rank", "id")
+    # the postings of the rarest word are read, the other words are looked up
+    # in the (term, photo) index for each of its photos
+    rarest = min(words, key=postings_count) if len(words) > 1 else words[0]
+    terms = PhotoSearchTerm.objects.filter(photo=OuterRef("pk"))
+    photos = photos.filter(search_terms__term=rarest)
+    for word in words:
+        if word != rarest:
+            photos = photos.filter(Exists(terms.filter(term=word)))
+    weights = (
+        terms.filter(term__in=words)
+        .order_by()
+        .values("photo")
+        .annotate(weight=Sum("weight"))
+        .values("weight")
+    )
+    return photos.annotate(rank=-Subquery(weights)).order_by("rank", "id")
@@ -0,0 +1,182 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import access, blobs, response_cache, search, trending
+from .likes import LIKES_LISTINGS, change_likes_count
+from .models import Gallery, Photo, PhotoLike, PhotoRendition
+
+User = get_user_model()
+
+LIKED_MODELS = (Gallery, Photo)
+
+IMAGE_MODELS = (Photo, PhotoRendition)
+
+
+def update_likes_count(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """ Keep likes_count in sync with the likes many to many table.
+        -forward side (gallery.likes.add(user)): instance is the liked object
+         and pk_set holds user ids.
+        -reverse side (user.liked_galleries.add(gallery)): instance is the user
+         and pk_set holds ids of the liked objects.
+        pk_set of post_add only holds the rows that were actually inserted, removals
+        are counted before the rows are deleted so that removing a missing like
+        has no effect. Both run inside the transaction django opens for the change.
+    """
+    liked_model = model if reverse else instance.__class__
+    through = liked_model.likes.through
+    liked_field = liked_model.likes.field.m2m_field_name()
+    user_field = liked_model.likes.field.m2m_reverse_field_name()
+
+    if action == "post_add" and pk_set:
+        if reverse:
+            change_likes_count(liked_model, pk_set, 1)
+        else:
+            change_likes_count(liked_model, [instance.pk], len(pk_set))
+    elif action == "pre_remove" and pk_set:
+        if reverse:
+            pks = liked_model.objects.filter(pk__in=pk_set, likes=instance).values_list(
+                "pk", flat=True
+            )
+            change_likes_count(liked_model, list(pks), -1)
+        else:
+            removed = through.objects.filter(
+                **{liked_field: instance, "%s__in" % user_field: pk_set}
+            ).count()
+            if removed:
+                change_likes_count(liked_model, [instance.pk], -removed)
+    elif action == "pre_clear":
+        if reverse:
+            pks = liked_model.objects.filter(likes=instance).values_list(
+                "pk", flat=True
+            )
+            change_likes_count(liked_model, list(pks), -1)
+        else:
+            response_cache.invalidate_objects(
+                LIKES_LISTINGS[liked_model], [instance.pk]
+            )
+            liked_model.objects.filter(pk=instance.pk).update(
+                likes_count=0, updated_at=timezone.now()
+            )
+
+
+for liked_model in LIKED_MODELS:
+    m2m_changed.connect(
+        update_likes_count,
+        sender=liked_model.likes.through,
+        dispatch_uid="update_%s_likes_count" % liked_model._meta.model_name,
+    )
+
+
+@receiver(m2m_changed, sender=PhotoLike, dispatch_uid="update_trending_photos")
+def update_trending_photos(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Add or remove the weight of changed likes to the trending score of photos.
+        Connected after update_likes_count so that likes_count is already up to date.
+    """
+    if action not in ("post_add", "pre_remove", "pre_clear"):
+        return
+    if action != "pre_clear" and not pk_set:
+        return
+    if reverse:
+        likes = PhotoLike.objects.filter(user=instance)
+        if pk_set is not None:
+            likes = likes.filter(photo_id__in=pk_set)
+    else:
+        likes = PhotoLike.objects.filter(photo=instance)
+        if pk_set is not None:
+            likes = likes.filter(user_id__in=pk_set)
+    likes = likes.values_list("photo_id", "created_at")
+    if action == "post_add":
+        trending.add_likes(likes)
+    else:
+        trending.remove_likes(likes)
+
+
+@receiver(post_save, sender=Gallery, dispatch_uid="update_trending_listing")
+def update_trending_listing(sender, instance, created, **kwargs):
+    if not created:
+        trending.update_gallery_listing(instance)
+
+
+@receiver(post_save, sender=Gallery, dispatch_uid="invalidate_saved_gallery_access")
+@receiver(post_delete, sender=Gallery, dispatch_uid="invalidate_deleted_gallery_access")
+def invalidate_gallery_access(sender, instance, **kwargs):
+    access.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Gallery, dispatch_uid="invalidate_saved_gallery_listing")
+def invalidate_saved_gallery_listing(sender, instance, created, **kwargs):
+    # an updated private gallery may have been public before
+    if instance.public or not created:
+        response_cache.invalidate(response_cache.PUBLIC_GALLERIES)
+
+
+@receiver(
+    post_delete, sender=Gallery, dispatch_uid="invalidate_deleted_gallery_listing"
+)
+def invalidate_deleted_gallery_listing(sender, instance, **kwargs):
+    if instance.public:
+        response_cache.invalidate(response_cache.PUBLIC_GALLERIES)
+
+
+@receiver(post_save, sender=Photo, dispatch_uid="invalidate_saved_photo_listing")
+def invalidate_saved_photo_listing(sender, instance, created, **kwargs):
+    # a new photo has no likes so it isn't trending yet
+    if not created:
+        response_cache.invalidate(response_cache.TRENDING)
+
+
+@receiver(post_delete, sender=Photo, dispatch_uid="invalidate_deleted_photo_listing")
+def invalidate_deleted_photo_listing(sender, instance, **kwargs):
+    response_cache.invalidate(response_cache.TRENDING)
+
+
+@receiver(post_save, sender=Photo, dispatch_uid="index_saved_photo")
+def index_saved_photo(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {"title", "description"} & set(update_fields):
+        search.index_photos([instance])
+
+
+@receiver(post_delete, sender=Photo, dispatch_uid="unindex_deleted_photo")
+def unindex_deleted_photo(sender, instance, **kwargs):
+    search.unindex_photos([instance.pk])
+
+
+@receiver(pre_delete, sender=User, dispatch_uid="remove_deleted_user_likes")
+def remove_deleted_user_likes(sender, instance, **kwargs):
+    """ Likes of a deleted user are removed by cascade without m2m_changed signals,
+        so decrement the counters of everything they liked before the rows go away
+        and take the likes out of the trending scores.
+    """
+    for liked_model in LIKED_MODELS:
+        pks = liked_model.objects.filter(likes=instance).values_list("pk", flat=True)
+        change_likes_count(liked_model, list(pks), -1)
+    trending.remove_likes(
+        PhotoLike.objects.filter(user=instance).values_list("photo_id", "created_at")
+    )
+
+
+def acquire_image_blob(sender, instance, created, **kwargs):
+    if created:
+        blobs.acquire(instance.image.name)
+
+
+def release_image_blob(sender, instance, **kwargs):
+    """ The file itself is deleted later by collect_blobs, as other photos may
+        share it and the deletion may still be rolled back.
+    """
+    blobs.release(instance.image.name)
+
+
+for image_model in IMAGE_MODELS:
+    post_save.connect(
+        acquire_image_blob,
+        sender=image_model,
+        dispatch_uid="acquire_%s_blob" % image_model._meta.model_name,
+    )
+    post_delete.connect(
+        release_image_blob,
+        sender=image_model,
+        dispatch_uid="release_%s_blob" % image_model._meta.model_name,
+    )
@@ -0,0 +1,147 @@
+""" Near-duplicate photo search with perceptual hashes.
+
+Every processed photo gets a 64 bit difference hash (dHash) of its image, which
+stays the same or changes by a few bits when the image is resized, recompressed
+or slightly edited, so the number of differing bits (hamming distance) between
+two hashes tells how similar two images look.
+
+Lookups use multi-index hashing: the hash is also stored as 4 indexed 16 bit
+chunks. Two hashes within distance d have at least one chunk within d // 4 bits
+(pigeonhole), so candidates are fetched with index lookups of the few chunk
+values that close to the query, then checked with the exact distance, instead of
+scanning every hash.
+"""
+from itertools import combinations
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image
+
+from .models import Photo
+from .renditions import open_image
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_FIELDS = ["dhash_%d" % i for i in range(CHUNKS)]
+
+# a chunk radius of 2 already looks up 4 * 137 chunk values
+MAX_DISTANCE = 3 * CHUNKS - 1
+
+
+def get_default_distance():
+    return getattr(settings, "GALLERY_SIMILAR_MAX_DISTANCE", 10)
+
+
+def dhash(image):
+    """ Difference hash of a PIL image: whether each pixel of a 9x8 grayscale
+        thumbnail is brighter than its right neighbour, row by row.
+    """
+    image = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            left, right = pixels[offset + column], pixels[offset + column + 1]
+            value = value << 1 | (left > right)
+    return value
+
+
+def photo_hash(photo):
+    # decoding a JPEG at a small scale is enough, the image is shrunk to 9x8
+    return dhash(open_image(photo, (64, 64)))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def to_signed(value):
+    """ Store the unsigned 64 bit hash in a signed BigIntegerField. """
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def split_hash(value):
+    """ Chunks of a hash, from the most significant one. """
+    mask = (1 << CHUNK_BITS) - 1
+    return [value >> (CHUNK_BITS * (CHUNKS - 1 - i)) & mask for i in range(CHUNKS)]
+
+
+def hash_fields(value):
+    """ Values of the Photo hash fields for the hash value. """
+    fields = dict(zip(CHUNK_FIELDS, split_hash(value)))
+    fields["dhash"] = to_signed(value)
+    return fields
+
+
+def neighbours(chunk, distance):
+    """ All chunk values within distance bits of chunk. """
+    values = [chunk]
+    for flipped in range(1, distance + 1):
+        for bits in combinations(range(CHUNK_BITS), flipped):
+            value = chunk
+            for bit in bits:
+                value ^= 1 << bit
+            values.append(value)
+    return values
+
+
+def update_photo_hash(photo):
+    """ Compute and save the hash of a photo image. """
+    value = photo_hash(photo)
+    Photo.objects.filter(pk=photo.pk).update(**hash_fields(value))
+    return value
+
+
+def candidates(value, distance):
+    """ Hashes of all photos sharing a chunk within distance // CHUNKS bits of value. """
+    radius = distance // CHUNKS
+    condition = Q()
+    for field, chunk in zip(CHUNK_FIELDS, split_hash(value)):
+        condition |= Q(**{"%s__in" % field: neighbours(chunk, radius)})
+    return Photo.objects.filter(condition).values_list("pk", "dhash")
+
+
+def within_distance(rows, value, distance):
+    """ (pk, distance) of the (pk, signed hash) rows within distance of value,
+        closest first.
+    """
+    matches = []
+    for pk, signed in rows:
+        row_distance = hamming(value, to_unsigned(signed))
+        if row_distance <= distance:
+            matches.append((pk, row_distance))
+    matches.sort(key=lambda match: (match[1], match[0]))
+    return matches
+
+
+def similar_photos(queryset, value, distance):
+    """ (pk, distance) of photos of queryset whose hash is within distance bits
+        of value, closest first. distance can't be more than MAX_DISTANCE.
+        Candidates are looked up in all photos and only the matches are then
+        filtered by queryset, so the database can't choose to scan the photos of
+        queryset (e.g. with the gallery index) instead of using the chunk indexes.
+    """
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise ValueError("distance must be between 0 and %d" % MAX_DISTANCE)
+    matches = within_distance(candidates(value, distance), value, distance)
+    if not matches:
+        return []
+    allowed = set(
+        queryset.filter(pk__in=[pk for pk, _ in matches]).values_list("pk", flat=True)
+    )
+    return [match for match in matches if match[0] in allowed]
+
+
+def similar_photos_scan(queryset, value, distance):
+    """ Same as similar_photos by comparing value with every hash of queryset,
+        used as a baseline by the benchmark_similar_photos command.
+    """
+    rows = queryset.filter(dhash__isnull=False).values_list("pk", "dhash")
+    return within_distance(rows.iterator(chunk_size=2000), value, distance)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """ File system storage keeping every file under the SHA-256 of its content:
+            blobs/<2 first hex digits>/<2 next hex digits>/<hex digest><extension>
+        Only the extension of the name a file is saved with is kept. Saving a file
+        that is already stored doesn't write it again, so identical uploads share
+        one file and a name always refers to the same content.
+        Files can be shared, references to them are counted by gallery.blobs which
+        also deletes the unreferenced ones.
+    """
+
+    prefix = "blobs"
+
+    def blob_name(self, digest, extension):
+        return "{0}/{1}/{2}/{3}{4}".format(
+            self.prefix, digest[:2], digest[2:4], digest, extension.lower()[:10]
+        )
+
+    def is_blob(self, name):
+        return bool(name) and name.startswith(self.prefix + "/")
+
+    def get_available_name(self, name, max_length=None):
+        # the name a file is saved with is replaced by its blob name
+        return name
+
+    def _save(self, name, content):
+        """ Hash content while copying it to a temporary file, then move it into
+            place, so content is read only once.
+        """
+        directory = self.path(self.prefix)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, "wb") as temporary_file:
+                if hasattr(content, "seek"):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+            return self.adopt(
+                temporary_path, digest.hexdigest(), os.path.splitext(name)[1]
+            )
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def adopt(self, path, digest, extension):
+        """ Move the local file at path, whose SHA-256 hex digest is digest, into
+            the storage and return its name. The file is removed if the storage
+            already holds the same content.
+        """
+        name = self.blob_name(digest, extension)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            os.remove(path)
+            # tell the garbage collector the blob was just used
+            os.utime(full_path)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(path, full_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+
+blob_storage = ContentAddressedStorage()
@@ -0,0 +1,301 @@
+""" Synthetic users, galleries, photos and likes to load test the service with.
+
+Photos share a few tiny generated images, stored once in blob_storage with their
+renditions and perceptual hash, so generating many photos costs rows and not
+files. Photos are spread over galleries and likes over photos and galleries by a
+power law (the item of rank r gets a weight of 1 / r ** exponent), so a few
+galleries are large and a few photos are liked by many users, like in real data.
+Words of the descriptions are drawn from WORDS by the same power law, and
+cameras from CAMERAS. Photos were taken in the year before their likes.
+Everything is inserted in bulk in one transaction and the same seed always
+generates the same data.
+"""
+import random
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from . import blobs, response_cache, search, similarity, trending
+from .models import Gallery, GalleryLike, Photo, PhotoLike, PhotoRendition
+from .renditions import EXTENSIONS, get_renditions, render
+from .storage import blob_storage
+
+User = get_user_model()
+
+BATCH_SIZE = 500
+# default number of objects of each kind
+SCALE = {
+    "users": 200,
+    "galleries": 500,
+    "photos": 5000,
+    "photo_likes": 50000,
+    "gallery_likes": 5000,
+}
+IMAGE_SIZE = (64, 48)
+WORDS = """
+    sunset beach mountain city night portrait family dog cat street river lake
+    forest snow winter summer spring autumn flower garden bridge tower sky cloud
+    rain sea boat harbor market food coffee friends wedding party concert
+    museum park train station road car bike desert island castle church temple
+    village farm horse bird tree leaf rock cliff waterfall valley field light
+    shadow reflection window door wall stairs roof festival parade
+    stadium game team school library kitchen breakfast dinner birthday holiday
+    travel trip hike camp fire star moon morning evening fog storm wave sand
+""".split()
+CAMERAS = ["iPhone 12", "Pixel 5", "SM-G991B", "Canon EOS 90D", "ILCE-7M3"]
+
+
+def power_law_weights(count, exponent):
+    """ Cumulative weights of count items ranked by a power law of exponent. """
+    cum_weights, weight = [], 0
+    for rank in range(1, count + 1):
+        weight += rank ** -exponent
+        cum_weights.append(weight)
+    return cum_weights
+
+
+def power_law_counts(rng, items, total, exponent, limit=None):
+    """ Spread total over items by a power law of exponent, in a random order of
+        items. Returns a Counter of item to count, counts are capped at limit.
+    """
+    ranked = list(items)
+    rng.shuffle(ranked)
+    cum_weights = power_law_weights(len(ranked), exponent)
+    counts = Counter(rng.choices(ranked, cum_weights=cum_weights, k=total))
+    if limit is not None:
+        for item, count in counts.items():
+            counts[item] = min(count, limit)
+    return counts
+
+
+def next_id(model):
+    """ Lowest id rows of model inserted from now on can have, rows inserted in
+        bulk are read back by their ids.
+    """
+    last = model.objects.order_by("-pk").values_list("pk", flat=True).first()
+    return (last or 0) + 1
+
+
+def generate_text(rng, cum_weights, words=8):
+    """ Sentence of words drawn from WORDS with cum_weights. """
+    text = " ".join(rng.choices(WORDS, cum_weights=cum_weights, k=words))
+    return text.capitalize() + "."
+
+
+def generate_image(rng):
+    """ JPEG content of a small image of random shapes. """
+    image = Image.new("RGB", IMAGE_SIZE, tuple(rng.randrange(256) for _ in "rgb"))
+    draw = ImageDraw.Draw(image)
+    for _ in range(4):
+        x, y = rng.randrange(IMAGE_SIZE[0]), rng.randrange(IMAGE_SIZE[1])
+        draw.ellipse(
+            (x, y, x + rng.randint(8, 32), y + rng.randint(8, 32)),
+            fill=tuple(rng.randrange(256) for _ in "rgb"),
+        )
+    output = BytesIO()
+    image.save(output, "JPEG", quality=80)
+    return image, output.getvalue()
+
+
+def store_images(rng, count):
+    """ Store count generated images with their renditions.
+        Returns dicts of the image name, hash fields and renditions of each.
+    """
+    images = []
+    for _ in range(count):
+        image, content = generate_image(rng)
+        renditions = []
+        for name, spec in get_renditions().items():
+            for image_format in spec["formats"]:
+                size, rendition = render(image, tuple(spec["size"]), image_format)
+                renditions.append(
+                    {
+                        "name": name,
+                        "format": image_format,
+                        "width": size[0],
+                        "height": size[1],
+                        "image": blob_storage.save(
+                            EXTENSIONS[image_format], ContentFile(rendition)
+                        ),
+                    }
+                )
+        images.append(
+            {
+                "image": blob_storage.save("synthetic.jpg", ContentFile(content)),
+                "hash_fields": similarity.hash_fields(similarity.dhash(image)),
+                "renditions": renditions,
+            }
+        )
+    return images
+
+
+def generate(
+    users=SCALE["users"],
+    galleries=SCALE["galleries"],
+    photos=SCALE["photos"],
+    photo_likes=SCALE["photo_likes"],
+    gallery_likes=SCALE["gallery_likes"],
+    images=20,
+    public_ratio=0.8,
+    exponent=1.1,
+    days=7,
+    prefix="synthetic",
+    seed=0,
+):
+    """ Generate data at the given scale, usernames start with prefix.
+        Likes are drawn by a power law and happened in the last days, an object
+        can't be liked more than once by a user so fewer likes than asked for
+        may be created. Returns the number of created objects of each kind.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    stored_images = store_images(rng, images)
+    with transaction.atomic():
+        password = make_password(None)
+        User.objects.bulk_create(
+            (
+                User(
+                    username="%s%d" % (prefix, i),
+                    email="%s%d@example.com" % (prefix, i),
+                    password=password,
+                )
+                for i in range(users)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith=prefix)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        first_gallery, first_photo = next_id(Gallery), next_id(Photo)
+        Gallery.objects.bulk_create(
+            (
+                Gallery(
+                    user_id=rng.choice(user_ids),
+                    name="%s gallery %d" % (prefix, i),
+                    public=rng.random() < public_ratio,
+                )
+                for i in range(galleries)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        gallery_ids = list(
+            Gallery.objects.filter(pk__gte=first_gallery)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+        photo_galleries = sorted(
+            power_law_counts(rng, gallery_ids, photos, exponent).elements()
+        )
+        photo_images = [rng.choice(stored_images) for _ in photo_galleries]
+        word_weights = power_law_weights(len(WORDS), exponent)
+        camera_weights = power_law_weights(len(CAMERAS), exponent)
+        Photo.objects.bulk_create(
+            (
+                Photo(
+                    gallery_id=gallery_id,
+                    title="%s photo %d" % (prefix, i),
+                    description=generate_text(rng, word_weights),
+                    image=image["image"],
+                    processing_status=Photo.READY,
+                    taken_at=now - timedelta(days=days + rng.uniform(0, 365)),
+                    width=IMAGE_SIZE[0],
+                    height=IMAGE_SIZE[1],
+                    orientation=Photo.LANDSCAPE,
+                    camera_model=rng.choices(CAMERAS, cum_weights=camera_weights)[0],
+                    **image["hash_fields"],
+                )
+                for i, (gallery_id, image) in enumerate(
+                    zip(photo_galleries, photo_images)
+                )
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        photo_rows = list(
+            Photo.objects.filter(pk__gte=first_photo)
+            .order_by("pk")
+            .values_list("pk", "image")
+        )
+        search.index_photos(
+            Photo.objects.filter(pk__gte=first_photo)
+            .only("pk", "title", "description")
+            .iterator()
+        )
+        renditions = {image["image"]: image["renditions"] for image in stored_images}
+        PhotoRendition.objects.bulk_create(
+            (
+                PhotoRendition(photo_id=pk, **rendition)
+                for pk, image in photo_rows
+                for rendition in renditions[image]
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        blobs.acquire(
+            *[image for _, image in photo_rows],
+            *[
+                rendition["image"]
+                for _, image in photo_rows
+                for rendition in renditions[image]
+            ],
+        )
+
+        photo_ids = [pk for pk, _ in photo_rows]
+        photo_counts = power_law_counts(
+            rng, photo_ids, photo_likes, exponent, limit=len(user_ids)
+        )
+        PhotoLike.objects.bulk_create(
+            (
+                PhotoLike(
+                    photo_id=photo_id,
+                    user_id=user_id,
+                    created_at=now - timedelta(seconds=rng.uniform(0, days * 86400)),
+                )
+                for photo_id, count in sorted(photo_counts.items())
+                for user_id in rng.sample(user_ids, count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        gallery_counts = power_law_counts(
+            rng, gallery_ids, gallery_likes, exponent, limit=len(user_ids)
+        )
+        GalleryLike.objects.bulk_create(
+            (
+                GalleryLike(
+                    gallery_id=gallery_id,
+                    user_id=user_id,
+                    created_at=now - timedelta(seconds=rng.uniform(0, days * 86400)),
+                )
+                for gallery_id, count in sorted(gallery_counts.items())
+                for user_id in rng.sample(user_ids, count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+        for model, counts in ((Photo, photo_counts), (Gallery, gallery_counts)):
+            liked = model.objects.in_bulk(list(counts))
+            for pk, obj in liked.items():
+                obj.likes_count = counts[pk]
+                obj.updated_at = now
+            model.objects.bulk_update(
+                liked.values(), ["likes_count", "updated_at"], batch_size=BATCH_SIZE
+            )
+        trending.rebuild()
+        response_cache.invalidate(response_cache.PUBLIC_GALLERIES)
+
+    return {
+        "users": len(user_ids),
+        "galleries": len(gallery_ids),
+        "photos": len(photo_ids),
+        "photo_likes": sum(photo_counts.values()),
+        "gallery_likes": sum(gallery_counts.values()),
+        "images": len(stored_images),
+    }
@@ -0,0 +1,39 @@
+""" Background jobs of the gallery app, run by the run_worker command. """
+from django.utils import timezone
+from PIL import Image
+
+from . import exif, renditions, similarity
+from .jobs import job
+from .models import Photo
+
+
+def mark_photo_failed(photo_id):
+    Photo.objects.filter(pk=photo_id).update(
+        processing_status=Photo.FAILED, updated_at=timezone.now()
+    )
+
+
+@job("process_photo", on_failure=mark_photo_failed)
+def process_photo(photo_id):
+    """ Validate the uploaded image of a photo, read its metadata, render its
+        renditions and compute its perceptual hash.
+    """
+    photo = Photo.objects.filter(pk=photo_id).first()
+    if photo is None:
+        # deleted before it was processed
+        return
+    Photo.objects.filter(pk=photo_id).update(
+        processing_status=Photo.PROCESSING, updated_at=timezone.now()
+    )
+    with photo.image.open("rb") as image_file:
+        with Image.open(image_file) as image:
+            # read before verify(), which leaves the image unusable. A
+            # malformed EXIF leaves the metadata empty (see exif.read_exif)
+            metadata = exif.image_metadata(image)
+            image.verify()
+    # renditions are encoded from decoded pixels only, so they carry no EXIF
+    renditions.generate_renditions(photo)
+    similarity.update_photo_hash(photo)
+    Photo.objects.filter(pk=photo_id).update(
+        processing_status=Photo.READY, updated_at=timezone.now(), **metadata
+    )
@@ -1,15 +1,90 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from gallery import (
+    bulk_uploads,
+    exif,
+    jobs,
+    likes,
+    media,
+    metrics,
+    response_cache,
+    search,
+    similarity,
+    uploads,
+)
 from gallery.api.serializers import GallerySerializer
-from gallery.models import Gallery
+from gallery.management.commands import run_worker
+from gallery.asgi import GalleryASGIHandler
+from gallery.models import (
+    Blob,
+    Gallery,
+    GalleryLike,
+    Job,
+    Photo,
+    PhotoLike,
+    PhotoRendition,
+    PhotoUpload,
+    TrendingPhoto,
+)
+from gallery.storage import blob_storage
 
 User = get_user_model()
 
 
+def create_image_file(name="photo.jpg", size=(800, 600), image_format="JPEG"):
+    output = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(output, image_format)
+    return SimpleUploadedFile(name, output.getvalue(), "image/jpeg")
+
+
+class MediaRootTestMixin:
+    """ Store files uploaded by a test case in a temporary MEDIA_ROOT """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
 class GalleryTests(APITestCase):
     """ Test only gallery apis """
 
@@ -31,7 +106,7 @@ class GalleryTests(APITestCase):
         response = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["count"], 2)
-        list = Gallery.objects.annotate(likes_count=Count("likes"))
+        list = Gallery.objects.all()
         self.assertEqual(
             response.data["results"][0], GallerySerializer(list[0]).data,
         )
@@ -59,7 +134,7 @@ class GalleryTests(APITestCase):
         gallery2 = Gallery.objects.create(
             name="gallery2", user=self.user1, public=False
         )
-        list = Gallery.objects.annotate(likes_count=Count("likes")).filter(public=True)
+        list = Gallery.objects.filter(public=True)
         self.client.force_login(self.user1)
         response = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -88,7 +163,7 @@ class GalleryTests(APITestCase):
         gallery2 = Gallery.objects.create(
             name="gallery2", user=self.user1, public=False
         )
-        list = Gallery.objects.annotate(likes_count=Count("likes"))
+        list = Gallery.objects.all()
         url1 = reverse("gallery:api_gallery:get_gallery", args=[gallery1.id])
         url2 = reverse("gallery:api_gallery:get_gallery", args=[gallery2.id])
         self.client.force_login(self.user1)
@@ -115,7 +190,7 @@ class GalleryTests(APITestCase):
         gallery_private = Gallery.objects.create(
             name="gallery2", user=self.user1, public=False
         )
-        list = Gallery.objects.annotate(likes_count=Count("likes"))
+        list = Gallery.objects.all()
         url1 = reverse("gallery:api_gallery:get_gallery", args=[gallery_public.id])
         url2 = reverse("gallery:api_gallery:get_gallery", args=[gallery_private.id])
         # test authentication
@@ -224,3 +299,2515 @@ class GalleryTests(APITestCase):
         gallery.save()
         response = self.client.put(url, data=data, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class PaginationTests(APITestCase):
+    """ Test page number and cursor pagination of list apis """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.galleries = [
+            Gallery.objects.create(name="gallery%d" % i, user=self.user)
+            for i in range(15)
+        ]
+        self.url = reverse("gallery:api_gallery:list_public_galleries")
+        self.client.force_login(self.user)
+
+    def test_page_number_pagination_is_default(self):
+        """
+        Assert galleries are paginated with page numbers ordered by id by default.
+        """
+        response = self.client.get(self.url, {"page": 2}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 15)
+        self.assertEqual(
+            [gallery["id"] for gallery in response.data["results"]],
+            [gallery.id for gallery in self.galleries[10:]],
+        )
+
+    def test_cursor_pagination(self):
+        """
+        Assert cursor pagination lists all galleries in the same order without a count.
+        """
+        response = self.client.get(self.url, {"pagination": "cursor"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        ids = [gallery["id"] for gallery in response.data["results"]]
+        response = self.client.get(response.data["next"], format="json")
+        ids += [gallery["id"] for gallery in response.data["results"]]
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(ids, [gallery.id for gallery in self.galleries])
+
+    def test_unknown_pagination(self):
+        """
+        Assert an unknown pagination mode is rejected.
+        """
+        response = self.client.get(self.url, {"pagination": "offset"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_trending_pagination(self):
+        """
+        Assert trending photos use page numbers unless a cursor is asked for, and
+        cursor pages list photos of the same score once each.
+        """
+        url = reverse("gallery:api_gallery:list_trending_photos")
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.data["count"], 0)
+
+        gallery = self.galleries[0]
+        photos = [
+            Photo.objects.create(gallery=gallery, title="photo%d" % i, image="a.jpg")
+            for i in range(15)
+        ]
+        TrendingPhoto.objects.bulk_create(
+            TrendingPhoto(photo=photo, score=1, listed=True) for photo in photos
+        )
+        response = self.client.get(url, {"pagination": "cursor"}, format="json")
+        self.assertNotIn("count", response.data)
+        ids = [photo["id"] for photo in response.data["results"]]
+        response = self.client.get(response.data["next"], format="json")
+        ids += [photo["id"] for photo in response.data["results"]]
+        self.assertEqual(ids, [photo.id for photo in photos])
+
+
+class LikesCountTests(APITestCase):
+    """ Test the denormalized likes_count of galleries and photos """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.photo = Photo.objects.create(
+            gallery=self.gallery, title="photo1", description="", image="photo1.jpg"
+        )
+
+    def assertLikesCount(self, obj, count):
+        obj.refresh_from_db()
+        self.assertEqual(obj.likes_count, count)
+        self.assertEqual(obj.likes_count, obj.number_of_likes)
+
+    def test_like_api_returns_stored_count(self):
+        """
+        Assert like responses read the stored counter and liking twice counts once.
+        """
+        url = reverse("gallery:api_gallery:like_photo", args=[self.photo.id])
+        self.client.force_login(self.user1)
+        response = self.client.put(url, data={}, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 1})
+        response = self.client.put(url, data={}, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 1})
+        self.assertLikesCount(self.photo, 1)
+
+    def test_like_api_concurrent_likes(self):
+        """
+        Assert a like returns the stored counter when others liked meanwhile.
+        """
+        change_likes_count = likes.change_likes_count
+
+        def liked_meanwhile(model, pks, delta):
+            # another user's like committed after the count was read
+            change_likes_count(model, pks, 1)
+            change_likes_count(model, pks, delta)
+
+        url = reverse("gallery:api_gallery:like_photo", args=[self.photo.id])
+        self.client.force_login(self.user1)
+        with mock.patch.object(likes, "change_likes_count", liked_meanwhile):
+            response = self.client.put(url, data={}, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 2})
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.likes_count, 2)
+
+    def test_unlike_api(self):
+        """
+        Assert unliking removes the like and unliking again has no effect.
+        """
+        url = reverse("gallery:api_gallery:like_gallery", args=[self.gallery.id])
+        self.client.force_login(self.user1)
+        self.client.put(url, data={}, format="json")
+        response = self.client.delete(url, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 0})
+        response = self.client.delete(url, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 0})
+        self.assertLikesCount(self.gallery, 0)
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.data, {"number_of_likes": 0})
+        url = reverse("gallery:api_gallery:like_gallery", args=[self.gallery.id + 1])
+        response = self.client.put(url, data={}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_like_api_does_not_count_likes(self):
+        """
+        Assert liking doesn't read existing likes nor count them.
+        """
+        url = reverse("gallery:api_gallery:like_photo", args=[self.photo.id])
+        self.client.force_login(self.user1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(url, data={}, format="json")
+        sql = " ".join(query["sql"] for query in queries).upper()
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn('FROM "GALLERY_PHOTO_LIKES"', sql)
+
+    def test_like_photos_batch(self):
+        """
+        Assert many photos can be liked and unliked in one request and missing
+        photos are ignored.
+        """
+        photo2 = Photo.objects.create(
+            gallery=self.gallery, title="photo2", description="", image="photo2.jpg"
+        )
+        self.photo.likes.add(self.user2)
+        photo2.likes.add(self.user1)
+        url = reverse("gallery:api_gallery:like_photos")
+        self.client.force_login(self.user1)
+        data = {"like": [self.photo.id, photo2.id + 1], "unlike": [photo2.id]}
+        response = self.client.post(url, data=data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(
+            response.data["results"],
+            [
+                {"id": self.photo.id, "number_of_likes": 2, "liked": True},
+                {"id": photo2.id, "number_of_likes": 0, "liked": False},
+            ],
+        )
+        self.assertLikesCount(self.photo, 2)
+        self.assertLikesCount(photo2, 0)
+        # syncing the same likes again has no effect
+        response = self.client.post(url, data=data, format="json")
+        self.assertLikesCount(self.photo, 2)
+        self.assertLikesCount(photo2, 0)
+
+    def test_like_photos_batch_liked_meanwhile(self):
+        """
+        Assert photos liked between the read of the batch and its transaction,
+        e.g. by a retried batch, aren't counted twice.
+        """
+        photo2 = Photo.objects.create(
+            gallery=self.gallery, title="photo2", description="", image="photo2.jpg"
+        )
+        liked_ids = likes.liked_ids
+
+        def like_meanwhile(model, user, pks):
+            # one like is inserted after the transaction read the existing ones
+            PhotoLike.objects.create(photo=self.photo, user=user)
+            Photo.objects.filter(pk=self.photo.pk).update(likes_count=1)
+            return liked_ids(model, user, [pk for pk in pks if pk != self.photo.pk])
+
+        with mock.patch.object(likes, "liked_ids", side_effect=like_meanwhile):
+            results = likes.sync_photo_likes(self.user1, [self.photo.id, photo2.id])
+        self.assertCountEqual(results, [(self.photo.id, 1, True), (photo2.id, 1, True)])
+        self.assertLikesCount(self.photo, 1)
+        self.assertLikesCount(photo2, 1)
+        self.assertEqual(
+            set(TrendingPhoto.objects.values_list("photo_id", flat=True)), {photo2.id}
+        )
+
+    def test_likes_count_follows_likes(self):
+        """
+        Assert likes_count follows adding and removing likes from both sides of
+        the relation and ignores removing a like that doesn't exist.
+        """
+        self.gallery.likes.add(self.user1, self.user2)
+        self.assertLikesCount(self.gallery, 2)
+        self.gallery.likes.remove(self.user1)
+        self.gallery.likes.remove(self.user1)
+        self.assertLikesCount(self.gallery, 1)
+        self.user1.liked_galleries.add(self.gallery)
+        self.assertLikesCount(self.gallery, 2)
+        self.user1.liked_galleries.remove(self.gallery)
+        self.assertLikesCount(self.gallery, 1)
+        self.user2.liked_galleries.clear()
+        self.assertLikesCount(self.gallery, 0)
+        self.photo.likes.add(self.user1, self.user2)
+        self.photo.likes.clear()
+        self.assertLikesCount(self.photo, 0)
+
+    def test_deleted_user_likes_are_uncounted(self):
+        """
+        Assert deleting a user removes their likes from the counters.
+        """
+        self.gallery.likes.add(self.user1, self.user2)
+        self.photo.likes.add(self.user2)
+        self.user2.delete()
+        self.assertLikesCount(self.gallery, 1)
+        self.assertLikesCount(self.photo, 0)
+
+    def test_reconcile_likes_count(self):
+        """
+        Assert reconcile_likes_count command fixes counters that drifted.
+        """
+        self.photo.likes.add(self.user1)
+        Gallery.objects.update(likes_count=5)
+        Photo.objects.update(likes_count=0)
+        call_command("reconcile_likes_count", stdout=StringIO())
+        self.assertLikesCount(self.gallery, 0)
+        self.assertLikesCount(self.photo, 1)
+
+
+class LikeHistoryTests(APITestCase):
+    """ Test likes of a time range and the like history of users """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.public_gallery = Gallery.objects.create(name="public", user=self.user2)
+        self.private_gallery = Gallery.objects.create(
+            name="private", user=self.user2, public=False
+        )
+        self.own_gallery = Gallery.objects.create(
+            name="own", user=self.user1, public=False
+        )
+        self.photos = [
+            Photo.objects.create(
+                gallery=gallery, title="photo", description="", image="photo.jpg"
+            )
+            for gallery in (self.public_gallery, self.private_gallery, self.own_gallery)
+        ]
+        self.now = timezone.now().replace(minute=30)
+        for hours, gallery, photo in zip(
+            (3, 2, 1),
+            (self.public_gallery, self.private_gallery, self.own_gallery),
+            self.photos,
+        ):
+            liked_at = self.now - timedelta(hours=hours)
+            GalleryLike.objects.create(
+                gallery=gallery, user=self.user1, created_at=liked_at
+            )
+            PhotoLike.objects.create(photo=photo, user=self.user1, created_at=liked_at)
+        PhotoLike.objects.create(
+            photo=self.photos[0],
+            user=self.user2,
+            created_at=self.now - timedelta(days=2),
+        )
+        self.client.force_login(self.user1)
+
+    def test_liked_lists(self):
+        """
+        Assert users list what they liked last first, without what they can't view.
+        """
+        url = reverse("gallery:api_gallery:list_liked_galleries")
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [gallery["id"] for gallery in response.data["results"]],
+            [self.own_gallery.id, self.public_gallery.id],
+        )
+        self.assertEqual(
+            response.data["results"][1]["liked_at"],
+            (self.now - timedelta(hours=3)).isoformat().replace("+00:00", "Z"),
+        )
+
+        url = reverse("gallery:api_gallery:list_liked_photos")
+        response = self.client.get(url, format="json")
+        self.assertEqual(
+            [photo["id"] for photo in response.data["results"]],
+            [self.photos[2].id, self.photos[0].id],
+        )
+        self.client.force_login(self.user2)
+        response = self.client.get(url, format="json")
+        self.assertEqual(
+            [photo["id"] for photo in response.data["results"]], [self.photos[0].id]
+        )
+        self.client.logout()
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_likes_by_period(self):
+        """
+        Assert likes of a time range are counted per period.
+        """
+        since = self.now - timedelta(hours=24)
+        self.assertEqual(likes.likes_between(Photo, since).count(), 3)
+        self.assertEqual(
+            likes.likes_between(
+                Gallery, since, until=self.now - timedelta(hours=1)
+            ).count(),
+            2,
+        )
+        hour = self.now.replace(minute=0, second=0, microsecond=0)
+        self.assertEqual(
+            likes.count_likes_by_period(Photo, since),
+            [(hour - timedelta(hours=hours), 1) for hours in (3, 2, 1)],
+        )
+        days = Counter(
+            liked_at.replace(hour=0, minute=0, second=0, microsecond=0)
+            for liked_at in PhotoLike.objects.values_list("created_at", flat=True)
+        )
+        self.assertEqual(
+            likes.count_likes_by_period(
+                Photo, self.now - timedelta(days=3), period="day"
+            ),
+            sorted(days.items()),
+        )
+        out = StringIO()
+        call_command("count_likes", "photos", "--hours=24", stdout=out)
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            [
+                "%s 1" % (hour - timedelta(hours=hours)).isoformat()
+                for hours in (3, 2, 1)
+            ]
+            + ["3 like(s) of photos in the last 24 hour(s)"],
+        )
+
+    def test_liked_list_same_time(self):
+        """
+        Assert pages of a liked list don't repeat or skip photos liked at the
+        same time.
+        """
+        photos = [
+            Photo.objects.create(
+                gallery=self.public_gallery, title="photo", description=""
+            )
+            for _ in range(15)
+        ]
+        likes.sync_photo_likes(self.user2, like_ids=[photo.pk for photo in photos])
+        self.client.force_login(self.user2)
+        url, listed = reverse("gallery:api_gallery:list_liked_photos"), []
+        while url:
+            response = self.client.get(url, format="json")
+            listed += [photo["id"] for photo in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            listed,
+            list(
+                PhotoLike.objects.filter(user=self.user2)
+                .order_by("-created_at", "-pk")
+                .values_list("photo_id", flat=True)
+            ),
+        )
+        self.assertEqual(len(listed), len(photos) + 1)
+
+    @skipUnless(connection.vendor == "sqlite", "Reads SQLite query plans")
+    def test_time_range_query_plans(self):
+        """
+        Assert likes of a time range and liked lists are read from the indexes
+        of the likes.
+        """
+
+        def query_plan(sql, params=()):
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                return [row[-1] for row in cursor.fetchall()]
+
+        since = self.now - timedelta(hours=24)
+        for model, name in ((Gallery, "galleries"), (Photo, "photos")):
+            through = model.likes.through
+            plan = query_plan(
+                *likes.likes_between(model, since).query.sql_with_params()
+            )
+            self.assertIn(through._meta.indexes[1].name, plan[0])
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse("gallery:api_gallery:list_liked_" + name))
+            (sql,) = [
+                query["sql"]
+                for query in queries
+                if "ORDER BY" in query["sql"] and through._meta.db_table in query["sql"]
+            ]
+            plan = query_plan(sql)
+            self.assertTrue(
+                any(through._meta.indexes[0].name in step for step in plan), plan
+            )
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+    def test_liked_by_me(self):
+        """
+        Assert galleries and photos tell whether the request user liked them,
+        read with one query per page, also in listings cached for all users.
+        """
+
+        def get(name, *args):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse("gallery:api_gallery:" + name, args=args), format="json"
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            likes_queries = [
+                query for query in queries if '_likes" WHERE' in query["sql"]
+            ]
+            self.assertEqual(len(likes_queries), 1)
+            return response.data
+
+        Gallery.objects.bulk_create(
+            Gallery(name="gallery%d" % i, user=self.user2) for i in range(5)
+        )
+        data = get("list_create_galleries")
+        self.assertEqual(
+            {gallery["id"] for gallery in data["results"] if gallery["liked_by_me"]},
+            {self.public_gallery.id, self.private_gallery.id, self.own_gallery.id},
+        )
+        data = get("get_gallery", self.public_gallery.id)
+        self.assertTrue(data["liked_by_me"])
+        data = get("list_create_photos", self.public_gallery.id)
+        self.assertTrue(data["results"][0]["liked_by_me"])
+
+        users = ((self.user1, True), (self.user2, False), (self.user1, True))
+        for user, liked in users:
+            self.client.force_login(user)
+            data = get("list_public_galleries")
+            self.assertEqual(data["results"][0]["id"], self.public_gallery.id)
+            self.assertIs(data["results"][0]["liked_by_me"], liked)
+            self.assertFalse(data["results"][1]["liked_by_me"])
+        self.client.put(
+            reverse("gallery:api_gallery:like_gallery", args=[data["results"][1]["id"]])
+        )
+        data = get("list_public_galleries")
+        self.assertTrue(data["results"][1]["liked_by_me"])
+
+
+class TrendingPhotosTests(APITestCase):
+    """ Test the trending photos ranking and api """
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username="user%d" % i, email="user%d@test.com" % i)
+            for i in range(4)
+        ]
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.users[0])
+        self.url = reverse("gallery:api_gallery:list_trending_photos")
+
+    def create_photo(self, title, gallery=None):
+        return Photo.objects.create(
+            gallery=gallery or self.gallery,
+            title=title,
+            description="",
+            image="%s.jpg" % title,
+        )
+
+    def like(self, photo, users, days_ago=0):
+        liked_at = timezone.now() - timedelta(days=days_ago)
+        photo.likes.add(*users, through_defaults={"created_at": liked_at})
+
+    def list_trending(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get(self.url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [photo["id"] for photo in response.data["results"]]
+
+    def test_trending_ordered_by_recent_likes(self):
+        """
+        Assert recent likes weigh more than old ones and more likes rank higher.
+        Assert photos with less than 3 likes are not trending.
+        """
+        old = self.create_photo("old")
+        recent = self.create_photo("recent")
+        popular = self.create_photo("popular")
+        unpopular = self.create_photo("unpopular")
+        self.like(old, self.users[:3], days_ago=3)
+        self.like(recent, self.users[:3])
+        self.like(popular, self.users)
+        self.like(unpopular, self.users[:2])
+        self.assertEqual(self.list_trending(), [popular.id, recent.id, old.id])
+
+    def test_trending_follows_unlikes_and_visibility(self):
+        """
+        Assert unliked photos and photos of private galleries are not trending.
+        """
+        photo = self.create_photo("photo")
+        self.like(photo, self.users[:3])
+        self.assertEqual(self.list_trending(), [photo.id])
+        photo.likes.remove(self.users[0])
+        self.assertEqual(self.list_trending(), [])
+        self.like(photo, self.users[:1])
+        self.gallery.public = False
+        self.gallery.save()
+        self.assertEqual(self.list_trending(), [])
+        self.gallery.public = True
+        self.gallery.save()
+        self.assertEqual(self.list_trending(), [photo.id])
+        photo.likes.clear()
+        self.assertFalse(TrendingPhoto.objects.exists())
+
+    def test_rebuild_trending(self):
+        """
+        Assert rebuild_trending command recomputes the stored scores.
+        """
+        photo = self.create_photo("photo")
+        self.like(photo, self.users[:3], days_ago=1)
+        score = TrendingPhoto.objects.get().score
+        TrendingPhoto.objects.all().delete()
+        call_command("rebuild_trending", stdout=StringIO())
+        trend = TrendingPhoto.objects.get()
+        self.assertAlmostEqual(trend.score, score)
+        self.assertTrue(trend.listed)
+
+
+@override_settings(GALLERY_RESPONSE_CACHE_TIMEOUT=60)
+class ResponseCacheTests(APITestCase):
+    """ Test caching of the public galleries and trending photos listings """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+        self.url = reverse("gallery:api_gallery:list_public_galleries")
+        self.client.force_login(self.user)
+
+    def list_galleries(self, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, format="json", **headers)
+        # liked_by_me of the request user is read from the likes on every request
+        gallery_queries = [
+            query for query in queries if 'FROM "gallery_gallery" ' in query["sql"]
+        ]
+        return response, gallery_queries
+
+    def test_cached_until_changed(self):
+        """
+        Assert a page is served from the cache until a gallery is created, made
+        private or liked.
+        """
+        response, queries = self.list_galleries()
+        self.assertTrue(queries)
+        response, queries = self.list_galleries()
+        self.assertEqual(queries, [])
+        self.assertEqual(response.data["count"], 1)
+
+        Gallery.objects.create(name="gallery2", user=self.user)
+        response, queries = self.list_galleries()
+        self.assertEqual(response.data["count"], 2)
+        self.gallery.public = False
+        self.gallery.save()
+        response, queries = self.list_galleries()
+        self.assertEqual(response.data["count"], 1)
+        gallery = Gallery.objects.get(name="gallery2")
+        self.client.put(reverse("gallery:api_gallery:like_gallery", args=[gallery.id]))
+        response, queries = self.list_galleries()
+        self.assertEqual(response.data["results"][0]["likes_count"], 1)
+
+    def test_like_invalidates_its_page(self):
+        """
+        Assert a like only drops the cached page listing the liked gallery.
+        """
+        galleries = [
+            Gallery.objects.create(name="gallery%d" % i, user=self.user)
+            for i in range(2, 12)
+        ]
+        first_page, second_page = self.url, self.url + "?page=2"
+        for url in (first_page, second_page):
+            self.client.get(url, format="json")
+        self.client.put(
+            reverse("gallery:api_gallery:like_gallery", args=[galleries[-1].id])
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first_page, format="json")
+        self.assertFalse(
+            [query for query in queries if 'FROM "gallery_gallery" ' in query["sql"]]
+        )
+        response = self.client.get(second_page, format="json")
+        self.assertEqual(response.data["results"][0]["likes_count"], 1)
+
+    def test_etag(self):
+        """
+        Assert a page whose ETag is sent in If-None-Match gets a 304 response,
+        until it changes.
+        """
+        response, _ = self.list_galleries()
+        etag = response["ETag"]
+        response, queries = self.list_galleries(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(queries, [])
+        self.assertEqual(response["ETag"], etag)
+
+        self.gallery.name = "renamed"
+        self.gallery.save()
+        response, _ = self.list_galleries(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_per_user(self):
+        """
+        Assert users who liked different galleries of a page get different ETags
+        for it, and responses vary on the credentials.
+        """
+        user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery.likes.add(user2)
+        response, _ = self.list_galleries()
+        etag = response["ETag"]
+        self.assertIn("Cookie", response["Vary"])
+        self.assertIn("Authorization", response["Vary"])
+        self.client.force_login(user2)
+        response, queries = self.list_galleries(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(queries, [])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["results"][0]["liked_by_me"])
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_lru_cache(self):
+        """
+        Assert the local cache drops the least recently used and expired entries.
+        """
+        lru = response_cache.LRUCache(max_entries=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        lru.set("a", 1, timeout=-1)
+        self.assertIsNone(lru.get("a"))
+
+
+class ConditionalRequestTests(MediaRootTestMixin, APITestCase):
+    """ Test validators and caching headers of gallery and media responses """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.url = reverse("gallery:api_gallery:get_gallery", args=[self.gallery.id])
+        self.client.force_login(self.user1)
+
+    def test_gallery_not_modified(self):
+        """
+        Assert a gallery that didn't change since the ETag or date sent gets a 304
+        response from one query of its metadata, and a new ETag once liked.
+        """
+        response = self.client.get(self.url, format="json")
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        gallery_queries = [q for q in queries if '"gallery_gallery"' in q["sql"]]
+        self.assertEqual(len(gallery_queries), 1)
+        self.assertNotIn('"name"', gallery_queries[0]["sql"])
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(
+            reverse("gallery:api_gallery:like_gallery", args=[self.gallery.id])
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["likes_count"], 1)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_gallery_etag_per_user(self):
+        """
+        Assert users who did and didn't like a gallery get different ETags for
+        it, and responses vary on the credentials.
+        """
+        self.gallery.likes.add(self.user2)
+        response = self.client.get(self.url, format="json")
+        etag = response["ETag"]
+        self.assertIn("Cookie", response["Vary"])
+        self.assertIn("Authorization", response["Vary"])
+        self.client.force_login(self.user2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["liked_by_me"])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn("Cookie", response["Vary"])
+
+    def test_private_gallery_not_modified(self):
+        """
+        Assert only the owner of a private gallery gets a 304 response.
+        """
+        self.gallery.public = False
+        self.gallery.save()
+        etag = self.client.get(self.url)["ETag"]
+        self.client.force_login(self.user2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_serve_media(self):
+        """
+        Assert content addressed media are cacheable forever with their digest as
+        ETag, and other files must be revalidated.
+        """
+        content = create_image_file().read()
+        name = blob_storage.save("photo.jpg", SimpleUploadedFile("photo.jpg", content))
+        digest = hashlib.sha256(content).hexdigest()
+        Photo.objects.create(
+            gallery=self.gallery, title="photo", description="", image=name
+        )
+        url = reverse("media", args=[name])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], '"%s"' % digest)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"%s"' % digest)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with open(os.path.join(self.media_root, "legacy.jpg"), "wb") as legacy:
+            legacy.write(content)
+        Photo.objects.create(
+            gallery=self.gallery, title="legacy", description="", image="legacy.jpg"
+        )
+        response = self.client.get(reverse("media", args=["legacy.jpg"]))
+        self.assertIn("no-cache", response["Cache-Control"])
+        last_modified = response["Last-Modified"]
+        response = self.client.get(
+            reverse("media", args=["legacy.jpg"]), HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class MediaServingTests(MediaRootTestMixin, APITestCase):
+    """ Test access to and sending of photo images and renditions """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.content = create_image_file().read()
+        self.name = blob_storage.save(
+            "photo.jpg", SimpleUploadedFile("photo.jpg", self.content)
+        )
+        self.url = reverse("media", args=[self.name])
+
+    def create_photo(self, public, image=None):
+        gallery = Gallery.objects.create(name="gallery", user=self.user1, public=public)
+        return Photo.objects.create(
+            gallery=gallery, title="photo", description="", image=image or self.name
+        )
+
+    def test_access(self):
+        """
+        Assert files of public galleries are served to anyone, files of private
+        galleries to their owner only, and files no photo uses to nobody.
+        """
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        photo = self.create_photo(public=False)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.force_login(self.user2)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.force_login(self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("private", response["Cache-Control"])
+
+        # a rendition of the photo
+        rendition = blob_storage.save("thumb.webp", ContentFile(b"rendition"))
+        PhotoRendition.objects.create(
+            photo=photo,
+            name="thumbnail",
+            format="WEBP",
+            image=rendition,
+            width=1,
+            height=1,
+        )
+        response = self.client.get(reverse("media", args=[rendition]))
+        self.assertEqual(response.status_code, 200)
+        self.client.logout()
+        self.assertEqual(
+            self.client.get(reverse("media", args=[rendition])).status_code, 404
+        )
+
+        # the same image in a public gallery
+        self.create_photo(public=True)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertEqual(
+            self.client.get(reverse("media", args=["../settings.py"])).status_code, 404
+        )
+
+    def test_range_requests(self):
+        """
+        Assert a single byte range gets a 206 response of its bytes, and other
+        ranges the whole file or a 416 response.
+        """
+        self.create_photo(public=True)
+        size = len(self.content)
+        for header, first, last in (
+            ("bytes=0-9", 0, 9),
+            ("bytes=10-", 10, size - 1),
+            ("bytes=-5", size - 5, size - 1),
+            ("bytes=5-%d" % (size * 2), 5, size - 1),
+        ):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(
+                response["Content-Range"], "bytes %d-%d/%d" % (first, last, size)
+            )
+            self.assertEqual(int(response["Content-Length"]), last - first + 1)
+            self.assertEqual(
+                b"".join(response.streaming_content), self.content[first : last + 1]
+            )
+
+        for header in ("bytes=0-1,5-9", "bytes=9-0", "items=0-9", "bytes=x-"):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+        response = self.client.get(self.url, HTTP_RANGE="bytes=%d-" % size)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */%d" % size)
+
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"changed"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_signed_urls(self):
+        """
+        Assert images of private galleries are listed with signed URLs, which
+        serve them to anyone without any query until they expire.
+        """
+        photo = self.create_photo(public=False)
+        rendition = blob_storage.save("thumb.webp", ContentFile(b"rendition"))
+        PhotoRendition.objects.create(
+            photo=photo,
+            name="thumbnail",
+            format="WEBP",
+            image=rendition,
+            width=1,
+            height=1,
+        )
+        public_image = blob_storage.save("public.jpg", ContentFile(b"public"))
+        public_photo = self.create_photo(public=True, image=public_image)
+        self.client.force_login(self.user1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse(
+                    "gallery:api_gallery:list_create_photos", args=[photo.gallery_id]
+                )
+            )
+        gallery_queries = [q for q in queries if 'FROM "gallery_gallery" ' in q["sql"]]
+        self.assertEqual(len(gallery_queries), 1)
+        image_url = response.data["results"][0]["image"]
+        rendition_url = response.data["results"][0]["renditions"][0]["image"]
+        self.assertIn("signature=", image_url)
+        self.assertIn("signature=", rendition_url)
+        response = self.client.get(
+            reverse(
+                "gallery:api_gallery:list_create_photos",
+                args=[public_photo.gallery_id],
+            )
+        )
+        self.assertNotIn("signature=", response.data["results"][0]["image"])
+
+        self.client.logout()
+        for url in (image_url, rendition_url):
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("private", response["Cache-Control"])
+        self.assertEqual(
+            self.client.get(image_url.replace("signature=", "signature=0")).status_code,
+            404,
+        )
+        expires = int(time.time()) - 1
+        expired = "%s?expires=%d&signature=%s" % (
+            self.url,
+            expires,
+            media.get_signature(self.name, expires),
+        )
+        self.assertEqual(self.client.get(expired).status_code, 404)
+        # a signature is only valid for the file it was made for
+        query = image_url.split("?")[1]
+        other = reverse("media", args=[rendition]) + "?" + query
+        self.assertEqual(self.client.get(other).status_code, 404)
+
+    @override_settings(GALLERY_MEDIA_CHUNK_SIZE=100)
+    def test_chunks(self):
+        """
+        Assert files are streamed in chunks of GALLERY_MEDIA_CHUNK_SIZE bytes.
+        """
+        self.create_photo(public=True)
+        response = self.client.get(self.url)
+        chunks = list(response.streaming_content)
+        self.assertEqual(b"".join(chunks), self.content)
+        self.assertEqual({len(chunk) for chunk in chunks[:-1]}, {100})
+        self.assertEqual(response.block_size, 100)
+
+    def test_server_backends(self):
+        """
+        Assert files are left to the fronting server with X-Accel-Redirect or
+        X-Sendfile, after access is checked.
+        """
+        self.create_photo(public=True)
+        with self.settings(GALLERY_MEDIA_BACKEND="x-accel-redirect"):
+            response = self.client.get(self.url)
+            self.assertEqual(
+                response["X-Accel-Redirect"], "/protected-media/" + self.name
+            )
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response["Content-Type"], "image/jpeg")
+        with self.settings(GALLERY_MEDIA_BACKEND="x-sendfile"):
+            response = self.client.get(self.url)
+            self.assertEqual(response["X-Sendfile"], blob_storage.path(self.name))
+            self.assertEqual(response.content, b"")
+            os.remove(blob_storage.path(self.name))
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class SparseFieldsetTests(APITestCase):
+    """ Test choosing the fields of listed objects with ?fields= and ?omit= """
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username="user%d" % i, email="user%d@test.com" % i)
+            for i in range(4)
+        ]
+        self.user = self.users[0]
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+        self.photos = [
+            Photo.objects.create(
+                gallery=self.gallery,
+                title="photo%d" % i,
+                description="description%d" % i,
+                image="photo%d.jpg" % i,
+            )
+            for i in range(12)
+        ]
+        for photo in self.photos[:2]:
+            photo.likes.add(*self.users[:3])
+        self.url = reverse(
+            "gallery:api_gallery:list_create_photos", args=[self.gallery.id]
+        )
+        self.client.force_login(self.user)
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        photo_queries = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "gallery_photo"."id"')
+        ]
+        return response, photo_queries, len(queries)
+
+    def test_fields_as_rows(self):
+        """
+        Assert only the chosen fields, and id, are listed from the rows of their
+        columns, without prefetching renditions or looking up galleries.
+        """
+        response, photo_queries, count = self.get(
+            self.url, {"fields": "title,likes_count,gallery,liked_by_me"}
+        )
+        self.assertEqual(
+            response.data["results"][0],
+            {
+                "id": self.photos[0].id,
+                "title": "photo0",
+                "gallery": self.gallery.id,
+                "likes_count": 3,
+                "liked_by_me": True,
+            },
+        )
+        self.assertFalse(response.data["results"][2]["liked_by_me"])
+        self.assertNotIn("description", photo_queries[-1])
+        # session, user, gallery permission, count, photos and likes
+        self.assertEqual(count, 6)
+
+        response, _, _ = self.get(self.url, {"fields": "title", "page": 2})
+        self.assertEqual(
+            response.data["results"],
+            [{"id": photo.id, "title": photo.title} for photo in self.photos[10:]],
+        )
+
+    def test_omit_with_instances(self):
+        """
+        Assert omitted fields aren't listed nor read, and fields reading model
+        instances, like image, are still serialized from instances.
+        """
+        full = self.client.get(self.url, format="json").data["results"][0]
+        response, photo_queries, _ = self.get(
+            self.url, {"omit": "description,renditions,liked_by_me"}
+        )
+        photo = response.data["results"][0]
+        self.assertEqual(
+            set(full) - set(photo), {"description", "renditions", "liked_by_me"}
+        )
+        self.assertEqual(photo["image"], full["image"])
+        self.assertNotIn("description", photo_queries[-1])
+        self.assertEqual(
+            self.get(self.url, {"omit": "id,title"})[0].data["results"][0]["id"],
+            self.photos[0].id,
+        )
+
+    def test_media_fields(self):
+        """
+        Assert the gallery of photos is read with them when only their image or
+        renditions are listed, instead of one query per photo.
+        """
+        for photo in self.photos[:10]:
+            PhotoRendition.objects.create(
+                photo=photo,
+                name="small",
+                format="webp",
+                image=photo.image.name,
+                width=1,
+                height=1,
+            )
+        # session, user, gallery permission, count and photos
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {"fields": "image"}, format="json")
+        self.assertTrue(response.data["results"][0]["image"])
+        # and renditions
+        with self.assertNumQueries(6):
+            response = self.client.get(
+                self.url, {"fields": "renditions"}, format="json"
+            )
+        self.assertTrue(response.data["results"][0]["renditions"][0]["image"])
+
+    def test_cached_and_cursor_listings(self):
+        """
+        Assert chosen fields work with cursor pagination and cached listings.
+        """
+        url = reverse("gallery:api_gallery:list_trending_photos")
+        params = {"fields": "likes_count,liked_by_me"}
+        response, _, _ = self.get(url, params)
+        self.assertCountEqual(
+            response.data["results"],
+            [
+                {"id": photo.id, "likes_count": 3, "liked_by_me": True}
+                for photo in self.photos[:2]
+            ],
+        )
+        # served from the cache, with liked_by_me of the user
+        self.client.force_login(self.users[3])
+        response, _, count = self.get(url, params)
+        self.assertEqual(
+            [photo["liked_by_me"] for photo in response.data["results"]],
+            [False, False],
+        )
+        # session, user and likes
+        self.assertEqual(count, 3)
+
+        response, _, _ = self.get(
+            self.url, {"fields": "title", "pagination": "cursor", "ordering": "-id"}
+        )
+        titles = [photo["title"] for photo in response.data["results"]]
+        titles += [
+            photo["title"]
+            for photo in self.client.get(response.data["next"]).data["results"]
+        ]
+        self.assertEqual(titles, ["photo%d" % i for i in reversed(range(12))])
+
+    def test_unknown_fields(self):
+        """
+        Assert unknown fields are rejected and writes ignore the parameters.
+        """
+        for params in ({"fields": "title,secret"}, {"omit": "secret"}):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params, format="json")
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse("gallery:api_gallery:list_create_galleries")
+        response = self.client.post(url + "?fields=name", {"name": "gallery2"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("public", response.data)
+
+
+class ASGITests(TransactionTestCase):
+    """ Test serving the api with the ASGI handler """
+
+    def test_asgi_handler(self):
+        """
+        Assert a read endpoint is served by the ASGI handler, with the view run
+        in the thread pool of the handler.
+        """
+        user = User.objects.create(username="user1", email="user1@test.com")
+        Gallery.objects.create(name="gallery1", user=user)
+        self.client.force_login(user)
+        cookie = "%s=%s" % (
+            settings.SESSION_COOKIE_NAME,
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value,
+        )
+        handler = GalleryASGIHandler(max_workers=2)
+        view_threads = []
+        get_response = handler.get_response_in_thread
+
+        def get_response_in_thread(request):
+            view_threads.append(threading.current_thread().name)
+            return get_response(request)
+
+        handler.get_response_in_thread = get_response_in_thread
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("gallery:api_gallery:list_public_galleries"),
+            "query_string": b"",
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(handler(scope, receive, send))
+        handler.executor.shutdown()
+        self.assertEqual(messages[0]["status"], status.HTTP_200_OK)
+        body = json.loads(b"".join(message.get("body", b"") for message in messages))
+        self.assertEqual(body["results"][0]["name"], "gallery1")
+        self.assertTrue(view_threads[0].startswith("asgi-view"))
+
+
+class RequestMetricsTests(APITestCase):
+    """ Test request instrumentation and the metrics endpoint """
+
+    view = "gallery:api_gallery:list_public_galleries"
+
+    def setUp(self):
+        metrics.registry.clear()
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        Gallery.objects.create(name="gallery1", user=self.user)
+        self.url = reverse(self.view)
+        self.client.force_login(self.user)
+
+    def histogram(self, name):
+        return metrics.registry.histograms.get((name, self.view))
+
+    @override_settings(GALLERY_METRICS_SAMPLE_RATE=1)
+    def test_request_metrics(self):
+        """
+        Assert sampled requests are recorded per view and served to staff users
+        in the Prometheus format.
+        """
+        self.client.get(self.url)
+        self.client.get(self.url)
+        duration = self.histogram("gallery_request_duration_seconds")
+        self.assertEqual(duration.count, 2)
+        self.assertGreater(duration.sum, 0)
+        self.assertGreater(self.histogram("gallery_request_queries").sum, 0)
+        self.assertGreater(self.histogram("gallery_request_serialize_seconds").sum, 0)
+        self.assertGreater(self.histogram("gallery_request_render_seconds").sum, 0)
+
+        metrics_url = reverse("gallery:metrics")
+        self.assertEqual(
+            self.client.get(metrics_url).status_code, status.HTTP_403_FORBIDDEN
+        )
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        content = response.content.decode()
+        self.assertIn("# TYPE gallery_request_queries histogram", content)
+        self.assertIn(
+            'gallery_request_duration_seconds_count{view="%s"} 2' % self.view, content
+        )
+        self.assertIn(
+            'gallery_request_queries_bucket{view="%s",le="+Inf"} 2' % self.view,
+            content,
+        )
+
+    @override_settings(GALLERY_METRICS_SAMPLE_RATE=1, GALLERY_METRICS_SLOW_REQUEST=0)
+    def test_slow_request_log(self):
+        """
+        Assert requests slower than the threshold are logged with their queries.
+        """
+        with self.assertLogs("gallery.metrics", "WARNING") as logs:
+            self.client.get(self.url)
+        message = logs.output[0]
+        self.assertIn("Slow request GET %s (%s) 200" % (self.url, self.view), message)
+        self.assertIn("gallery_gallery", message)
+
+    def test_sampling_off(self):
+        """
+        Assert nothing is recorded when sampling is off.
+        """
+        self.client.get(self.url)
+        self.assertEqual(metrics.registry.histograms, {})
+
+
+@override_settings(GALLERY_RESPONSE_CACHE_TIMEOUT=0)
+class QueryBudgetTests(APITestCase):
+    """ Test every list and like api runs a fixed number of bounded queries over
+        thousands of galleries, photos and likes, so N+1 queries and scans of
+        whole tables fail the tests.
+    """
+
+    # (method, url name) budgets, SAVEPOINT statements aren't counted
+    BUDGETS = {
+        ("get", "list_create_galleries"): 3,
+        ("get", "list_public_galleries"): 3,
+        ("get", "list_create_photos"): 5,
+        ("get", "list_trending_photos"): 5,
+        ("put", "like_photo"): 7,
+        ("delete", "like_photo"): 8,
+        ("put", "like_gallery"): 4,
+        ("delete", "like_gallery"): 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            User(username="user%d" % i, email="user%d@test.com" % i) for i in range(50)
+        )
+        cls.users = list(User.objects.order_by("pk"))
+        cls.user = cls.users[0]
+        Gallery.objects.bulk_create(
+            (
+                Gallery(name="gallery%d" % i, user=cls.users[i % 50], public=i % 2 == 0)
+                for i in range(2000)
+            ),
+            batch_size=500,
+        )
+        cls.galleries = list(Gallery.objects.order_by("pk"))
+        Photo.objects.bulk_create(
+            (
+                Photo(
+                    gallery=cls.galleries[i % 40],
+                    title="photo%d" % i,
+                    description="description",
+                    image="gallery/photo%d.jpg" % i,
+                    processing_status=Photo.READY,
+                )
+                for i in range(5000)
+            ),
+            batch_size=500,
+        )
+        cls.photos = list(Photo.objects.order_by("pk").values_list("pk", flat=True))
+        PhotoRendition.objects.bulk_create(
+            (
+                PhotoRendition(
+                    photo_id=pk,
+                    name=name,
+                    format="JPEG",
+                    image="gallery/photo_%s.jpg" % name,
+                    width=width,
+                    height=width,
+                )
+                for pk in cls.photos[:1000]
+                for name, width in (("thumbnail", 200), ("medium", 800))
+            ),
+            batch_size=500,
+        )
+        liked_at = timezone.now()
+        PhotoLike.objects.bulk_create(
+            (
+                PhotoLike(photo_id=pk, user=user, created_at=liked_at)
+                for pk in cls.photos[:1000]
+                for user in cls.users[1:11]
+            ),
+            batch_size=500,
+        )
+        GalleryLike.objects.bulk_create(
+            (
+                GalleryLike(gallery_id=gallery.pk, user_id=user.pk)
+                for gallery in cls.galleries[:1000]
+                for user in cls.users[1:6]
+            ),
+            batch_size=500,
+        )
+        call_command("reconcile_likes_count", stdout=StringIO())
+        call_command("rebuild_trending", stdout=StringIO())
+
+    def setUp(self):
+        # no session queries, only the ones of the api
+        self.client.force_authenticate(self.user)
+
+    def call_api(self, method, name, args=(), data=None):
+        """ Call the api, return its response and the (sql, params) it ran. """
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if not sql.startswith(("SAVEPOINT", "RELEASE", "ROLLBACK")):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        url = reverse("gallery:api_gallery:%s" % name, args=args)
+        with connection.execute_wrapper(record):
+            response = getattr(self.client, method)(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, queries
+
+    def explain(self, sql, params=()):
+        """ Steps of the SQLite query plan of sql. """
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertQueryBudget(self, method, name, args=(), data=None):
+        """ Call the api, assert it runs at most its budget of queries and that
+            no query scans a whole table (or sorts all its rows) on SQLite.
+        """
+        response, queries = self.call_api(method, name, args, data)
+        self.assertLessEqual(
+            len(queries),
+            self.BUDGETS[method, name],
+            "%s %s ran:\n%s" % (method, name, "\n".join(sql for sql, _ in queries)),
+        )
+        if connection.vendor == "sqlite":
+            for sql, params in queries:
+                self.assertBoundedQuery(sql, params)
+        return response
+
+    def assertBoundedQuery(self, sql, params):
+        # page numbers need the total count, ?pagination=cursor doesn't count
+        if not sql.startswith("SELECT") or sql.startswith("SELECT COUNT(*)"):
+            return
+        plan = self.explain(sql, params)
+        for step in plan:
+            # a limited scan in index order stops after the page is read
+            unbounded = step.startswith("SCAN") and " LIMIT " not in sql
+            self.assertFalse(
+                unbounded or step.startswith("USE TEMP B-TREE FOR ORDER BY"),
+                "Unbounded query plan %s of:\n%s" % (plan, sql),
+            )
+
+    def test_list_budgets(self):
+        """
+        Assert list apis run the same bounded queries whatever the page content.
+        """
+        public_gallery, empty_gallery = self.galleries[0], self.galleries[1998]
+        for pagination in ("page", "cursor"):
+            data = {"pagination": pagination}
+            for name in ("list_create_galleries", "list_public_galleries"):
+                response = self.assertQueryBudget("get", name, data=data)
+                self.assertEqual(len(response.data["results"]), 10)
+            for gallery in (public_gallery, empty_gallery):
+                self.assertQueryBudget(
+                    "get", "list_create_photos", args=[gallery.pk], data=data
+                )
+            response = self.assertQueryBudget("get", "list_trending_photos", data=data)
+            self.assertEqual(len(response.data["results"]), 10)
+        self.assertQueryBudget("get", "list_public_galleries", data={"page": 50})
+        self.assertQueryBudget(
+            "get", "list_create_photos", args=[public_gallery.pk], data={"page": 12}
+        )
+
+    @skipUnless(connection.vendor == "sqlite", "Reads SQLite query plans")
+    def test_query_plans_use_indexes(self):
+        """
+        Assert list apis and like lookups read the indexes made for them instead
+        of scanning or sorting tables.
+        """
+        indexes = {
+            "list_public_galleries": Gallery._meta.indexes[0].name,
+            "list_create_photos": Photo._meta.indexes[0].name,
+            "list_trending_photos": TrendingPhoto._meta.indexes[0].name,
+        }
+        for pagination in ("page", "cursor"):
+            for name, index in indexes.items():
+                args = [self.galleries[0].pk] if name == "list_create_photos" else []
+                _, queries = self.call_api(
+                    "get", name, args, {"pagination": pagination}
+                )
+                steps = [
+                    step
+                    for sql, params in queries
+                    if sql.startswith("SELECT")
+                    for step in self.explain(sql, params)
+                ]
+                self.assertTrue(
+                    any(index in step for step in steps), "%s: %s" % (name, steps)
+                )
+                for step in steps:
+                    self.assertNotIn("TEMP B-TREE", step)
+                    self.assertFalse(step.startswith("SCAN") and "INDEX" not in step)
+
+        lookups = [
+            (
+                PhotoLike.objects.filter(photo_id=self.photos[0], user=self.user),
+                "(photo_id=? AND user_id=?)",
+            ),
+            (
+                PhotoLike.objects.filter(user=self.user).values("photo"),
+                PhotoLike._meta.indexes[0].name,
+            ),
+            (
+                self.user.liked_galleries.values("pk"),
+                GalleryLike._meta.indexes[0].name,
+            ),
+        ]
+        for queryset, index in lookups:
+            plan = self.explain(*queryset.query.sql_with_params())
+            self.assertIn(index, plan[0])
+
+    def test_like_budgets(self):
+        """
+        Assert liking and unliking run a fixed number of indexed queries, liked
+        before or not.
+        """
+        for pk in (self.photos[0], self.photos[4000]):
+            self.assertQueryBudget("put", "like_photo", args=[pk])
+            self.assertQueryBudget("put", "like_photo", args=[pk])
+            self.assertQueryBudget("delete", "like_photo", args=[pk])
+        for gallery in (self.galleries[0], self.galleries[1500]):
+            self.assertQueryBudget("put", "like_gallery", args=[gallery.pk])
+            self.assertQueryBudget("delete", "like_gallery", args=[gallery.pk])
+
+
+@override_settings(
+    GALLERY_RENDITIONS={
+        "thumbnail": {"size": (100, 100), "formats": ["JPEG", "WEBP"]},
+        "medium": {"size": (400, 400), "formats": ["JPEG"]},
+    }
+)
+class PhotoRenditionTests(MediaRootTestMixin, APITestCase):
+    """ Test generating renditions of uploaded photos """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+        self.url = reverse(
+            "gallery:api_gallery:list_create_photos", args=[self.gallery.id]
+        )
+        self.client.force_login(self.user)
+
+    def upload_photo(self):
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": self.gallery.id,
+            "image": create_image_file(),
+        }
+        response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def test_upload_creates_renditions(self):
+        """
+        Assert renditions of every configured size and format are created by the
+        background job, fit their size and are listed with the photo.
+        """
+        response = self.upload_photo()
+        self.assertEqual(response.data["processing_status"], Photo.PENDING)
+        self.assertEqual(response.data["renditions"], [])
+        self.assertEqual(jobs.run_pending(), 1)
+        response = self.client.get(self.url, format="json")
+        self.assertEqual(response.data["results"][0]["processing_status"], Photo.READY)
+        renditions = {
+            (rendition["name"], rendition["format"]): rendition
+            for rendition in response.data["results"][0]["renditions"]
+        }
+        self.assertEqual(
+            set(renditions),
+            {("thumbnail", "JPEG"), ("thumbnail", "WEBP"), ("medium", "JPEG")},
+        )
+        self.assertEqual(renditions["thumbnail", "WEBP"]["width"], 100)
+        self.assertEqual(renditions["thumbnail", "WEBP"]["height"], 75)
+        self.assertEqual(renditions["medium", "JPEG"]["width"], 400)
+        photo = Photo.objects.get()
+        for rendition in photo.renditions.all():
+            self.assertTrue(rendition.image.name.startswith("blobs/"))
+            with Image.open(rendition.image.path) as image:
+                self.assertEqual(image.format, rendition.format)
+                self.assertEqual(image.size, (rendition.width, rendition.height))
+
+    def test_generate_renditions_command(self):
+        """
+        Assert generate_renditions command only creates missing renditions.
+        """
+        self.upload_photo()
+        jobs.run_pending()
+        PhotoRendition.objects.filter(format="WEBP").delete()
+        out = StringIO()
+        call_command("generate_renditions", stdout=out)
+        self.assertIn("Created 1 rendition(s)", out.getvalue())
+        out = StringIO()
+        call_command("generate_renditions", stdout=out)
+        self.assertIn("Created 0 rendition(s)", out.getvalue())
+        self.assertEqual(PhotoRendition.objects.count(), 3)
+
+
+class JobTests(MediaRootTestMixin, APITestCase):
+    """ Test the background job queue """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+
+    def test_failed_job_is_retried_then_failed(self):
+        """
+        Assert a failing job is retried later and marked failed once it runs out
+        of attempts, and that failed photo processing marks the photo failed.
+        """
+        photo = Photo.objects.create(
+            gallery=self.gallery,
+            title="photo1",
+            description="description1",
+            image=SimpleUploadedFile("broken.jpg", b"not an image"),
+        )
+        job = jobs.enqueue("process_photo", max_attempts=2, photo_id=photo.pk)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertGreater(job.run_at, timezone.now())
+        # not due before its retry delay
+        self.assertEqual(jobs.run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs("gallery.jobs", "ERROR"):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("Traceback", job.last_error)
+        photo.refresh_from_db()
+        self.assertEqual(photo.processing_status, Photo.FAILED)
+
+    def test_worker_survives_job_errors(self):
+        """
+        Assert a job deleted after it was claimed or of an unknown name, and a
+        run raising outside of the job function, don't stop the worker.
+        """
+        deleted = jobs.enqueue("process_photo", photo_id=0)
+        unknown = jobs.enqueue("process_photo", photo_id=0)
+        crashed = jobs.enqueue("process_photo", photo_id=0)
+        Job.objects.filter(pk=unknown.pk).update(name="removed_task")
+        self.assertEqual(len(jobs.claim(3)), 3)
+        deleted.delete()
+        self.assertIsNone(jobs.run(deleted.pk))
+        with self.assertLogs("gallery.jobs", "ERROR"):
+            self.assertEqual(jobs.run(unknown.pk), Job.FAILED)
+
+        command = run_worker.Command(stdout=StringIO())
+        future = Future()
+        future.set_exception(DatabaseError("database is locked"))
+        with self.assertLogs("gallery.jobs", "ERROR"):
+            command.job_done(crashed.pk, future)
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, Job.PENDING)
+        self.assertIn("database is locked", crashed.last_error)
+
+    def test_expired_lease_is_claimed_again(self):
+        """
+        Assert a running job whose worker died is claimed again and a claimed job
+        isn't claimed twice.
+        """
+        job = jobs.enqueue("process_photo", photo_id=0)
+        self.assertEqual(jobs.claim(10), [job.pk])
+        self.assertEqual(jobs.claim(10), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(jobs.claim(10), [job.pk])
+        jobs.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+
+class BlobStorageTests(MediaRootTestMixin, APITestCase):
+    """ Test content addressed storage of images """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+        self.url = reverse(
+            "gallery:api_gallery:list_create_photos", args=[self.gallery.id]
+        )
+        self.client.force_login(self.user)
+
+    def upload_photo(self, name, color=(200, 30, 30)):
+        output = BytesIO()
+        Image.new("RGB", (80, 60), color).save(output, "JPEG")
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": self.gallery.id,
+            "image": SimpleUploadedFile(name, output.getvalue(), "image/jpeg"),
+        }
+        response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Photo.objects.get(pk=response.data["id"])
+
+    def test_identical_images_share_a_file(self):
+        """
+        Assert identical uploads are stored once under the hash of their content
+        and the file is counted once per photo.
+        """
+        photo1 = self.upload_photo("photo1.jpg")
+        photo2 = self.upload_photo("photo2.JPG")
+        photo3 = self.upload_photo("photo3.jpg", color=(30, 30, 200))
+        self.assertEqual(photo1.image.name, photo2.image.name)
+        self.assertNotEqual(photo1.image.name, photo3.image.name)
+        with photo1.image.open("rb") as image_file:
+            digest = hashlib.sha256(image_file.read()).hexdigest()
+        self.assertEqual(photo1.image.name, blob_storage.blob_name(digest, ".jpg"))
+        self.assertEqual(Blob.objects.get(name=photo1.image.name).refcount, 2)
+        self.assertEqual(Blob.objects.get(name=photo3.image.name).refcount, 1)
+
+    def test_collect_blobs(self):
+        """
+        Assert deleting photos releases their files, which collect_blobs deletes
+        once unused for the grace period, while shared files are kept.
+        """
+        photo1 = self.upload_photo("photo1.jpg")
+        photo2 = self.upload_photo("photo2.jpg")
+        photo3 = self.upload_photo("photo3.jpg", color=(30, 30, 200))
+        jobs.run_pending()
+        self.assertEqual(Blob.objects.get(name=photo3.image.name).refcount, 1)
+        renditions = set(photo3.renditions.values_list("image", flat=True))
+        self.assertTrue(renditions)
+        photo1.delete()
+        photo3.delete()
+        self.assertEqual(Blob.objects.get(name=photo3.image.name).refcount, 0)
+        for name in renditions:
+            self.assertEqual(Blob.objects.get(name=name).refcount, 0)
+
+        out = StringIO()
+        call_command("collect_blobs", stdout=out)
+        self.assertIn("Deleted 0 unused file(s)", out.getvalue())
+        Blob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        past = (timezone.now() - timedelta(hours=2)).timestamp()
+        for name in Blob.objects.values_list("name", flat=True):
+            os.utime(blob_storage.path(name), (past, past))
+        out = StringIO()
+        call_command("collect_blobs", stdout=out)
+        self.assertIn(
+            "Deleted %d unused file(s)" % (len(renditions) + 1), out.getvalue()
+        )
+        self.assertTrue(blob_storage.exists(photo2.image.name))
+        self.assertFalse(blob_storage.exists(photo3.image.name))
+        self.assertFalse(Blob.objects.filter(name=photo3.image.name).exists())
+        for name in photo2.renditions.values_list("image", flat=True):
+            self.assertTrue(blob_storage.exists(name))
+
+
+class GalleryAccessTests(MediaRootTestMixin, APITestCase):
+    """ Test galleries are fetched once per request for permission checks """
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.other_gallery = Gallery.objects.create(name="gallery2", user=self.user1)
+        self.url = reverse(
+            "gallery:api_gallery:list_create_photos", args=[self.gallery.id]
+        )
+
+    def gallery_queries(self, queries):
+        return [query for query in queries if 'FROM "gallery_gallery"' in query["sql"]]
+
+    def test_create_photo_fetches_gallery_once(self):
+        """
+        Assert permissions and serializer share one gallery query and the photo
+        is added to the gallery of the url.
+        """
+        self.client.force_login(self.user1)
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": self.gallery.id,
+            "image": create_image_file(),
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.gallery_queries(queries)), 1)
+
+        data = dict(data, gallery=self.other_gallery.id, image=create_image_file())
+        response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.data["gallery"], self.gallery.id)
+        data = dict(data, gallery=0, image=create_image_file())
+        response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(GALLERY_ACCESS_CACHE_TIMEOUT=60)
+    def test_access_cache(self):
+        """
+        Assert gallery visibility is cached across requests and saving the gallery
+        invalidates it.
+        """
+        self.client.force_login(self.user2)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.gallery_queries(queries), [])
+
+        self.gallery.public = False
+        self.gallery.save()
+        self.assertEqual(
+            self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN
+        )
+        self.gallery.delete()
+        self.assertEqual(
+            self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND
+        )
+
+
+class SimilarPhotoTests(MediaRootTestMixin, APITestCase):
+    """ Test the perceptual hash search of similar photos """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.client.force_login(self.user1)
+
+    def upload_photo(self, image, gallery=None, quality=90):
+        gallery = gallery or self.gallery
+        output = BytesIO()
+        image.save(output, "JPEG", quality=quality)
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": gallery.id,
+            "image": SimpleUploadedFile("photo.jpg", output.getvalue(), "image/jpeg"),
+        }
+        self.client.force_login(gallery.user)
+        url = reverse("gallery:api_gallery:list_create_photos", args=[gallery.id])
+        response = self.client.post(url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def similar(self, photo_id, **params):
+        url = reverse(
+            "gallery:api_gallery:list_similar_photos", args=[self.gallery.id, photo_id]
+        )
+        return self.client.get(url, params, format="json")
+
+    def test_similar_photos(self):
+        """
+        Assert resized and recompressed copies of an image are found closest
+        first, and other images or photos of other galleries aren't.
+        """
+        image = Image.radial_gradient("L").convert("RGB").resize((400, 300))
+        other = Image.linear_gradient("L").convert("RGB").resize((400, 300))
+        original = self.upload_photo(image)
+        copy = self.upload_photo(image, quality=30)
+        resized = self.upload_photo(image.resize((200, 150)), quality=50)
+        different = self.upload_photo(other)
+        public_gallery = Gallery.objects.create(name="gallery2", user=self.user2)
+        public_copy = self.upload_photo(image, gallery=public_gallery, quality=40)
+        # not processed yet
+        self.client.force_login(self.user1)
+        response = self.similar(original)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        jobs.run_pending()
+
+        response = self.similar(original)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        found = {photo["id"]: photo["distance"] for photo in response.data}
+        self.assertEqual(set(found), {copy, resized})
+        self.assertEqual(
+            [photo["distance"] for photo in response.data], sorted(found.values())
+        )
+        response = self.similar(original, scope="public")
+        self.assertEqual(
+            {photo["id"] for photo in response.data}, {copy, resized, public_copy}
+        )
+        response = self.similar(original, distance=0, scope="public")
+        self.assertNotIn(different, [photo["id"] for photo in response.data])
+        response = self.similar(original, distance=similarity.MAX_DISTANCE + 1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        Gallery.objects.filter(pk=self.gallery.pk).update(public=False)
+        self.client.force_login(self.user2)
+        self.assertEqual(self.similar(original).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_index_lookup_matches_scan(self):
+        """
+        Assert the multi-index lookup finds the same photos as comparing every
+        hash, for every distance.
+        """
+        rng = random.Random(1)
+        query = rng.getrandbits(64)
+        hashes = [rng.getrandbits(64) for _ in range(200)]
+        for _ in range(50):
+            near = query
+            for bit in rng.sample(range(64), rng.randint(0, 12)):
+                near ^= 1 << bit
+            hashes.append(near)
+        Photo.objects.bulk_create(
+            Photo(
+                gallery=self.gallery,
+                title="photo",
+                description="description",
+                image="photo.jpg",
+                **similarity.hash_fields(value)
+            )
+            for value in hashes
+        )
+        photos = Photo.objects.all()
+        for distance in range(similarity.MAX_DISTANCE + 1):
+            self.assertEqual(
+                similarity.similar_photos(photos, query, distance),
+                similarity.similar_photos_scan(photos, query, distance),
+            )
+        out = StringIO()
+        call_command("benchmark_similar_photos", photos=300, queries=5, stdout=out)
+        self.assertIn("faster than a scan", out.getvalue())
+
+
+class PhotoMetadataTests(MediaRootTestMixin, APITestCase):
+    """ Test reading the EXIF of photos and listing photos by it """
+
+    def setUp(self):
+        self.user = User.objects.create(username="user1", email="user1@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user)
+        self.url = reverse(
+            "gallery:api_gallery:list_create_photos", args=[self.gallery.id]
+        )
+        self.client.force_login(self.user)
+
+    def create_photo(self, title, **metadata):
+        if "latitude" in metadata:
+            metadata["geohash"] = exif.geohash(
+                metadata["latitude"], metadata["longitude"]
+            )
+        return Photo.objects.create(
+            gallery=self.gallery, title=title, description="", **metadata
+        )
+
+    def list_titles(self, **params):
+        response = self.client.get(self.url, params, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [photo["title"] for photo in response.data["results"]]
+
+    def test_upload_reads_metadata(self):
+        """
+        Assert the capture time, camera, location and upright dimensions of an
+        uploaded image are read when it is processed.
+        """
+        metadata = Image.Exif()
+        metadata[exif.MODEL] = "Camera 1\x00"
+        metadata[exif.ORIENTATION] = 6
+        metadata[exif.EXIF_IFD] = {
+            exif.DATETIME_ORIGINAL: "2020:05:01 10:20:30",
+            exif.OFFSET_TIME_ORIGINAL: "+02:00",
+        }
+        metadata[exif.GPS_IFD] = {
+            exif.GPS_LATITUDE_REF: "S",
+            exif.GPS_LATITUDE: (33.0, 51.0, 36.0),
+            exif.GPS_LONGITUDE_REF: "E",
+            exif.GPS_LONGITUDE: (151.0, 12.0, 36.0),
+        }
+        output = BytesIO()
+        Image.new("RGB", (80, 60)).save(output, "JPEG", exif=metadata.tobytes())
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": self.gallery.id,
+            "image": SimpleUploadedFile("photo.jpg", output.getvalue(), "image/jpeg"),
+        }
+        response = self.client.post(self.url, data=data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data["taken_at"])
+        jobs.run_pending()
+
+        photo = self.client.get(self.url, format="json").data["results"][0]
+        self.assertEqual(photo["taken_at"], "2020-05-01T08:20:30Z")
+        self.assertEqual(photo["camera_model"], "Camera 1")
+        self.assertEqual((photo["width"], photo["height"]), (60, 80))
+        self.assertEqual(photo["orientation"], Photo.PORTRAIT)
+        self.assertAlmostEqual(photo["latitude"], -33.86)
+        self.assertAlmostEqual(photo["longitude"], 151.21)
+        self.assertEqual(Photo.objects.get().geohash, exif.geohash(-33.86, 151.21))
+
+        Photo.objects.update(width=None)
+        out = StringIO()
+        with self.settings(GALLERY_EXIF_LOCATION=False):
+            call_command("extract_photo_metadata", stdout=out)
+        self.assertIn("Read the metadata of 1 photo(s)", out.getvalue())
+        photo = Photo.objects.get()
+        self.assertEqual(photo.width, 60)
+        self.assertIsNone(photo.latitude)
+        self.assertIsNone(photo.geohash)
+        self.assertEqual(photo.camera_model, "Camera 1")
+
+    def test_malformed_exif(self):
+        """
+        Assert a photo whose EXIF can't be read is processed without metadata.
+        """
+        data = {
+            "title": "photo1",
+            "description": "description1",
+            "gallery": self.gallery.id,
+            "image": create_image_file(size=(80, 60)),
+        }
+        self.client.post(self.url, data=data, format="multipart")
+        with mock.patch(
+            "gallery.exif.get_ifd", side_effect=SyntaxError("not a TIFF file")
+        ):
+            jobs.run_pending()
+        photo = Photo.objects.get()
+        self.assertEqual(photo.processing_status, Photo.READY)
+        self.assertEqual((photo.width, photo.height), (80, 60))
+        self.assertIsNone(photo.taken_at)
+        self.assertIsNone(photo.camera_model)
+
+    def test_geohash(self):
+        """
+        Assert geohashes are the reference ones and grow with the latitude and
+        longitude, so the ones of a bounding box are between its corners' ones.
+        """
+        self.assertEqual(exif.geohash(57.64911, 10.40744), "u4pruydqq")
+        self.assertEqual(exif.geohash(-33.86, 151.21, 5), "r3gx2")
+        rng = random.Random(0)
+        south_west, north_east = exif.geohash(-34, 151), exif.geohash(-33.5, 151.5)
+        for _ in range(100):
+            latitude, longitude = rng.uniform(-34, -33.5), rng.uniform(151, 151.5)
+            self.assertTrue(
+                south_west <= exif.geohash(latitude, longitude) <= north_east
+            )
+
+    def test_filters_and_ordering(self):
+        """
+        Assert photos are filtered by capture time, orientation, camera and
+        location, and ordered by capture time with both paginations.
+        """
+        day = timedelta(days=1)
+        taken_at = timezone.now() - 10 * day
+        for i in range(12):
+            self.create_photo(
+                "photo%d" % i,
+                taken_at=taken_at + (i % 6) * day,
+                orientation=Photo.LANDSCAPE if i % 2 else Photo.PORTRAIT,
+                camera_model="Camera %d" % (i % 3),
+                latitude=48.85 + i / 100,
+                longitude=2.35,
+            )
+        self.create_photo("undated")
+
+        self.assertEqual(len(self.list_titles(taken_after=taken_at + 4 * day)), 4)
+        self.assertEqual(
+            self.list_titles(
+                taken_after=taken_at + day, taken_before=taken_at + 2 * day
+            ),
+            ["photo1", "photo2", "photo7", "photo8"],
+        )
+        self.assertEqual(
+            self.list_titles(orientation=Photo.PORTRAIT, camera="Camera 0"),
+            ["photo0", "photo6"],
+        )
+        self.assertEqual(
+            self.list_titles(bbox="48.875,2,48.905,3"), ["photo3", "photo4", "photo5"]
+        )
+        self.assertEqual(self.list_titles(bbox="10,2,20,3"), [])
+
+        self.assertEqual(self.list_titles(dated="false"), ["undated"])
+        newest_first = ["photo%d" % i for i in (11, 5, 10, 4, 9, 3, 8, 2, 7, 1, 6, 0)]
+        self.assertEqual(
+            self.list_titles(ordering="-taken_at", dated="true"), newest_first[:10]
+        )
+        self.assertEqual(
+            self.list_titles(ordering="-taken_at", dated="true", page=2),
+            newest_first[10:],
+        )
+        response = self.client.get(
+            self.url,
+            {"ordering": "-taken_at", "dated": "true", "pagination": "cursor"},
+            format="json",
+        )
+        titles = [photo["title"] for photo in response.data["results"]]
+        response = self.client.get(response.data["next"], format="json")
+        titles += [photo["title"] for photo in response.data["results"]]
+        self.assertEqual(titles, newest_first)
+        self.assertEqual(self.list_titles(ordering="-id")[0], "undated")
+
+        for params in (
+            {"bbox": "1,2,3"},
+            {"bbox": "50,2,40,3"},
+            {"orientation": "round"},
+            {"ordering": "title"},
+            {"ordering": "taken_at"},
+            {"ordering": "taken_at", "dated": "false"},
+            {"taken_after": "yesterday"},
+        ):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params, format="json")
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(connection.vendor == "sqlite", "Reads SQLite query plans")
+    def test_query_plans(self):
+        """
+        Assert filtered and ordered listings read the metadata indexes.
+        """
+        self.create_photo(
+            "photo1",
+            taken_at=timezone.now(),
+            orientation=Photo.SQUARE,
+            camera_model="Camera 1",
+            latitude=48.85,
+            longitude=2.35,
+        )
+        for params, index in (
+            (
+                {"ordering": "-taken_at", "dated": "true"},
+                "gallery_pho_gallery_99fdf3_idx",
+            ),
+            ({"orientation": Photo.SQUARE}, "gallery_pho_gallery_049290_idx"),
+            ({"camera": "Camera 1"}, "gallery_pho_gallery_c5588a_idx"),
+            ({"bbox": "48.8,2.3,48.9,2.4"}, "gallery_pho_gallery_6b8c39_idx"),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.list_titles(**params)
+            sql = [
+                query["sql"]
+                for query in queries
+                if query["sql"].startswith('SELECT "gallery_photo"."id"')
+            ][0]
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = " ".join(row[-1] for row in cursor.fetchall())
+            with self.subTest(**params):
+                self.assertIn(index, plan)
+
+
+class PhotoSearchTests(MediaRootTestMixin, APITestCase):
+    """ Test the photo search index and api """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.public_gallery = Gallery.objects.create(name="public", user=self.user1)
+        self.private_gallery = Gallery.objects.create(
+            name="private", user=self.user2, public=False
+        )
+        self.photos = {
+            name: Photo.objects.create(
+                gallery=gallery, title=title, description=description, image="a.jpg"
+            )
+            for name, gallery, title, description in (
+                ("beach", self.public_gallery, "Beach", "Sunset at the beach, beach!"),
+                ("sunset", self.public_gallery, "Sunset", "Over the beach"),
+                ("cafe", self.public_gallery, "Café", "Morning coffee"),
+                ("private", self.private_gallery, "Private beach", "sunset"),
+            )
+        }
+        self.url = reverse("gallery:api_gallery:search_photos")
+        self.client.force_login(self.user1)
+
+    def search(self, query, **params):
+        response = self.client.get(self.url, dict(params, q=query), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = {photo.pk: name for name, photo in self.photos.items()}
+        return [names.get(photo["id"]) for photo in response.data["results"]]
+
+    def backends(self):
+        """ Run the block with every search backend the database has. """
+        backends = [search.PYTHON]
+        if search.get_backend() == search.FTS5:
+            backends.append(search.FTS5)
+        for backend in backends:
+            with self.subTest(backend=backend), self.settings(
+                GALLERY_SEARCH_BACKEND=backend
+            ):
+                search.rebuild()
+                yield backend
+
+    def test_search(self):
+        """
+        Assert photos having all words are found best match first, among the
+        photos the user can view, and the index follows changes of photos.
+        """
+        for _ in self.backends():
+            self.assertEqual(self.search("beach"), ["beach", "sunset"])
+            self.assertEqual(self.search("SUNSET beach"), ["beach", "sunset"])
+            self.assertEqual(self.search("cafe"), ["cafe"])
+            self.assertEqual(self.search("café coffee morning"), ["cafe"])
+            self.assertEqual(self.search("beach coffee"), [])
+            self.assertEqual(self.search("beach", gallery=self.private_gallery.id), [])
+            self.client.force_login(self.user2)
+            self.assertEqual(self.search("private"), ["private"])
+            self.assertEqual(
+                self.search("sunset", gallery=self.private_gallery.id), ["private"]
+            )
+            self.client.force_login(self.user1)
+
+            photo = self.photos["cafe"]
+            photo.description = "Coffee at the beach"
+            photo.save()
+            self.assertEqual(self.search("beach coffee"), ["cafe"])
+            photo.description = "Morning coffee"
+            photo.save(update_fields=["description"])
+            self.photos["sunset"].delete()
+            self.assertEqual(self.search("beach"), ["beach"])
+            self.photos["sunset"] = Photo.objects.create(
+                gallery=self.public_gallery,
+                title="Sunset",
+                description="Over the beach",
+                image="a.jpg",
+            )
+
+        response = self.client.get(self.url, {"q": " ,!"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_created_photos(self):
+        """
+        Assert photos created in bulk are indexed.
+        """
+        for _ in self.backends():
+            gallery = Gallery.objects.create(name="bulk", user=self.user1)
+            items = [
+                {
+                    "title": "Bulk %d" % i,
+                    "description": "Lighthouse",
+                    "image": create_image_file(size=(800 + i, 600)),
+                }
+                for i in range(3)
+            ]
+            bulk_uploads.create_photos(gallery, items)
+            response = self.client.get(self.url, {"q": "lighthouse"}, format="json")
+            self.assertEqual(response.data["count"], 3)
+            gallery.delete()
+
+    @skipUnless(connection.vendor == "sqlite", "Reads SQLite query plans")
+    def test_query_plans(self):
+        """
+        Assert searches read the index instead of scanning the photos.
+        """
+        photos = Photo.objects.filter(
+            Q(gallery__public=True) | Q(gallery__user=self.user1)
+        )
+        for backend in self.backends():
+            found = search.search(photos, ["sunset", "beach"])
+            sql, params = found.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if step.startswith("SCAN gallery_photo ")]
+            self.assertEqual(scans, [], plan)
+            if backend == search.FTS5:
+                self.assertIn("VIRTUAL TABLE", plan[0])
+            else:
+                self.assertIn("gallery_photosearchterm", plan[0])
+
+    def test_benchmark_command(self):
+        """
+        Assert the benchmark command compares the index with a scan.
+        """
+        out = StringIO()
+        call_command(
+            "benchmark_search", photos=[50, 100], queries=3, matches=2, stdout=out
+        )
+        self.assertIn("100 photos: index", out.getvalue())
+        self.assertIn("scan", out.getvalue())
+
+
+class SyntheticDataTests(MediaRootTestMixin, APITestCase):
+    """ Test the synthetic data generator and the api benchmark """
+
+    def generate(self, **options):
+        options = dict(
+            users=20,
+            galleries=10,
+            photos=200,
+            photo_likes=1000,
+            gallery_likes=50,
+            images=3,
+            stdout=StringIO(),
+            **options
+        )
+        call_command("generate_data", **options)
+
+    def test_generate_data(self):
+        """
+        Assert generated objects are consistent and likes follow a power law.
+        """
+        self.generate()
+        users = User.objects.filter(username__startswith="synthetic")
+        self.assertEqual(users.count(), 20)
+        self.assertEqual(Gallery.objects.count(), 10)
+        self.assertEqual(Photo.objects.count(), 200)
+        names = set(Photo.objects.values_list("image", flat=True))
+        names.update(PhotoRendition.objects.values_list("image", flat=True))
+        self.assertEqual(len(names), Blob.objects.count())
+        self.assertEqual(
+            sum(Blob.objects.values_list("refcount", flat=True)),
+            Photo.objects.count() + PhotoRendition.objects.count(),
+        )
+        likes = sorted(Photo.objects.values_list("likes_count", flat=True))
+        self.assertEqual(sum(likes), PhotoLike.objects.count())
+        self.assertGreater(likes[-1], 5 * sum(likes) / len(likes))
+        out = StringIO()
+        call_command("reconcile_likes_count", "--dry-run", stdout=out)
+        self.assertEqual(out.getvalue().count(" 0 object(s)"), 2)
+        self.assertTrue(TrendingPhoto.objects.filter(listed=True).exists())
+        with self.assertRaises(CommandError):
+            self.generate()
+
+    def test_benchmark_api(self):
+        """
+        Assert the benchmark reports every endpoint as JSON and leaves likes as
+        they were.
+        """
+        self.generate()
+        likes = PhotoLike.objects.count()
+        path = os.path.join(self.media_root, "report.json")
+        call_command(
+            "benchmark_api",
+            requests=4,
+            warmup=1,
+            label="test",
+            setting=[("GALLERY_RESPONSE_CACHE_TIMEOUT", 0)],
+            output=path,
+            stdout=StringIO(),
+        )
+        with open(path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report["label"], "test")
+        self.assertEqual(report["settings"], {"GALLERY_RESPONSE_CACHE_TIMEOUT": 0})
+        self.assertEqual(report["data"]["photos"], 200)
+        self.assertEqual(len(report["endpoints"]), 7)
+        for result in report["endpoints"].values():
+            self.assertEqual(result["requests"], 4)
+            self.assertEqual(result["errors"], 0)
+            self.assertGreater(result["queries_per_request"], 0)
+            self.assertLessEqual(
+                result["latency_ms"]["p50"], result["latency_ms"]["p99"]
+            )
+        self.assertEqual(PhotoLike.objects.count(), likes)
+
+
+class BulkPhotoUploadTests(MediaRootTestMixin, APITestCase):
+    """ Test creating many photos in one request """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.url = reverse(
+            "gallery:api_gallery:bulk_create_photos", args=[self.gallery.id]
+        )
+        self.client.force_login(self.user1)
+
+    def post(self, photos):
+        data = {
+            "title": [title for title, _, _ in photos],
+            "description": [description for _, description, _ in photos],
+            "image": [image for _, _, image in photos],
+        }
+        return self.client.post(self.url, data=data, format="multipart")
+
+    def test_bulk_upload(self):
+        """
+        Assert valid photos are created with one INSERT and queued for processing,
+        and invalid ones are reported with their index.
+        """
+        photos = [
+            ("photo%d" % i, "description%d" % i, create_image_file("photo%d.jpg" % i))
+            for i in range(3)
+        ]
+        broken = SimpleUploadedFile("broken.jpg", b"not an image")
+        photos.append(("broken", "description", broken))
+        photos.append(("", "description", create_image_file()))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(photos)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data["results"]
+        self.assertEqual([result["index"] for result in results], list(range(5)))
+        self.assertEqual(
+            [result["status"] for result in results], [201, 201, 201, 400, 400]
+        )
+        self.assertIn("image", results[3]["errors"])
+        self.assertIn("title", results[4]["errors"])
+        self.assertEqual(
+            [result["photo"]["title"] for result in results[:3]],
+            ["photo0", "photo1", "photo2"],
+        )
+        photo_inserts = [
+            query
+            for query in queries
+            if query["sql"].startswith('INSERT INTO "gallery_photo"')
+        ]
+        self.assertEqual(len(photo_inserts), 1)
+
+        photos = Photo.objects.filter(gallery=self.gallery)
+        self.assertEqual(photos.count(), 3)
+        self.assertEqual(
+            sorted(json.loads(job.arguments)["photo_id"] for job in Job.objects.all()),
+            sorted(photos.values_list("pk", flat=True)),
+        )
+        # the three images are identical
+        self.assertEqual(Blob.objects.get().refcount, 3)
+        self.assertEqual(jobs.run_pending(), 3)
+        self.assertEqual(photos.filter(processing_status=Photo.READY).count(), 3)
+
+    def test_bulk_upload_auth_and_perm(self):
+        """
+        Assert only the gallery owner can upload photos and a request with all
+        photos invalid is rejected.
+        """
+        photo = ("photo", "description", create_image_file())
+        self.client.force_login(self.user2)
+        self.assertEqual(self.post([photo]).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.user1)
+        response = self.post([("", "description", create_image_file())])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            self.url,
+            data={
+                "title": ["a", "b"],
+                "description": ["c"],
+                "image": [create_image_file()],
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Photo.objects.exists())
+
+
+class PhotoUploadTests(MediaRootTestMixin, APITestCase):
+    """ Test chunked photo uploads """
+
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1", email="user1@test.com")
+        self.user2 = User.objects.create(username="user2", email="user2@test.com")
+        self.gallery = Gallery.objects.create(name="gallery1", user=self.user1)
+        self.content = create_image_file().read()
+        self.client.force_login(self.user1)
+
+    def start_upload(self, **data):
+        url = reverse("gallery:api_gallery:create_photo_upload", args=[self.gallery.id])
+        data = dict(
+            {
+                "title": "photo1",
+                "description": "description1",
+                "filename": "photo1.jpg",
+                "size": len(self.content),
+                "checksum": hashlib.sha256(self.content).hexdigest(),
+            },
+            **data
+        )
+        return self.client.post(url, data=data, format="json")
+
+    def send_chunk(self, upload_id, first, last, **headers):
+        url = reverse("gallery:api_gallery:photo_upload", args=[upload_id])
+        return self.client.put(
+            url,
+            data=self.content[first : last + 1],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE="bytes %d-%d/%d" % (first, last, len(self.content)),
+            **headers
+        )
+
+    def finish(self, upload_id):
+        url = reverse("gallery:api_gallery:finish_photo_upload", args=[upload_id])
+        return self.client.post(url, format="json")
+
+    def test_chunked_upload(self):
+        """
+        Assert an image sent in chunks is written in place and becomes a photo
+        waiting to be processed, and the upload can be resumed after a bad chunk.
+        """
+        response = self.start_upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data["id"]
+        middle = len(self.content) // 2
+        response = self.send_chunk(upload_id, 0, middle - 1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["received"], middle)
+        # finishing too early fails
+        self.assertEqual(
+            self.finish(upload_id).status_code, status.HTTP_400_BAD_REQUEST
+        )
+        # chunk not starting where the last one ended
+        response = self.send_chunk(upload_id, middle + 1, len(self.content) - 1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["received"], middle)
+        # chunk not matching its checksum
+        response = self.send_chunk(
+            upload_id, middle, len(self.content) - 1, HTTP_X_CHUNK_SHA256="0" * 64
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        chunk = self.content[middle:]
+        response = self.send_chunk(
+            upload_id,
+            middle,
+            len(self.content) - 1,
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(chunk).hexdigest(),
+        )
+        self.assertEqual(response.data["received"], len(self.content))
+        response = self.finish(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["processing_status"], Photo.PENDING)
+        photo = Photo.objects.get()
+        self.assertEqual(
+            photo.image.name,
+            blob_storage.blob_name(hashlib.sha256(self.content).hexdigest(), ".jpg"),
+        )
+        with photo.image.open("rb") as image_file:
+            self.assertEqual(image_file.read(), self.content)
+        self.assertEqual(Blob.objects.get(name=photo.image.name).refcount, 1)
+        self.assertFalse(PhotoUpload.objects.exists())
+        self.assertEqual(Job.objects.get().name, "process_photo")
+
+    def test_upload_checksum_mismatch(self):
+        """
+        Assert an image that doesn't match the announced checksum isn't accepted.
+        """
+        response = self.start_upload(checksum="a" * 64)
+        upload_id = response.data["id"]
+        self.send_chunk(upload_id, 0, len(self.content) - 1)
+        self.assertEqual(
+            self.finish(upload_id).status_code, status.HTTP_400_BAD_REQUEST
+        )
+        self.assertFalse(Photo.objects.exists())
+
+    def test_concurrent_bad_chunk(self):
+        """
+        Assert a bad chunk sent at the offset a good chunk was just written at
+        doesn't cut off the good data.
+        """
+        upload = PhotoUpload.objects.get(pk=self.start_upload().data["id"])
+        middle = len(self.content) // 2
+        stale = PhotoUpload.objects.get(pk=upload.pk)
+        uploads.append_chunk(upload, 0, BytesIO(self.content[:middle]), middle)
+        with self.assertRaises(uploads.UploadError):
+            uploads.append_chunk(
+                stale, 0, BytesIO(b"x" * middle), middle, checksum="0" * 64
+            )
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.append_chunk(stale, 0, BytesIO(b"x" * middle), middle)
+        with open(default_storage.path(upload.path), "rb") as image_file:
+            self.assertEqual(image_file.read(), self.content[:middle])
+
+    def test_running_checksum(self):
+        """
+        Assert finishing checks the digest kept while chunks were appended
+        without reading the file again, and hashes the file when the digest
+        was kept by another process.
+        """
+        upload_id = self.start_upload().data["id"]
+        middle = len(self.content) // 2
+        self.send_chunk(upload_id, 0, middle - 1)
+        # the next chunk reaches a process that doesn't have the digest
+        uploads.running_digests.clear()
+        self.send_chunk(upload_id, middle, len(self.content) - 1)
+        with mock.patch(
+            "gallery.uploads.open", side_effect=AssertionError, create=True
+        ):
+            response = self.finish(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_concurrent_finish(self):
+        """
+        Assert an upload finished by another request can't be finished again,
+        and an upload whose photo couldn't be created keeps its file for a retry.
+        """
+        upload_id = self.start_upload().data["id"]
+        self.send_chunk(upload_id, 0, len(self.content) - 1)
+        stale = PhotoUpload.objects.get(pk=upload_id)
+        with mock.patch.object(jobs, "enqueue", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                uploads.finish_upload(PhotoUpload.objects.get(pk=upload_id))
+        with open(default_storage.path(stale.path), "rb") as image_file:
+            self.assertEqual(image_file.read(), self.content)
+        self.assertFalse(Photo.objects.exists())
+
+        self.assertEqual(self.finish(upload_id).status_code, status.HTTP_201_CREATED)
+        with self.assertRaises(uploads.UploadGone):
+            uploads.finish_upload(stale)
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_finish_methods(self):
+        """
+        Assert the finish url only finishes uploads, it doesn't take chunks nor
+        cancel uploads.
+        """
+        upload_id = self.start_upload().data["id"]
+        url = reverse("gallery:api_gallery:finish_photo_upload", args=[upload_id])
+        response = self.client.put(
+            url, data=self.content, content_type="application/octet-stream"
+        )
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(PhotoUpload.objects.get().received, 0)
+
+    def test_upload_auth_and_perm(self):
+        """
+        Assert only the gallery owner can start an upload and only the user who
+        started it can send chunks to it.
+        """
+        self.client.force_login(self.user2)
+        self.assertEqual(self.start_upload().status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.user1)
+        upload_id = self.start_upload().data["id"]
+        self.client.force_login(self.user2)
+        response = self.send_chunk(upload_id, 0, len(self.content) - 1)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
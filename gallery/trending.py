@@ -0,0 +1,140 @@
+""" Trending photos ranking.
+
+Every like adds a weight of 2 ** ((liked_at - EPOCH) / half life) to the score of
+the liked photo, so a like counts half as much as one that happens a half life
+later. Ranking by the sum of weights is the same as ranking by likes decayed to
+the current time, but a score never has to be touched again unless the photo
+gets (un)liked. Scores are stored as the natural log of the sum to keep them
+in float range.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import response_cache
+from .models import Photo, PhotoLike, TrendingPhoto
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def get_half_life():
+    """ Seconds it takes a like to lose half of its weight. """
+    return getattr(settings, "GALLERY_TRENDING_HALF_LIFE", 24 * 60 * 60)
+
+
+def get_min_likes():
+    """ Number of likes a photo needs to be listed as trending. """
+    return getattr(settings, "GALLERY_TRENDING_MIN_LIKES", 3)
+
+
+def like_weight(liked_at):
+    """ Log of the weight of a like that happened at liked_at. """
+    return (liked_at - EPOCH).total_seconds() * math.log(2) / get_half_life()
+
+
+def log_add(a, b):
+    """ log(exp(a) + exp(b)) without overflowing. """
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def log_sub(a, b):
+    """ log(exp(a) - exp(b)) or None if nothing is left of a. """
+    if a is None or b >= a:
+        return None
+    return a + math.log1p(-math.exp(b - a))
+
+
+def is_listed(likes_count, public):
+    return public and likes_count >= get_min_likes()
+
+
+def update_scores(likes, combine):
+    """ Combine the weights of likes ((photo_id, liked_at) pairs) into the stored
+        score of their photos and refresh whether the photos are listed.
+        Photos left without any like are dropped from the ranking. The cached
+        listing is invalidated only if a photo was or becomes listed, likes of
+        photos that aren't trending don't change it.
+    """
+    weights = defaultdict(list)
+    for photo_id, liked_at in likes:
+        weights[photo_id].append(like_weight(liked_at))
+    if not weights:
+        return
+
+    with transaction.atomic():
+        trends = TrendingPhoto.objects.select_for_update().in_bulk(list(weights))
+        photos = Photo.objects.filter(pk__in=list(weights)).values_list(
+            "pk", "likes_count", "gallery__public"
+        )
+        listing_changed = False
+        for photo_id, likes_count, public in photos:
+            trend = trends.get(photo_id)
+            score = trend.score if trend else None
+            listing_changed = listing_changed or bool(trend and trend.listed)
+            for weight in weights[photo_id]:
+                score = combine(score, weight)
+            if score is None or likes_count == 0:
+                if trend:
+                    trend.delete()
+                continue
+            listed = is_listed(likes_count, public)
+            listing_changed = listing_changed or listed
+            if trend:
+                trend.score, trend.listed = score, listed
+                trend.save()
+            else:
+                TrendingPhoto.objects.create(
+                    photo_id=photo_id, score=score, listed=listed
+                )
+        if listing_changed:
+            response_cache.invalidate(response_cache.TRENDING)
+
+
+def add_likes(likes):
+    update_scores(likes, log_add)
+
+
+def remove_likes(likes):
+    update_scores(likes, log_sub)
+
+
+def update_gallery_listing(gallery):
+    """ List or unlist the trending photos of gallery after its visibility changed. """
+    response_cache.invalidate(response_cache.TRENDING)
+    trends = TrendingPhoto.objects.filter(photo__gallery_id=gallery.pk)
+    if gallery.public:
+        trends.filter(photo__likes_count__gte=get_min_likes()).update(listed=True)
+        trends.filter(photo__likes_count__lt=get_min_likes()).update(listed=False)
+    else:
+        trends.update(listed=False)
+
+
+def rebuild():
+    """ Recompute the whole ranking from the likes table. """
+    scores = {}
+    likes = PhotoLike.objects.order_by().values_list("photo_id", "created_at")
+    for photo_id, liked_at in likes.iterator():
+        scores[photo_id] = log_add(scores.get(photo_id), like_weight(liked_at))
+    photos = Photo.objects.filter(likes_count__gt=0).values_list(
+        "pk", "likes_count", "gallery__public"
+    )
+    with transaction.atomic():
+        TrendingPhoto.objects.all().delete()
+        TrendingPhoto.objects.bulk_create(
+            TrendingPhoto(
+                photo_id=photo_id,
+                score=scores[photo_id],
+                listed=is_listed(likes_count, public),
+            )
+            for photo_id, likes_count, public in photos.iterator()
+            if photo_id in scores
+        )
+    response_cache.invalidate(response_cache.TRENDING)
+    return len(scores)
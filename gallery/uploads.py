@@ -0,0 +1,228 @@
+""" Resumable chunked photo uploads.
+
+An upload is started with the size and SHA-256 checksum of the image, then the
+image is sent in consecutive chunks which are streamed to a temporary file,
+and finally finished, which checks the file, moves it into the content
+addressed blob_storage and creates the photo.
+Neither a chunk nor the image is ever held in memory as a whole, and a client
+that lost its connection asks for the received size and carries on from there.
+Chunks are written with the local path of the file, so the storage must be a
+FileSystemStorage.
+
+A chunk is first streamed to a temporary file and checked, so a bad chunk never
+touches the upload file. It is then copied into the upload file while the row
+of the upload is locked by the update of its received size, so two requests
+sending a chunk at the same offset can't write over each other.
+The SHA-256 of the image is kept running as chunks are appended, so finishing
+doesn't read the file again. hashlib can't store the state of a digest in the
+database, it is kept in memory by the process that appended the last chunk; a
+chunk or a finish reaching another process hashes the received bytes again.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import jobs
+from .models import Photo, PhotoUpload
+from .storage import blob_storage
+
+# bytes read from the request or the file at once
+BLOCK_SIZE = 64 * 1024
+# running digests kept in memory, the ones of the least recent uploads are dropped
+MAX_RUNNING_DIGESTS = 1000
+
+# upload pk -> (bytes hashed, SHA-256 of them)
+running_digests = OrderedDict()
+running_digests_lock = threading.Lock()
+
+
+class UploadError(ValueError):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """ A chunk doesn't start where the last one ended. """
+
+
+class UploadGone(UploadError):
+    """ The upload was finished or cancelled by another request. """
+
+
+def get_max_size():
+    return getattr(settings, "GALLERY_UPLOAD_MAX_SIZE", 200 * 1024 * 1024)
+
+
+def start_upload(user, gallery, title, description, filename, size, checksum):
+    """ Create an upload and the empty file its chunks will be written to. """
+    if size > get_max_size():
+        raise UploadError("Image is larger than %d bytes." % get_max_size())
+    upload = PhotoUpload(
+        user=user,
+        gallery=gallery,
+        title=title,
+        description=description,
+        filename=filename,
+        size=size,
+        checksum=checksum.lower(),
+    )
+    upload.path = default_storage.save(
+        "uploads/{0}{1}".format(upload.pk, os.path.splitext(filename)[1]),
+        ContentFile(b""),
+    )
+    upload.save()
+    return upload
+
+
+def running_digest(upload, offset):
+    """ SHA-256 of the first offset bytes of the upload file, the running one if
+        this process appended the last chunk, else hashed from the file.
+    """
+    with running_digests_lock:
+        hashed, digest = running_digests.pop(upload.pk, (None, None))
+    if hashed == offset:
+        return digest
+    digest = hashlib.sha256()
+    remaining = offset
+    with open(default_storage.path(upload.path), "rb") as image_file:
+        while remaining:
+            block = image_file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest
+
+
+def keep_running_digest(upload, hashed, digest):
+    with running_digests_lock:
+        running_digests[upload.pk] = (hashed, digest)
+        while len(running_digests) > MAX_RUNNING_DIGESTS:
+            running_digests.popitem(last=False)
+
+
+def drop_running_digest(upload):
+    with running_digests_lock:
+        running_digests.pop(upload.pk, None)
+
+
+def append_chunk(upload, offset, stream, length, checksum=None):
+    """ Write length bytes read from stream at offset of the upload file.
+        offset must be the number of bytes received so far. If checksum (SHA-256
+        hex digest of the chunk) is given and doesn't match, the chunk is dropped.
+    """
+    if offset != upload.received:
+        raise OffsetMismatch("Next chunk must start at byte %d." % upload.received)
+    if offset + length > upload.size:
+        raise UploadError("Chunk goes past the announced size of the image.")
+
+    with tempfile.TemporaryFile() as chunk_file:
+        chunk_digest = hashlib.sha256()
+        written = 0
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            chunk_digest.update(block)
+            chunk_file.write(block)
+            written += len(block)
+        if written != length or (
+            checksum and checksum.lower() != chunk_digest.hexdigest()
+        ):
+            raise UploadError("Chunk is incomplete or doesn't match its checksum.")
+
+        with transaction.atomic():
+            # locks the row until the chunk is written, another request may
+            # have written the same chunk in the meantime
+            if not PhotoUpload.objects.filter(pk=upload.pk, received=offset).update(
+                received=offset + length
+            ):
+                upload.refresh_from_db()
+                raise OffsetMismatch(
+                    "Next chunk must start at byte %d." % upload.received
+                )
+            digest = running_digest(upload, offset)
+            chunk_file.seek(0)
+            with open(default_storage.path(upload.path), "r+b") as image_file:
+                image_file.seek(offset)
+                for block in iter(lambda: chunk_file.read(BLOCK_SIZE), b""):
+                    digest.update(block)
+                    image_file.write(block)
+                image_file.truncate(offset + length)
+    # a digest left from a rolled back chunk doesn't match the received size
+    keep_running_digest(upload, offset + length, digest)
+    upload.received = offset + length
+    return upload
+
+
+def finish_upload(upload):
+    """ Check the uploaded image and create its photo, the file is moved (not
+        copied) into blob_storage. Processing of the photo is left to the
+        background worker.
+        The upload row is deleted first, which locks it until the photo is
+        created, so a concurrent finish or cancel of the same upload finds it
+        gone. If the photo can't be created, the file is put back for a retry
+        and the blob is left to the garbage collector (see gallery.blobs).
+    """
+    if upload.received != upload.size:
+        raise UploadError("Received %d of %d bytes." % (upload.received, upload.size))
+    path = default_storage.path(upload.path)
+    name = None
+    try:
+        with transaction.atomic():
+            if not PhotoUpload.objects.filter(pk=upload.pk).delete()[0]:
+                raise UploadGone("Upload was finished or cancelled.")
+            if running_digest(upload, upload.size).hexdigest() != upload.checksum:
+                raise UploadError("Image doesn't match its checksum.")
+            try:
+                name = blob_storage.adopt(
+                    path, upload.checksum, os.path.splitext(path)[1]
+                )
+            except FileNotFoundError:
+                raise UploadGone("Upload was finished or cancelled.")
+            photo = Photo(
+                gallery=upload.gallery,
+                title=upload.title,
+                description=upload.description,
+                processing_status=Photo.PENDING,
+            )
+            photo.image.name = name
+            photo.save()
+            jobs.enqueue("process_photo", photo_id=photo.pk)
+    except Exception:
+        if name is not None:
+            # the blob may be shared with another photo, copy it back
+            shutil.copyfile(blob_storage.path(name), path)
+        raise
+    drop_running_digest(upload)
+    return photo
+
+
+def cancel_upload(upload):
+    """ Delete an upload and its file, unless it was finished or cancelled by a
+        concurrent request.
+    """
+    drop_running_digest(upload)
+    if PhotoUpload.objects.filter(pk=upload.pk).delete()[0]:
+        default_storage.delete(upload.path)
+
+
+def delete_stale_uploads(max_age):
+    """ Cancel uploads started more than max_age seconds ago. """
+    stale = PhotoUpload.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=max_age)
+    )
+    count = 0
+    for upload in stale.iterator():
+        cancel_upload(upload)
+        count += 1
+    return count
@@ -1,7 +1,10 @@
 from django.urls import include, path
 
+from gallery import views
+
 app_name = "gallery"
 
 urlpatterns = [
     path("api/", include("gallery.api.urls", namespace="api_gallery")),
+    path("metrics/", views.metrics_view, name="metrics"),
 ]
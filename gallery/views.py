@@ -1,3 +1,70 @@
-from django.shortcuts import render
+import os
 
-# Create your views here.
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import media, metrics
+from .storage import blob_storage
+
+# a year, the longest max-age caches are expected to honor
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def serve_media(request, path):
+    """ Serve a photo image or rendition to the users allowed to view it, or to
+        anyone with a signed URL of it, see gallery.media. Files nobody may view
+        (or no photo uses) are missing.
+        Content addressed files (see gallery.storage) never change, so they may
+        be cached forever and their ETag is the digest in their name, which
+        answers If-None-Match without touching the file. Other files must be
+        revalidated with If-Modified-Since. Files of private galleries may only
+        be kept by the cache of the user.
+    """
+    if media.check_signature(
+        path, request.GET.get("expires"), request.GET.get("signature")
+    ):
+        # signed for a photo of a private gallery
+        visibility = media.PRIVATE
+    else:
+        visibility = media.get_visibility(request.user, path)
+    if visibility is None:
+        raise Http404
+    etag = last_modified = None
+    try:
+        if blob_storage.is_blob(path):
+            etag = quote_etag(os.path.splitext(os.path.basename(path))[0])
+        else:
+            last_modified = int(os.stat(blob_storage.path(path)).st_mtime)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = media.send_file(request, path, etag, last_modified)
+    except FileNotFoundError:
+        raise Http404
+
+    # the visibility is also the cache-control directive, public or private
+    if etag is None:
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True, **{visibility: True})
+        return response
+    response["ETag"] = etag
+    patch_cache_control(
+        response, max_age=IMMUTABLE_MAX_AGE, immutable=True, **{visibility: True}
+    )
+    return response
+
+
+def metrics_view(request):
+    """ Request metrics of this process in the Prometheus text format, for staff
+        users and the INTERNAL_IPS (e.g. the Prometheus server).
+    """
+    internal = request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+    if not (request.user.is_staff or internal):
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.registry.render(), content_type="text/plain; version=0.0.4"
+    )
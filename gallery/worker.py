@@ -0,0 +1,22 @@
+""" Entry points of run_worker pool processes.
+
+Pool processes are spawned, so this module is imported before django is set
+up and must not import models at module level.
+"""
+
+
+def setup_worker_process():
+    import django
+
+    django.setup()
+
+
+def run_job(job_id):
+    from django.db import connections
+
+    from . import jobs
+
+    try:
+        return job_id, jobs.run(job_id)
+    finally:
+        connections.close_all()
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "gallery.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -124,3 +125,72 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
 }
+
+# Gallery
+
+# seconds it takes a like to lose half of its weight in the trending photos score
+GALLERY_TRENDING_HALF_LIFE = 24 * 60 * 60
+# number of likes a photo of a public gallery needs to be listed as trending
+GALLERY_TRENDING_MIN_LIKES = 3
+# resized copies generated for every uploaded photo: name -> max (width, height)
+# and the image formats to save it in
+GALLERY_RENDITIONS = {
+    "thumbnail": {"size": (320, 320), "formats": ["JPEG", "WEBP"]},
+    "medium": {"size": (1280, 1280), "formats": ["JPEG", "WEBP"]},
+}
+GALLERY_RENDITION_QUALITY = 80
+# seconds a run_worker process may run a job before it is considered dead and
+# the job is run again
+GALLERY_JOBS_LEASE = 10 * 60
+# seconds before a failed job is retried, doubled on every retry
+GALLERY_JOBS_RETRY_DELAY = 30
+# maximum size in bytes of a photo sent with a chunked upload
+GALLERY_UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+# default maximum number of differing bits of the perceptual hashes of similar
+# photos (at most 11)
+GALLERY_SIMILAR_MAX_DISTANCE = 10
+# seconds the owner and visibility of galleries checked by permissions are cached
+# across requests, 0 disables the cache
+GALLERY_ACCESS_CACHE_TIMEOUT = 0
+# seconds pages of the public galleries and trending photos listings are cached,
+# 0 disables the cache. They are kept in a local memory LRU cache of at most
+# GALLERY_RESPONSE_CACHE_MAX_ENTRIES pages, unless GALLERY_RESPONSE_CACHE names
+# one of CACHES to use instead. The LRU cache is per process: with several worker
+# processes, set GALLERY_RESPONSE_CACHE to a cache they share, or a process keeps
+# serving pages another one invalidated until they expire.
+GALLERY_RESPONSE_CACHE_TIMEOUT = 60
+GALLERY_RESPONSE_CACHE_MAX_ENTRIES = 1000
+GALLERY_RESPONSE_CACHE = None
+# maximum number of photos of a bulk upload, and threads validating and storing
+# their images
+GALLERY_BULK_UPLOAD_MAX_PHOTOS = 100
+GALLERY_BULK_UPLOAD_WORKERS = 4
+# threads running views under ASGI (see gallery.asgi), which bounds the number of
+# database connections of an ASGI process
+GALLERY_ASGI_THREADS = 16
+# fraction of the requests whose latency, queries, serialize and render time are
+# recorded (see gallery.metrics), served in the Prometheus format at /gallery/metrics/
+# to staff users and INTERNAL_IPS. 0 disables the measures.
+GALLERY_METRICS_SAMPLE_RATE = 0
+# seconds after which a measured request is logged with its slowest and repeated
+# queries, None disables the log
+GALLERY_METRICS_SLOW_REQUEST = None
+# how photo images and renditions are sent once the request user is allowed to
+# view them (see gallery.media): "django" streams them in chunks of
+# GALLERY_MEDIA_CHUNK_SIZE bytes (with os.sendfile under servers providing
+# wsgi.file_wrapper), "x-accel-redirect" leaves it to nginx from the internal
+# location GALLERY_MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT, "x-sendfile" to
+# Apache mod_xsendfile or lighttpd
+GALLERY_MEDIA_BACKEND = "django"
+GALLERY_MEDIA_ACCEL_PREFIX = "/protected-media/"
+GALLERY_MEDIA_CHUNK_SIZE = 64 * 1024
+# images of photos of private galleries have signed URLs, valid for at least
+# that many seconds and at most twice as long
+GALLERY_MEDIA_URL_MAX_AGE = 60 * 60
+# index searched by the photo search (see gallery.search): "fts5" (SQLite with
+# FTS5) or "python", chosen from the database when None. Run
+# rebuild_search_index after changing it.
+GALLERY_SEARCH_BACKEND = None
+# whether the GPS location of photos is read from their EXIF and stored, with the
+# capture time, camera and dimensions (see gallery.exif)
+GALLERY_EXIF_LOCATION = True